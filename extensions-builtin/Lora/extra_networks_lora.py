@@ -1,4 +1,4 @@
-from modules import extra_networks, shared
+from modules import extra_networks, shared, metrics
 import networks
 
 
@@ -42,7 +42,8 @@ class ExtraNetworkLora(extra_networks.ExtraNetwork):
             unet_multipliers.append(unet_multiplier)
             dyn_dims.append(dyn_dim)
 
-        networks.load_networks(names, te_multipliers, unet_multipliers, dyn_dims)
+        with metrics.lora_patch.time():
+            networks.load_networks(names, te_multipliers, unet_multipliers, dyn_dims)
 
         if shared.opts.lora_add_hashes_to_infotext:
             if not getattr(p, "is_hr_pass", False) or not hasattr(p, "lora_hashes"):
@@ -0,0 +1,184 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import safetensors.torch
+
+from modules import shared, errors
+from modules.paths_internal import data_path
+
+cache_dir = os.path.join(data_path, "cache", "fused-lora-weights")
+
+
+class FusedWeights:
+    """
+    Weights of one model (UNet or CLIP) with one combination of Loras already applied, keyed by weight name.
+
+    Attached to a ModelPatcher as the "fused_weights" attachment; ModelPatcher.patch_weight_to_device uses it to copy
+    weights that were already calculated instead of applying the Lora patches again. It is only valid for the patches
+    the model had when it was attached, which is checked with patches_uuid.
+    """
+
+    def __init__(self, cache, tag, patches_uuid):
+        self.cache = cache
+        self.tag = tag
+        self.patches_uuid = patches_uuid
+
+    def get(self, key, weight):
+        """Returns the cached fused weight for key, or None; weight is the model's current weight, used to validate the cached one."""
+
+        tensor = self.cache.weights(self.tag).get(key)
+        if tensor is None or tensor.shape != weight.shape or tensor.dtype != weight.dtype:
+            return None
+
+        self.cache.hits += 1
+        return tensor
+
+    def put(self, key, tensor):
+        self.cache.misses += 1
+        self.cache.store(self.tag, key, tensor.to(device="cpu", copy=True))
+
+
+class FusedWeightsCache:
+    """
+    A cache of fused weights for recent Lora combinations, limited to lora_fused_cache_ram_mb megabytes of RAM.
+
+    If lora_fused_cache_disk_mb is set, combinations dropped from RAM are written to safetensors files in cache_dir,
+    and read back from there when the combination is used again; the oldest files are removed to stay within the limit.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.changed = set()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def weights(self, tag):
+        entry = self.entries.get(tag)
+        if entry is not None:
+            self.entries.move_to_end(tag)
+            return entry
+
+        entry = self.read_from_disk(tag) or {}
+        self.entries[tag] = entry
+        self.sizes[tag] = sum(x.numel() * x.element_size() for x in entry.values())
+        self.size += self.sizes[tag]
+        self.evict()
+
+        return self.entries.get(tag, {})
+
+    def budget(self):
+        return shared.opts.lora_fused_cache_ram_mb * 1024 * 1024
+
+    def store(self, tag, key, tensor):
+        entry = self.weights(tag)
+        if tag not in self.entries:
+            return
+
+        size = tensor.numel() * tensor.element_size()
+        previous = entry.get(key)
+        if previous is not None:
+            size -= previous.numel() * previous.element_size()
+
+        # a combination that does not fit into the budget on its own is not cached
+        if self.sizes[tag] + size > self.budget():
+            return
+
+        entry[key] = tensor
+        self.changed.add(tag)
+        self.sizes[tag] += size
+        self.size += size
+        self.evict(keep=tag)
+
+    def evict(self, keep=None):
+        for tag in list(self.entries):
+            if self.size <= self.budget():
+                break
+
+            if tag != keep:
+                self.drop(tag)
+
+    def drop(self, tag):
+        entry = self.entries.pop(tag)
+        self.size -= self.sizes.pop(tag)
+
+        if tag in self.changed:
+            self.changed.discard(tag)
+            self.write_to_disk(tag, entry)
+
+    def clear(self):
+        for tag in list(self.entries):
+            self.drop(tag)
+
+    def filename(self, tag):
+        return os.path.join(cache_dir, hashlib.sha256(repr(tag).encode("utf8")).hexdigest()[:32] + ".safetensors")
+
+    def read_from_disk(self, tag):
+        if shared.opts.lora_fused_cache_disk_mb <= 0:
+            return None
+
+        filename = self.filename(tag)
+        if not os.path.isfile(filename):
+            return None
+
+        try:
+            with safetensors.safe_open(filename, framework="pt") as f:
+                if f.metadata().get("tag") != repr(tag):
+                    return None
+
+            os.utime(filename)
+            return safetensors.torch.load_file(filename)
+        except Exception:
+            errors.report(f"Error reading fused Lora weights from {filename}", exc_info=True)
+            return None
+
+    def write_to_disk(self, tag, entry):
+        budget = shared.opts.lora_fused_cache_disk_mb * 1024 * 1024
+        size = sum(x.numel() * x.element_size() for x in entry.values())
+        if not entry or size > budget:
+            return
+
+        filename = self.filename(tag)
+
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            safetensors.torch.save_file({k: v.contiguous() for k, v in entry.items()}, filename + ".tmp", metadata={"tag": repr(tag)})
+            os.replace(filename + ".tmp", filename)
+        except Exception:
+            errors.report(f"Error writing fused Lora weights to {filename}", exc_info=True)
+            return
+
+        files = [os.path.join(cache_dir, x) for x in os.listdir(cache_dir) if x.endswith(".safetensors")]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(x) for x in files)
+        for file in files:
+            if total <= budget:
+                break
+
+            total -= os.path.getsize(file)
+            os.remove(file)
+
+
+cache = FusedWeightsCache()
+
+
+def attach(patcher, tag):
+    """Makes the patcher use cached fused weights for the Lora combination described by tag, if the cache is enabled."""
+
+    if patcher is None:
+        return
+
+    if shared.opts.lora_fused_cache_ram_mb <= 0:
+        patcher.attachments.pop("fused_weights", None)
+        return
+
+    patcher.attachments["fused_weights"] = FusedWeights(cache, tag, patcher.patches_uuid)
+
+
+def model_tag(checkpoint_info):
+    if checkpoint_info is None:
+        return None
+
+    return checkpoint_info.sha256 or (checkpoint_info.filename, os.path.getmtime(checkpoint_info.filename))
@@ -77,8 +77,10 @@ class NetworkOnDisk:
             networks.available_network_hash_lookup[self.shorthash] = self
 
     def read_hash(self):
+        """Sets the hash if it has been calculated; otherwise schedules it, and it's left out of infotext until it's ready."""
+
         if not self.hash:
-            self.set_hash(hashes.sha256(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors) or '')
+            self.set_hash(hashes.sha256(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors, wait=False) or '')
 
     def get_alias(self):
         import networks
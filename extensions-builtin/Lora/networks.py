@@ -4,23 +4,92 @@ import logging
 import os
 import re
 
+import fused_weights
 import lora_patches
-import functools
 import network
 
 import torch
+from collections import OrderedDict
 from typing import Union
 
 from modules import shared, sd_models, errors, scripts
 from ldm_patched.modules.utils import load_torch_file
-from ldm_patched.modules.sd import load_lora_for_models
+from ldm_patched.modules.sd import load_lora_for_models, lora_patches_for_models
 
 
-@functools.lru_cache(maxsize=5)
 def load_lora_state_dict(filename):
     return load_torch_file(filename, safe_load=True)
 
 
+lora_patches_cache = OrderedDict()
+lora_patches_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def patches_size(obj):
+    """Returns the number of bytes taken by tensors in a patch dict made by lora_patches_for_models."""
+
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, dict):
+        return sum(patches_size(x) for x in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(patches_size(x) for x in obj)
+    if hasattr(obj, "weights"):
+        return patches_size(obj.weights)
+
+    return 0
+
+
+def lora_patches_cache_budget():
+    return int(shared.opts.lora_cache_ram_mb * 1024 * 1024)
+
+
+def evict_lora_patches(budget):
+    while lora_patches_cache and lora_patches_cache_stats["bytes"] > budget:
+        _, (_, size) = lora_patches_cache.popitem(last=False)
+        lora_patches_cache_stats["bytes"] -= size
+        lora_patches_cache_stats["evictions"] += 1
+
+
+def load_lora_patches(filename, unet, clip, strength_model, strength_clip):
+    """
+    Returns patches for the LoRA file, already converted and mapped to weight names of unet and clip.
+
+    Results are cached by file, file modification time, model architecture and which of unet/clip are patched, so
+    switching between sets of LoRAs only costs the weight patching. The cache is limited to lora_cache_ram_mb megabytes,
+    dropping least recently used LoRAs first.
+    """
+
+    key = (
+        filename,
+        os.path.getmtime(filename),
+        type(unet.model).__name__ if unet is not None else None,
+        type(clip.cond_stage_model).__name__ if clip is not None else None,
+        unet is not None and strength_model != 0,
+        clip is not None and strength_clip != 0,
+    )
+
+    cached = lora_patches_cache.get(key)
+    if cached is not None:
+        lora_patches_cache.move_to_end(key)
+        lora_patches_cache_stats["hits"] += 1
+        return cached[0]
+
+    lora_patches_cache_stats["misses"] += 1
+
+    lora_sd = load_lora_state_dict(filename)
+    patches = lora_patches_for_models(unet, clip, lora_sd, strength_model, strength_clip)
+
+    budget = lora_patches_cache_budget()
+    size = patches_size(patches)
+    if size <= budget:
+        lora_patches_cache[key] = (patches, size)
+        lora_patches_cache_stats["bytes"] += size
+        evict_lora_patches(budget)
+
+    return patches
+
+
 def convert_diffusers_name_to_compvis(key, is_sd2):
     pass
 
@@ -45,7 +114,7 @@ def load_network(name, network_on_disk):
 
 
 def purge_networks_from_memory():
-    pass
+    evict_lora_patches(lora_patches_cache_budget())
 
 
 def load_networks(names, te_multipliers=None, unet_multipliers=None, dyn_dims=None):
@@ -91,17 +160,26 @@ def load_networks(names, te_multipliers=None, unet_multipliers=None, dyn_dims=No
     if current_sd.current_lora_hash == compiled_lora_targets_hash:
         return
 
-    current_sd.current_lora_hash = compiled_lora_targets_hash
     current_sd.forge_objects.unet = current_sd.forge_objects_original.unet
     current_sd.forge_objects.clip = current_sd.forge_objects_original.clip
 
     for filename, strength_model, strength_clip in compiled_lora_targets:
-        lora_sd = load_lora_state_dict(filename)
+        patches = load_lora_patches(filename, current_sd.forge_objects.unet, current_sd.forge_objects.clip, strength_model, strength_clip)
         current_sd.forge_objects.unet, current_sd.forge_objects.clip = load_lora_for_models(
-            current_sd.forge_objects.unet, current_sd.forge_objects.clip, lora_sd, strength_model, strength_clip,
-            filename=filename)
+            current_sd.forge_objects.unet, current_sd.forge_objects.clip, None, strength_model, strength_clip,
+            filename=filename, loaded=patches)
+
+    if compiled_lora_targets and shared.opts.lora_fused_cache_ram_mb > 0:
+        # hashes may still be being calculated in background, so the file's mtime identifies its contents instead
+        loras = tuple(sorted((filename, os.path.getmtime(filename), strength_model, strength_clip) for filename, strength_model, strength_clip in compiled_lora_targets))
+        checkpoint = fused_weights.model_tag(current_sd.sd_checkpoint_info)
+        fused_weights.attach(current_sd.forge_objects.unet, (checkpoint, "unet", loras))
+        fused_weights.attach(current_sd.forge_objects.clip.patcher if current_sd.forge_objects.clip is not None else None, (checkpoint, "clip", loras))
 
     current_sd.forge_objects_after_applying_lora = current_sd.forge_objects.shallow_copy()
+
+    # only remembered once patching succeeded; otherwise the next generation with the same Loras would skip them
+    current_sd.current_lora_hash = compiled_lora_targets_hash
     return
 
 
@@ -3,6 +3,7 @@ import re
 import gradio as gr
 from fastapi import FastAPI
 
+import fused_weights
 import network
 import networks
 import lora  # noqa:F401
@@ -40,6 +41,9 @@ shared.options_templates.update(shared.options_section(('extra_networks', "Extra
     "lora_show_all": shared.OptionInfo(False, "Always show all networks on the Lora page").info("otherwise, those detected as for incompatible version of Stable Diffusion will be hidden"),
     "lora_hide_unknown_for_versions": shared.OptionInfo([], "Hide networks of unknown versions for model versions", gr.CheckboxGroup, {"choices": ["SD1", "SD2", "SDXL"]}),
     "lora_in_memory_limit": shared.OptionInfo(0, "Number of Lora networks to keep cached in memory", gr.Number, {"precision": 0}),
+    "lora_fused_cache_ram_mb": shared.OptionInfo(0, "Memory for caching model weights with Loras applied (MB)", gr.Number, {"precision": 0}).info("switching back to a recently used combination of Loras and strengths copies the weights instead of recalculating them; 0 = disable"),
+    "lora_fused_cache_disk_mb": shared.OptionInfo(0, "Disk space for caching model weights with Loras applied (MB)", gr.Number, {"precision": 0}).info("combinations dropped from memory are kept in the cache directory; 0 = disable"),
+    "lora_cache_ram_mb": shared.OptionInfo(1024, "Memory for caching prepared Lora weights (MB)", gr.Number, {"precision": 0}).info("Loras used recently are kept in RAM, already matched to the model's layers; 0 = disable"),
     "lora_not_found_warning_console": shared.OptionInfo(False, "Lora not found warning in console"),
     "lora_not_found_gradio_warning": shared.OptionInfo(False, "Lora not found warning popup in webui"),
 }))
@@ -68,6 +72,14 @@ def api_networks(_: gr.Blocks, app: FastAPI):
     async def refresh_loras():
         return networks.list_available_networks()
 
+    @app.get("/sdapi/v1/lora-cache")
+    async def get_lora_cache():
+        return {
+            **networks.lora_patches_cache_stats,
+            "entries": len(networks.lora_patches_cache),
+            "fused": {"hits": fused_weights.cache.hits, "misses": fused_weights.cache.misses, "bytes": fused_weights.cache.size, "entries": len(fused_weights.cache.entries)},
+        }
+
 
 script_callbacks.on_app_started(api_networks)
 
@@ -100,3 +112,5 @@ def infotext_pasted(infotext, d):
 script_callbacks.on_infotext_pasted(infotext_pasted)
 
 shared.opts.onchange("lora_in_memory_limit", networks.purge_networks_from_memory)
+shared.opts.onchange("lora_cache_ram_mb", networks.purge_networks_from_memory)
+shared.opts.onchange("lora_fused_cache_ram_mb", fused_weights.cache.evict)
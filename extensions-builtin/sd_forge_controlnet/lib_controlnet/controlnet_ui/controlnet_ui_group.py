@@ -14,6 +14,7 @@ from lib_controlnet import (
 )
 from lib_controlnet.external_code import ControlNetUnit
 from lib_controlnet.logging import logger
+from lib_controlnet.preprocessor_cache import preprocessor_cache
 from lib_controlnet.controlnet_ui.openpose_editor import OpenposeEditor
 from lib_controlnet.controlnet_ui.preset import ControlNetPresetUI
 from lib_controlnet.controlnet_ui.tool_button import ToolButton
@@ -926,12 +927,14 @@ class ControlNetUiGroup(object):
             # effect.
             # TODO: Maybe we should let `preprocessor` return a Dict to alleviate this issue?
             # This requires changing all callsites though.
-            result = preprocessor(
+            result = preprocessor_cache.run(
+                preprocessor,
                 input_image=img,
                 resolution=pres,
                 slider_1=pthr_a,
                 slider_2=pthr_b,
                 input_mask=mask,
+                read=not is_openpose(module),
                 json_pose_callback=json_acceptor.accept
                 if is_openpose(module)
                 else None,
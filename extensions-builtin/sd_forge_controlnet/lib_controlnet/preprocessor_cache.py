@@ -0,0 +1,218 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from modules import cache, errors, images, shared
+from lib_controlnet.logging import logger
+from lib_controlnet.utils import judge_image_type
+
+disk_cache_dir = os.path.join(cache.cache_dir, "controlnet-preprocessor")
+
+
+def hash_array(x) -> str:
+    if x is None:
+        return "none"
+
+    x = np.ascontiguousarray(x)
+    h = hashlib.sha256(f"{x.dtype}{x.shape}".encode("utf8"))
+    h.update(x.data)
+    return h.hexdigest()
+
+
+def normalize_number(x):
+    """Makes 100, 100.0 and np.float32(100) give the same key, since the UI and the API pass slider values differently."""
+
+    try:
+        return repr(float(x))
+    except (TypeError, ValueError):
+        return repr(x)
+
+
+def numpy_rng_state():
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return keys.tobytes(), pos, has_gauss, cached_gaussian
+
+
+class PreprocessorCache:
+    """
+    Results of ControlNet preprocessors, so that generating again with the same input image and preprocessor
+    settings does not run the preprocessor again.
+
+    Results are keyed by hashes of the input image and mask together with the preprocessor name, resolution and
+    slider values. Only image results are kept; those are what the expensive preprocessors (depth, openpose, lineart
+    and so on) return. The most recently used ones are kept in RAM, up to control_net_preprocessor_cache_size_mb; if
+    control_net_preprocessor_cache_disk is enabled, results are also written as .npy files into the cache directory,
+    which is trimmed to control_net_preprocessor_cache_disk_size_mb by removing the least recently used files.
+
+    Some preprocessors, like shuffle, draw random numbers from the numpy generator seeded from the generation seed.
+    A preprocessor that changes the numpy random state while running is remembered as random, and the seed is added
+    to keys of its results.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.random_preprocessors = set()
+
+    def key(self, preprocessor_name, input_image, input_mask, resolution, slider_1, slider_2, seed=None):
+        parts = [
+            preprocessor_name,
+            hash_array(input_image),
+            hash_array(input_mask),
+            normalize_number(resolution),
+            normalize_number(slider_1),
+            normalize_number(slider_2),
+        ]
+
+        if preprocessor_name in self.random_preprocessors:
+            parts.append(f"seed={seed}")
+
+        return hashlib.sha256("\n".join(parts).encode("utf8")).hexdigest()
+
+    def disk_path(self, key):
+        return os.path.join(disk_cache_dir, f"{key}.npy")
+
+    def get(self, key):
+        """Returns a copy of the result stored under key, or None."""
+
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                return value.copy()
+
+        if not shared.opts.control_net_preprocessor_cache_disk:
+            return None
+
+        filename = self.disk_path(key)
+        if not os.path.isfile(filename):
+            return None
+
+        try:
+            value = np.load(filename, allow_pickle=False)
+            os.utime(filename)
+        except Exception:
+            errors.report(f"Error reading cached preprocessor result {filename}", exc_info=True)
+            return None
+
+        self.put_in_memory(key, value.copy())
+
+        return value
+
+    def put_in_memory(self, key, value):
+        limit = int(shared.opts.control_net_preprocessor_cache_size_mb * 1024 * 1024)
+        if value.nbytes > limit:
+            return
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.nbytes
+
+            self.entries[key] = value
+            self.size += value.nbytes
+
+            while self.size > limit:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def put(self, key, value):
+        """Stores a copy of value under key in RAM, and on disk if enabled; the file is written on the image saving thread pool."""
+
+        value = value.copy()
+        self.put_in_memory(key, value)
+
+        if not shared.opts.control_net_preprocessor_cache_disk:
+            return
+
+        def write():
+            filename = self.disk_path(key)
+
+            try:
+                os.makedirs(disk_cache_dir, exist_ok=True)
+
+                with open(filename + ".tmp", "wb") as file:
+                    np.save(file, value, allow_pickle=False)
+
+                os.replace(filename + ".tmp", filename)
+            except Exception:
+                errors.report(f"Error writing cached preprocessor result {filename}", exc_info=True)
+                return
+
+            self.trim_disk()
+
+        images.submit_background_save(write)
+
+    def trim_disk(self):
+        limit = int(shared.opts.control_net_preprocessor_cache_disk_size_mb * 1024 * 1024)
+
+        try:
+            files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(disk_cache_dir) if entry.name.endswith(".npy")]
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= limit:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def run(self, preprocessor, input_image, input_mask, resolution, slider_1, slider_2, seed=None, read=True, **kwargs):
+        """
+        Calls preprocessor with the given arguments, or returns its result from an earlier call with the same ones.
+
+        With read=False, the preprocessor always runs and its result is only stored; this is for calls that need
+        side effects of the preprocessor, like the openpose JSON callback.
+        """
+
+        def call():
+            return preprocessor(
+                input_image=input_image,
+                input_mask=input_mask,
+                resolution=resolution,
+                slider_1=slider_1,
+                slider_2=slider_2,
+                **kwargs,
+            )
+
+        if shared.opts.control_net_preprocessor_cache_size_mb <= 0:
+            return call()
+
+        args = (preprocessor.name, input_image, input_mask, resolution, slider_1, slider_2)
+
+        if read:
+            result = self.get(self.key(*args, seed=seed))
+            if result is not None:
+                logger.info(f"Using cached result of preprocessor {preprocessor.name}")
+                return result
+
+        rng_state = numpy_rng_state()
+        result = call()
+
+        if not judge_image_type(result):
+            return result
+
+        if numpy_rng_state() != rng_state:
+            self.random_preprocessors.add(preprocessor.name)
+
+        self.put(self.key(*args, seed=seed), result)
+
+        return result
+
+
+preprocessor_cache = PreprocessorCache()
@@ -30,6 +30,7 @@ from lib_controlnet.infotext import Infotext
 from modules_forge.forge_util import HWC3, numpy_to_pytorch
 from lib_controlnet.enums import HiResFixOption
 from lib_controlnet.api import controlnet_api
+from lib_controlnet.preprocessor_cache import preprocessor_cache
 
 import numpy as np
 import functools
@@ -348,12 +349,14 @@ class ControlNetForForgeOfficial(scripts.Script):
             logger.info(f"Using preprocessor: {unit.module}")
             logger.info(f'preprocessor resolution = {unit.processor_res}')
 
-            preprocessor_output = preprocessor(
+            preprocessor_output = preprocessor_cache.run(
+                preprocessor,
                 input_image=input_image,
                 input_mask=input_mask,
                 resolution=unit.processor_res,
                 slider_1=unit.threshold_a,
                 slider_2=unit.threshold_b,
+                seed=seed,
             )
 
             preprocessor_outputs.append(preprocessor_output)
@@ -624,6 +627,13 @@ def on_ui_settings():
         5, "Model cache size (requires restart)", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}, section=section))
     shared.opts.add_option("control_net_ipadapter_cache_size", shared.OptionInfo(
         5, "IPAdapter cache size (requires restart)", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}, section=section))    
+    shared.opts.add_option("control_net_preprocessor_cache_size_mb", shared.OptionInfo(
+        512, "Preprocessor result cache size in RAM, in MB (0 = disable)", gr.Slider,
+        {"minimum": 0, "maximum": 8192, "step": 64}, section=section).info("reuses results of preprocessors when input image and preprocessor settings have not changed"))
+    shared.opts.add_option("control_net_preprocessor_cache_disk", shared.OptionInfo(
+        False, "Also keep preprocessor results on disk", gr.Checkbox, {"interactive": True}, section=section))
+    shared.opts.add_option("control_net_preprocessor_cache_disk_size_mb", shared.OptionInfo(
+        2048, "Preprocessor result cache size on disk, in MB", gr.Number, section=section))
     shared.opts.add_option("control_net_no_detectmap", shared.OptionInfo(
         False, "Do not append detectmap to output", gr.Checkbox, {"interactive": True}, section=section))
     shared.opts.add_option("control_net_detectmap_autosaving", shared.OptionInfo(
@@ -25,6 +25,7 @@ import sys
 import platform
 import weakref
 import gc
+import contextlib
 import logging
 
 class VRAMState(Enum):
@@ -575,6 +576,94 @@ def extra_reserved_memory():
 def minimum_inference_memory():
     return (1024 * 1024 * 1024) * 0.8 + extra_reserved_memory()
 
+class ResidencyPlanner:
+    """
+    Decides which models stay in VRAM while a job runs.
+
+    A job (for example a txt2img generation) declares the models it is going to use, in order: text encoder, UNet,
+    VAE, repeated for every batch. When memory has to be freed, models that the job will not use again are unloaded
+    first; of the models it still needs, the one needed furthest in the future goes first, and may only be partially
+    offloaded. Outside of a job, models are unloaded in the usual order.
+
+    Counts of the decisions made and the bytes moved in and out of VRAM are kept per job in report, and logged when
+    the job ends; the report of the previous job is kept in last_report.
+    """
+
+    def __init__(self):
+        self.upcoming = []
+        self.active = False
+        self.report = None
+        self.last_report = None
+
+    @contextlib.contextmanager
+    def job(self, models):
+        self.begin_job(models)
+        try:
+            yield self
+        finally:
+            self.end_job()
+
+    def begin_job(self, models):
+        self.upcoming = [weakref.ref(x) for x in models if x is not None]
+        self.active = True
+        self.report = {
+            "kept": 0,
+            "loaded": 0,
+            "evicted": 0,
+            "partially_offloaded": 0,
+            "bytes_loaded": 0,
+            "bytes_offloaded": 0,
+            "cache_flushes": 0,
+        }
+
+    def end_job(self):
+        if not self.active:
+            return
+
+        self.active = False
+        self.upcoming = []
+        self.last_report = self.report
+
+        report = self.report
+        logging.info(
+            f"VRAM residency: {report['kept']} kept, {report['loaded']} loaded, {report['partially_offloaded']} partially offloaded, "
+            f"{report['evicted']} evicted, {report['bytes_loaded'] / (1024 * 1024):.2f} MB loaded, "
+            f"{report['bytes_offloaded'] / (1024 * 1024):.2f} MB offloaded, {report['cache_flushes']} cache flushes"
+        )
+
+    def record(self, name, value=1):
+        if self.active:
+            self.report[name] += value
+
+    def find(self, model):
+        for i, ref in enumerate(self.upcoming):
+            planned = ref()
+            if planned is not None and (model is planned or model.is_clone(planned)):
+                return i
+
+        return None
+
+    def use(self, models):
+        """Marks models as being used now; uses of them planned up to this point are dropped from the plan."""
+
+        positions = [self.find(x) for x in models]
+        positions = [x for x in positions if x is not None]
+        if positions:
+            self.upcoming = self.upcoming[max(positions) + 1:]
+
+    def eviction_priority(self, model):
+        """Models with lower priority are unloaded first: 0 for models the job will not use again, higher for models it will use sooner."""
+
+        position = self.find(model)
+        if position is None:
+            return 0
+
+        return len(self.upcoming) - position
+
+
+residency_planner = ResidencyPlanner()
+
+
 def free_memory(memory_required, device, keep_loaded=[]):
     cleanup_models_gc()
     unloaded_model = []
@@ -585,7 +674,7 @@ def free_memory(memory_required, device, keep_loaded=[]):
         shift_model = current_loaded_models[i]
         if shift_model.device == device:
             if shift_model not in keep_loaded and not shift_model.is_dead():
-                can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
+                can_unload.append((residency_planner.eviction_priority(shift_model.model), -shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
                 shift_model.currently_used = False
 
     for x in sorted(can_unload):
@@ -597,15 +686,23 @@ def free_memory(memory_required, device, keep_loaded=[]):
                 break
             memory_to_free = memory_required - free_mem
         logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
+        loaded_size = current_loaded_models[i].model_loaded_memory()
         if current_loaded_models[i].model_unload(memory_to_free):
             unloaded_model.append(i)
+            residency_planner.record("evicted")
+            residency_planner.record("bytes_offloaded", loaded_size)
+        else:
+            residency_planner.record("partially_offloaded")
+            residency_planner.record("bytes_offloaded", loaded_size - current_loaded_models[i].model_loaded_memory())
 
     for i in sorted(unloaded_model, reverse=True):
         unloaded_models.append(current_loaded_models.pop(i))
 
     if len(unloaded_model) > 0:
         soft_empty_cache(force=True)
-    else:
+        residency_planner.record("cache_flushes")
+    elif not residency_planner.active:
+        # during a planned job, the cache is only flushed when a model is actually evicted
         if vram_state != VRAMState.HIGH_VRAM:
             mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
             if mem_free_torch > mem_free_total * 0.25:
@@ -654,9 +751,6 @@ def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimu
         for i in to_unload:
             current_loaded_models.pop(i).model.detach(unpatch_all=False)
 
-    # Force memory cleanup before loading new models
-    soft_empty_cache(force=True)
-
     total_memory_required = {}
     for loaded_model in models_to_load:
         device_mem = loaded_model.model_memory_required(loaded_model.device)
@@ -698,13 +792,20 @@ def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimu
         # current_loaded_models.insert(0, loaded_model)
         try:
             logging.debug(f"Loading model to {model.load_device}")
+            loaded_size = loaded_model.model_loaded_memory()
             loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
             current_loaded_models.insert(0, loaded_model)
             logging.debug(f"Successfully loaded model to {model.load_device}")
+
+            bytes_loaded = loaded_model.model_loaded_memory() - loaded_size
+            residency_planner.record("loaded" if bytes_loaded > 0 else "kept")
+            residency_planner.record("bytes_loaded", max(0, bytes_loaded))
         except Exception as e:
             logging.debug(f"Error loading model: {str(e)}")
             soft_empty_cache(force=True)
             raise e
+
+    residency_planner.use([x.model for x in models_to_load])
     return
 
 def load_model_gpu(model):
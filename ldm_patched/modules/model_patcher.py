@@ -23,6 +23,7 @@ import inspect
 import logging
 import math
 import uuid
+import weakref
 from typing import Callable, Optional
 
 import torch
@@ -122,17 +123,88 @@ def move_weight_functions(m, device):
                 memory += f.move_to(device=device)
     return memory
 
+class LowVramPatchCache:
+    """
+    Keeps weights calculated by LowVramPatch in CPU memory (pinned, if CUDA is available), so that layers that are
+    streamed to the device for every forward pass do not recalculate their patches on every sampling step; instead,
+    the patched weight is streamed in the same way as the original weight would have been.
+
+    Entries are keyed by (patches_uuid, weight name, dtype), so they stop being used as soon as the model's patches
+    change, and are dropped in least recently used order to stay within the lowvram_patch_cache_mb option.
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    def budget(self):
+        from modules import shared
+        return int(shared.opts.lowvram_patch_cache_mb * 1024 * 1024)
+
+    def get(self, key):
+        tensor = self.entries.get(key)
+        if tensor is not None:
+            self.entries.move_to_end(key)
+
+        return tensor
+
+    def put(self, key, tensor):
+        budget = self.budget()
+        size = tensor.numel() * tensor.element_size()
+        if size > budget or key in self.entries:
+            return
+
+        tensor = tensor.to(device="cpu", copy=True)
+        if torch.cuda.is_available():
+            tensor = tensor.pin_memory()
+
+        self.entries[key] = tensor
+        self.size += size
+
+        while self.size > budget:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.numel() * evicted.element_size()
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+lowvram_patch_cache = LowVramPatchCache()
+
+
 class LowVramPatch:
-    def __init__(self, key, patches):
+    def __init__(self, key, patches, patcher=None):
         self.key = key
         self.patches = patches
+        self.patcher = weakref.ref(patcher) if patcher is not None else None
+
+    def cache_key(self, dtype):
+        patcher = self.patcher() if self.patcher is not None else None
+        if patcher is None or lowvram_patch_cache.budget() <= 0:
+            return None
+
+        return patcher.patches_uuid, self.key, dtype
+
+    def cached_weight(self, dtype):
+        """Returns the result of calling this for a weight of the given dtype, if it was calculated before, or None."""
+
+        key = self.cache_key(dtype)
+        return lowvram_patch_cache.get(key) if key is not None else None
+
     def __call__(self, weight):
         intermediate_dtype = weight.dtype
         if intermediate_dtype not in [torch.float32, torch.float16, torch.bfloat16]: #intermediate_dtype has to be one that is supported in math ops
             intermediate_dtype = torch.float32
-            return ldm_patched.float.stochastic_rounding(ldm_patched.modules.lora.calculate_weight(self.patches[self.key], weight.to(intermediate_dtype), self.key, intermediate_dtype=intermediate_dtype), weight.dtype, seed=string_to_seed(self.key))
+            result = ldm_patched.float.stochastic_rounding(ldm_patched.modules.lora.calculate_weight(self.patches[self.key], weight.to(intermediate_dtype), self.key, intermediate_dtype=intermediate_dtype), weight.dtype, seed=string_to_seed(self.key))
+        else:
+            result = ldm_patched.modules.lora.calculate_weight(self.patches[self.key], weight, self.key, intermediate_dtype=intermediate_dtype)
+
+        key = self.cache_key(weight.dtype)
+        if key is not None:
+            lowvram_patch_cache.put(key, result)
 
-        return ldm_patched.modules.lora.calculate_weight(self.patches[self.key], weight, self.key, intermediate_dtype=intermediate_dtype)
+        return result
 
 def get_key_weight(model, key):
     set_func = None
@@ -566,6 +638,21 @@ class ModelPatcher:
         if key not in self.backup:
             self.backup[key] = collections.namedtuple('Dimension', ['weight', 'inplace_update'])(weight.to(device=self.offload_device, copy=inplace_update), inplace_update)
 
+        # weights with these patches applied may have been calculated before, see extensions-builtin/Lora/fused_weights.py
+        fused_weights = self.attachments.get("fused_weights", None)
+        if fused_weights is not None and (fused_weights.patches_uuid != self.patches_uuid or set_func is not None or convert_func is not None):
+            fused_weights = None
+
+        if fused_weights is not None:
+            out_weight = fused_weights.get(key, weight)
+            if out_weight is not None:
+                out_weight = out_weight.to(device=device_to if device_to is not None else weight.device, copy=True)
+                if inplace_update:
+                    ldm_patched.modules.utils.copy_to_param(self.model, key, out_weight)
+                else:
+                    ldm_patched.modules.utils.set_attr_param(self.model, key, out_weight)
+                return
+
         if device_to is not None:
             temp_weight = ldm_patched.modules.model_management.cast_to_device(weight, device_to, torch.float32, copy=True)
         else:
@@ -576,6 +663,8 @@ class ModelPatcher:
         out_weight = ldm_patched.modules.lora.calculate_weight(self.patches[key], temp_weight, key)
         if set_func is None:
             out_weight = ldm_patched.float.stochastic_rounding(out_weight, weight.dtype, seed=string_to_seed(key))
+            if fused_weights is not None:
+                fused_weights.put(key, out_weight)
             if inplace_update:
                 ldm_patched.modules.utils.copy_to_param(self.model, key, out_weight)
             else:
@@ -636,13 +725,13 @@ class ModelPatcher:
                         if force_patch_weights:
                             self.patch_weight_to_device(weight_key)
                         else:
-                            m.weight_function = [LowVramPatch(weight_key, self.patches)]
+                            m.weight_function = [LowVramPatch(weight_key, self.patches, self)]
                             patch_counter += 1
                     if bias_key in self.patches:
                         if force_patch_weights:
                             self.patch_weight_to_device(bias_key)
                         else:
-                            m.bias_function = [LowVramPatch(bias_key, self.patches)]
+                            m.bias_function = [LowVramPatch(bias_key, self.patches, self)]
                             patch_counter += 1
 
                     cast_weight = True
@@ -804,10 +893,10 @@ class ModelPatcher:
                         module_mem += move_weight_functions(m, device_to)
                         if lowvram_possible:
                             if weight_key in self.patches:
-                                m.weight_function.append(LowVramPatch(weight_key, self.patches))
+                                m.weight_function.append(LowVramPatch(weight_key, self.patches, self))
                                 patch_counter += 1
                             if bias_key in self.patches:
-                                m.bias_function.append(LowVramPatch(bias_key, self.patches))
+                                m.bias_function.append(LowVramPatch(bias_key, self.patches, self))
                                 patch_counter += 1
                             cast_weight = True
 
@@ -51,6 +51,14 @@ cast_to = ldm_patched.modules.model_management.cast_to #TODO: remove once no mor
 def cast_to_input(weight, input, non_blocking=False, copy=True):
     return ldm_patched.modules.model_management.cast_to(weight, input.dtype, input.device, non_blocking=non_blocking, copy=copy)
 
+def cached_function_result(functions, dtype):
+    # a single LowVramPatch may already have the patched weight in memory, which can be streamed instead of the original weight
+    if len(functions) != 1 or not hasattr(functions[0], "cached_weight"):
+        return None
+
+    return functions[0].cached_weight(dtype)
+
+
 def cast_bias_weight(s, input=None, dtype=None, device=None, bias_dtype=None):
     if input is not None:
         if dtype is None:
@@ -69,13 +77,23 @@ def cast_bias_weight(s, input=None, dtype=None, device=None, bias_dtype=None):
     bias = None
     non_blocking = ldm_patched.modules.model_management.device_supports_non_blocking(device)
     if s.bias is not None:
-        has_function = len(s.bias_function) > 0
-        bias = ldm_patched.modules.model_management.cast_to(s.bias, bias_dtype, device, non_blocking=non_blocking, copy=has_function, stream=offload_stream)
-
-        if has_function:
-            with wf_context:
-                for f in s.bias_function:
-                    bias = f(bias)
+        cached = cached_function_result(s.bias_function, bias_dtype or s.bias.dtype)
+        if cached is not None:
+            bias = ldm_patched.modules.model_management.cast_to(cached, bias_dtype, device, non_blocking=non_blocking, stream=offload_stream)
+        else:
+            has_function = len(s.bias_function) > 0
+            bias = ldm_patched.modules.model_management.cast_to(s.bias, bias_dtype, device, non_blocking=non_blocking, copy=has_function, stream=offload_stream)
+
+            if has_function:
+                with wf_context:
+                    for f in s.bias_function:
+                        bias = f(bias)
+
+    cached = cached_function_result(s.weight_function, dtype or s.weight.dtype)
+    if cached is not None:
+        weight = ldm_patched.modules.model_management.cast_to(cached, dtype, device, non_blocking=non_blocking, stream=offload_stream)
+        ldm_patched.modules.model_management.sync_stream(device, offload_stream)
+        return weight, bias
 
     has_function = len(s.weight_function) > 0
     weight = ldm_patched.modules.model_management.cast_to(s.weight, dtype, device, non_blocking=non_blocking, copy=has_function, stream=offload_stream)
@@ -86,9 +86,9 @@ def load_clip_weights(model, sd):
     sd = ldm_patched.modules.utils.transformers_convert(sd, "cond_stage_model.model.", "cond_stage_model.transformer.text_model.", 24)
     return load_model_weights(model, sd)
 
-def load_lora_for_models(model, clip, lora, strength_model, strength_clip, filename='default'):
-    model_flag = type(model.model).__name__ if model is not None else 'default'
-    
+def lora_patches_for_models(model, clip, lora, strength_model, strength_clip):
+    """Converts a LoRA state dict into patches keyed by the weight names of model and clip; components with zero strength are skipped."""
+
     # Only build key maps for components we'll actually use
     key_map = {}
     if model is not None and strength_model != 0:
@@ -98,14 +98,30 @@ def load_lora_for_models(model, clip, lora, strength_model, strength_clip, filen
 
     # If we have no keys to process, return early
     if not key_map:
-        return (model, clip)
+        return {}
 
     # Convert lora before loading
     lora = ldm_patched.modules.lora_convert.convert_lora(lora)
-    
+
     # Load LoRA weights
-    loaded = ldm_patched.modules.lora.load_lora(lora, key_map)
-    
+    return ldm_patched.modules.lora.load_lora(lora, key_map)
+
+
+def load_lora_for_models(model, clip, lora, strength_model, strength_clip, filename='default', loaded=None):
+    """
+    Returns copies of model and clip with the LoRA applied. If loaded is given, it must be the result of
+    lora_patches_for_models for the same models and LoRA, and lora is not used.
+    """
+
+    model_flag = type(model.model).__name__ if model is not None else 'default'
+
+    if loaded is None:
+        loaded = lora_patches_for_models(model, clip, lora, strength_model, strength_clip)
+
+    # If we have no keys to process, return early
+    if not loaded:
+        return (model, clip)
+
     # Handle model patching
     if model is not None:
         new_modelpatcher = model.clone()
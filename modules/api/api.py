@@ -1,24 +1,30 @@
 import base64
 import io
+import json
 import os
+import queue
+import threading
 import time
+import urllib.parse
+import uuid
 import datetime
 import uvicorn
 import ipaddress
 import requests
 import gradio as gr
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from fastapi import APIRouter, Depends, FastAPI, Request, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
 
 import modules.shared as shared
 from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
-from modules.api import models
+from modules.api import models, batching
 from modules.shared import opts
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
 from modules.textual_inversion.textual_inversion import create_embedding, train_embedding
@@ -26,12 +32,12 @@ from modules.hypernetworks.hypernetwork import create_hypernetwork, train_hypern
 from PIL import PngImagePlugin
 from modules.sd_models_config import find_checkpoint_config_near_filename
 from modules.realesrgan_model import get_realesrgan_models
-from modules import devices
+from modules import devices, fifo_lock, metrics
 from typing import Any
 import piexif
 import piexif.helper
-from contextlib import closing
-from modules.progress import create_task_id, add_task_to_queue, start_task, finish_task, current_task
+from contextlib import closing, contextmanager
+from modules.progress import create_task_id, add_task_to_queue, remove_task_from_queue, start_task, finish_task, current_task
 
 def script_name_to_index(name, scripts):
     try:
@@ -99,10 +105,11 @@ def decode_base64_to_image(encoding):
         raise HTTPException(status_code=500, detail="Invalid encoded image") from e
 
 
-def encode_pil_to_base64(image):
+@metrics.api_encode.time()
+def encode_pil_to_bytes(image):
+    """Encodes the image in the format from settings; returns a tuple of (bytes, mime type)."""
+
     with io.BytesIO() as output_bytes:
-        if isinstance(image, str):
-            return image
         if opts.samples_format.lower() == 'png':
             use_metadata = False
             metadata = PngImagePlugin.PngInfo()
@@ -111,6 +118,7 @@ def encode_pil_to_base64(image):
                     metadata.add_text(key, value)
                     use_metadata = True
             image.save(output_bytes, format="PNG", pnginfo=(metadata if use_metadata else None), quality=opts.jpeg_quality)
+            mime_type = "image/png"
 
         elif opts.samples_format.lower() in ("jpg", "jpeg", "webp"):
             if image.mode in ("RGBA", "P"):
@@ -121,17 +129,106 @@ def encode_pil_to_base64(image):
             })
             if opts.samples_format.lower() in ("jpg", "jpeg"):
                 image.save(output_bytes, format="JPEG", exif = exif_bytes, quality=opts.jpeg_quality)
+                mime_type = "image/jpeg"
             else:
                 image.save(output_bytes, format="WEBP", exif = exif_bytes, quality=opts.jpeg_quality, lossless=opts.webp_lossless)
+                mime_type = "image/webp"
 
         else:
             raise HTTPException(status_code=500, detail="Invalid image format")
 
-        bytes_data = output_bytes.getvalue()
+        return output_bytes.getvalue(), mime_type
+
+
+def encode_pil_to_base64(image):
+    if isinstance(image, str):
+        return image
+
+    bytes_data, _ = encode_pil_to_bytes(image)
 
     return base64.b64encode(bytes_data)
 
 
+encode_executor = None
+encode_executor_lock = threading.Lock()
+
+
+def get_encode_executor():
+    global encode_executor
+
+    with encode_executor_lock:
+        if encode_executor is None:
+            encode_executor = ThreadPoolExecutor(max_workers=max(1, opts.api_encode_workers), thread_name_prefix="api-encode")
+
+    return encode_executor
+
+
+def encode_images_to_base64(images_list):
+    """Encodes a list of images to base64 in parallel, preserving order."""
+
+    if len(images_list) <= 1:
+        return list(map(encode_pil_to_base64, images_list))
+
+    return list(get_encode_executor().map(encode_pil_to_base64, images_list))
+
+
+def wants_stream(request: Request):
+    """Returns True if the client asked for images to be streamed as multipart/mixed as they are produced."""
+
+    return request is not None and "multipart/mixed" in request.headers.get("accept", "")
+
+
+def stream_multipart(process):
+    """
+    Runs process(on_image_ready) on a background thread and streams each image as a part of a multipart/mixed response
+    as soon as it's produced. Images are encoded in the encode thread pool; each image part has the infotext in the
+    X-Infotext header (percent-encoded). The last part is application/json with the info of the whole job, or with an
+    error if processing failed.
+    """
+
+    boundary = uuid.uuid4().hex
+    parts = queue.Queue()
+    executor = get_encode_executor()
+
+    def on_image_ready(image, infotext):
+        # the image may be being saved on the image saving thread pool at the same time, and PIL's save() keeps
+        # its state in attributes of the image, so encode a copy
+        parts.put((executor.submit(encode_pil_to_bytes, image.copy()), infotext))
+
+    def run():
+        try:
+            processed = process(on_image_ready)
+            parts.put((None, processed if isinstance(processed, str) else processed.js()))
+        except Exception as e:
+            status_code = vars(e).get('status_code', 500)
+            errors.report(f"API error while streaming: {e}", exc_info=not isinstance(e, HTTPException))
+            parts.put((None, json.dumps({"error": type(e).__name__, "detail": vars(e).get('detail', ''), "status_code": status_code, "errors": str(e)})))
+
+        parts.put(None)
+
+    def generate():
+        while True:
+            part = parts.get()
+            if part is None:
+                break
+
+            future, text = part
+            if future is None:
+                headers = "Content-Type: application/json\r\n"
+                body = text.encode("utf8")
+            else:
+                body, mime_type = future.result()
+                headers = f"Content-Type: {mime_type}\r\nContent-Length: {len(body)}\r\nX-Infotext: {urllib.parse.quote(text or '')}\r\n"
+
+            yield f"--{boundary}\r\n{headers}\r\n".encode("utf8") + body + b"\r\n"
+
+        yield f"--{boundary}--\r\n".encode("utf8")
+
+    threading.Thread(target=run, daemon=True, name="api-stream").start()
+
+    return StreamingResponse(generate(), media_type=f"multipart/mixed; boundary={boundary}")
+
+
 def api_middleware(app: FastAPI):
     rich_available = False
     try:
@@ -207,6 +304,7 @@ class Api:
         self.router = APIRouter()
         self.app = app
         self.queue_lock = queue_lock
+        self.txt2img_batcher = batching.Txt2ImgBatcher(self.process_txt2img_batch)
         api_middleware(self.app)
         self.add_api_route("/sdapi/v1/txt2img", self.text2imgapi, methods=["POST"], response_model=models.TextToImageResponse)
         self.add_api_route("/sdapi/v1/img2img", self.img2imgapi, methods=["POST"], response_model=models.ImageToImageResponse)
@@ -239,6 +337,7 @@ class Api:
         self.add_api_route("/sdapi/v1/train/embedding", self.train_embedding, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/train/hypernetwork", self.train_hypernetwork, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/memory", self.get_memory, methods=["GET"], response_model=models.MemoryResponse)
+        self.add_api_route("/metrics", self.get_metrics, methods=["GET"], response_class=PlainTextResponse)
         self.add_api_route("/sdapi/v1/unload-checkpoint", self.unloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/reload-checkpoint", self.reloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/scripts", self.get_scripts_list, methods=["GET"], response_model=models.ScriptsList)
@@ -283,6 +382,54 @@ class Api:
 
         raise HTTPException(status_code=401, detail="Incorrect username or password", headers={"WWW-Authenticate": "Basic"})
 
+    def queued(self, request: Request = None, *, task_id=None, priority=fifo_lock.PRIORITY_API):
+        """
+        Takes a place in the queue and returns a context manager that waits for the queue lock and holds it for the
+        duration of the block. The place is taken when this is called rather than when the block is entered, so that
+        streaming endpoints can call it before returning the response and a full queue gets the status code.
+
+        Clients can lower the priority of their request with the X-Queue-Priority header (api, batch), but never raise
+        it above the priority the endpoint gives them, and identify themselves for fair scheduling with X-Client-Id;
+        by default the client's address is used.
+        Raises HTTP 429 if the queue is full; the returned context manager must be entered, or the queue is stuck.
+        """
+
+        client = None
+        if request is not None:
+            requested = request.headers.get("x-queue-priority", "").strip().lower()
+            if requested in fifo_lock.priorities and fifo_lock.priorities.index(requested) > fifo_lock.priorities.index(priority):
+                priority = requested
+            client = request.headers.get("x-client-id") or (request.client.host if request.client else None)
+
+        started = time.perf_counter()
+
+        if not isinstance(self.queue_lock, fifo_lock.PriorityFIFOLock):
+            @contextmanager
+            def hold_lock():
+                with self.queue_lock:
+                    metrics.queue_wait.observe(time.perf_counter() - started)
+                    yield
+
+            return hold_lock()
+
+        try:
+            waiter = self.queue_lock.enqueue(priority=priority, client=client, task_id=task_id)
+        except fifo_lock.QueueFullError as e:
+            if task_id is not None:
+                remove_task_from_queue(task_id)
+            raise HTTPException(status_code=429, detail=str(e)) from e
+
+        @contextmanager
+        def hold_place():
+            try:
+                waiter.event.wait()
+                metrics.queue_wait.observe(time.perf_counter() - started)
+                yield
+            finally:
+                self.queue_lock.release()
+
+        return hold_place()
+
     def get_selectable_script(self, script_name, script_runner):
         if script_name is None or script_name == "":
             return None, None
@@ -429,7 +576,7 @@ class Api:
 
         return params
 
-    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, request: Request = None):
         task_id = txt2imgreq.force_task_id or create_task_id("txt2img")
 
         script_runner = scripts.scripts_txt2img
@@ -462,34 +609,70 @@ class Api:
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
 
+        if request is not None and request.headers.get("x-trace", "").strip().lower() in ("1", "true", "yes"):
+            args['trace'] = True
+
         add_task_to_queue(task_id)
 
-        with self.queue_lock:
-            with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
-                p.is_api = True
-                p.scripts = script_runner
-                p.outpath_grids = opts.outdir_txt2img_grids
-                p.outpath_samples = opts.outdir_txt2img_samples
-
-                try:
-                    shared.state.begin(job="scripts_txt2img")
-                    start_task(task_id)
-                    if selectable_scripts is not None:
-                        p.script_args = script_args
-                        processed = scripts.scripts_txt2img.run(p, *p.script_args) # Need to pass args as list here
-                    else:
-                        p.script_args = tuple(script_args) # Need to pass args as tuple here
-                        processed = process_images(p)
-                    finish_task(task_id)
-                finally:
-                    shared.state.end()
-                    shared.total_tqdm.clear()
-
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
-
-        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
-
-    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+        if wants_stream(request):
+            place = self.queued(request, task_id=task_id)
+
+            def process(on_image_ready):
+                with place:
+                    return self.process_txt2img(task_id, args, script_args, selectable_scripts, on_image_ready=on_image_ready)
+
+            return stream_multipart(process)
+
+        if batching.is_batchable(txt2imgreq, args):
+            _, result_images, info = self.txt2img_batcher.submit(task_id, args, request)
+        else:
+            with self.queued(request, task_id=task_id):
+                processed = self.process_txt2img(task_id, args, script_args, selectable_scripts)
+
+            result_images, info = processed.images, processed.js()
+
+        b64images = encode_images_to_base64(result_images) if send_images else []
+
+        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=info)
+
+    def process_txt2img(self, task_id, args, script_args, selectable_scripts=None, *, on_image_ready=None):
+        """Runs txt2img processing; the caller must hold the queue lock."""
+
+        script_runner = scripts.scripts_txt2img
+
+        with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
+            p.is_api = True
+            p.on_image_ready = on_image_ready
+            p.scripts = script_runner
+            p.outpath_grids = opts.outdir_txt2img_grids
+            p.outpath_samples = opts.outdir_txt2img_samples
+
+            try:
+                shared.state.begin(job="scripts_txt2img")
+                start_task(task_id)
+                if selectable_scripts is not None:
+                    p.script_args = script_args
+                    processed = scripts.scripts_txt2img.run(p, *p.script_args) # Need to pass args as list here
+                else:
+                    p.script_args = tuple(script_args) # Need to pass args as tuple here
+                    processed = process_images(p)
+                finish_task(task_id)
+            finally:
+                shared.state.end()
+                shared.total_tqdm.clear()
+
+        return processed
+
+    def process_txt2img_batch(self, batch, request=None):
+        leader = batch.items[0]
+
+        with self.queued(request, task_id=leader.task_id):
+            self.txt2img_batcher.close_batch(batch)
+            args = batching.combine_args(batch.items)
+
+            return self.process_txt2img(leader.task_id, args, self.default_script_arg_txt2img)
+
+    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI, request: Request = None):
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
 
         init_images = img2imgreq.init_images
@@ -532,58 +715,91 @@ class Api:
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
 
-        add_task_to_queue(task_id)
+        if request is not None and request.headers.get("x-trace", "").strip().lower() in ("1", "true", "yes"):
+            args['trace'] = True
 
-        with self.queue_lock:
-            with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
-                p.init_images = [decode_base64_to_image(x) for x in init_images]
-                p.is_api = True
-                p.scripts = script_runner
-                p.outpath_grids = opts.outdir_img2img_grids
-                p.outpath_samples = opts.outdir_img2img_samples
-
-                try:
-                    shared.state.begin(job="scripts_img2img")
-                    start_task(task_id)
-                    if selectable_scripts is not None:
-                        p.script_args = script_args
-                        processed = scripts.scripts_img2img.run(p, *p.script_args) # Need to pass args as list here
-                    else:
-                        p.script_args = tuple(script_args) # Need to pass args as tuple here
-                        processed = process_images(p)
-                    finish_task(task_id)
-                finally:
-                    shared.state.end()
-                    shared.total_tqdm.clear()
-
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+        add_task_to_queue(task_id)
 
         if not img2imgreq.include_init_images:
             img2imgreq.init_images = None
             img2imgreq.mask = None
 
+        if wants_stream(request):
+            place = self.queued(request, task_id=task_id)
+
+            def process(on_image_ready):
+                with place:
+                    return self.process_img2img(task_id, args, init_images, script_args, selectable_scripts, on_image_ready=on_image_ready)
+
+            return stream_multipart(process)
+
+        with self.queued(request, task_id=task_id):
+            processed = self.process_img2img(task_id, args, init_images, script_args, selectable_scripts)
+
+        b64images = encode_images_to_base64(processed.images) if send_images else []
+
         return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=processed.js())
 
-    def extras_single_image_api(self, req: models.ExtrasSingleImageRequest):
+    def process_img2img(self, task_id, args, init_images, script_args, selectable_scripts=None, *, on_image_ready=None):
+        """Runs img2img processing; the caller must hold the queue lock."""
+
+        script_runner = scripts.scripts_img2img
+
+        with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
+            p.init_images = [decode_base64_to_image(x) for x in init_images]
+            p.is_api = True
+            p.on_image_ready = on_image_ready
+            p.scripts = script_runner
+            p.outpath_grids = opts.outdir_img2img_grids
+            p.outpath_samples = opts.outdir_img2img_samples
+
+            try:
+                shared.state.begin(job="scripts_img2img")
+                start_task(task_id)
+                if selectable_scripts is not None:
+                    p.script_args = script_args
+                    processed = scripts.scripts_img2img.run(p, *p.script_args) # Need to pass args as list here
+                else:
+                    p.script_args = tuple(script_args) # Need to pass args as tuple here
+                    processed = process_images(p)
+                finish_task(task_id)
+            finally:
+                shared.state.end()
+                shared.total_tqdm.clear()
+
+        return processed
+
+    def extras_single_image_api(self, req: models.ExtrasSingleImageRequest, request: Request = None):
         reqDict = setUpscalers(req)
 
         reqDict['image'] = decode_base64_to_image(reqDict['image'])
 
-        with self.queue_lock:
+        with self.queued(request):
             result = postprocessing.run_extras(extras_mode=0, image_folder="", input_dir="", output_dir="", save_output=False, **reqDict)
 
         return models.ExtrasSingleImageResponse(image=encode_pil_to_base64(result[0][0]), html_info=result[1])
 
-    def extras_batch_images_api(self, req: models.ExtrasBatchImagesRequest):
+    def extras_batch_images_api(self, req: models.ExtrasBatchImagesRequest, request: Request = None):
         reqDict = setUpscalers(req)
 
         image_list = reqDict.pop('imageList', [])
         image_folder = [decode_base64_to_image(x.data) for x in image_list]
 
-        with self.queue_lock:
+        if wants_stream(request):
+            place = self.queued(request)
+
+            def process(on_image_ready):
+                with place:
+                    result = postprocessing.run_extras(extras_mode=1, image_folder=image_folder, image="", input_dir="", output_dir="", save_output=False, on_image_ready=on_image_ready, **reqDict)
+
+                return json.dumps({"html_info": result[1]})
+
+            return stream_multipart(process)
+
+        with self.queued(request):
             result = postprocessing.run_extras(extras_mode=1, image_folder=image_folder, image="", input_dir="", output_dir="", save_output=False, **reqDict)
 
-        return models.ExtrasBatchImagesResponse(images=list(map(encode_pil_to_base64, result[0])), html_info=result[1])
+        return models.ExtrasBatchImagesResponse(images=encode_images_to_base64(result[0]), html_info=result[1])
 
     def pnginfoapi(self, req: models.PNGInfoRequest):
         image = decode_base64_to_image(req.image.strip())
@@ -627,7 +843,7 @@ class Api:
 
         return models.ProgressResponse(progress=progress, eta_relative=eta_relative, state=shared.state.dict(), current_image=current_image, textinfo=shared.state.textinfo, current_task=current_task)
 
-    def interrogateapi(self, interrogatereq: models.InterrogateRequest):
+    def interrogateapi(self, interrogatereq: models.InterrogateRequest, request: Request = None):
         image_b64 = interrogatereq.image
         if image_b64 is None:
             raise HTTPException(status_code=404, detail="Image not found")
@@ -636,7 +852,7 @@ class Api:
         img = img.convert('RGB')
 
         # Override object param
-        with self.queue_lock:
+        with self.queued(request, priority=fifo_lock.PRIORITY_INTERACTIVE):
             if interrogatereq.model == "clip":
                 processed = shared.interrogator.interrogate(img)
             elif interrogatereq.model == "deepdanbooru":
@@ -769,15 +985,15 @@ class Api:
         }
 
     def refresh_embeddings(self):
-        with self.queue_lock:
+        with self.queued(priority=fifo_lock.PRIORITY_INTERACTIVE):
             sd_hijack.model_hijack.embedding_db.load_textual_inversion_embeddings(force_reload=True)
 
     def refresh_checkpoints(self):
-        with self.queue_lock:
+        with self.queued(priority=fifo_lock.PRIORITY_INTERACTIVE):
             shared.refresh_checkpoints()
 
     def refresh_vae(self):
-        with self.queue_lock:
+        with self.queued(priority=fifo_lock.PRIORITY_INTERACTIVE):
             shared_items.refresh_vae_list()
 
     def create_embedding(self, args: dict):
@@ -848,6 +1064,9 @@ class Api:
         finally:
             shared.state.end()
 
+    def get_metrics(self):
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
     def get_memory(self):
         try:
             import os
@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+
+from fastapi.exceptions import HTTPException
+
+from modules import extra_networks, processing, progress
+from modules.shared import opts
+
+per_item_fields = ["prompt", "negative_prompt", "hr_prompt", "hr_negative_prompt", "seed", "subseed"]
+ignored_fields = ["force_task_id"]
+
+
+class BatchItem:
+    def __init__(self, task_id, args):
+        self.task_id = task_id
+        self.args = args
+        self.processed = None
+        self.images = None
+        self.info = None
+
+
+class PendingBatch:
+    def __init__(self, key):
+        self.key = key
+        self.items = []
+        self.closed = False
+        self.processed = None
+        self.finished = threading.Event()
+        self.error = None
+
+
+def is_batchable(req, args):
+    """Returns True if a txt2img request can be combined with other requests into one batch."""
+
+    if not opts.api_txt2img_batching:
+        return False
+
+    if req.script_name or req.alwayson_scripts or req.infotext or args.get("trace"):
+        return False
+
+    if (args.get("batch_size") or 1) != 1 or (args.get("n_iter") or 1) != 1:
+        return False
+
+    return all(not isinstance(args.get(field), list) for field in per_item_fields)
+
+
+def batch_key(args):
+    """
+    Requests with equal keys differ only in per-item fields and can be sampled together.
+
+    Prompts are per-item, but extra networks in them (<lora:...> and such) are activated for the whole batch,
+    so they are part of the key.
+    """
+
+    shared_args = {k: v for k, v in args.items() if k not in per_item_fields and k not in ignored_fields}
+    shared_args["extra_networks"] = extra_networks.extra_networks_key(*(args.get(field) for field in ["prompt", "negative_prompt", "hr_prompt", "hr_negative_prompt"]))
+    return json.dumps(shared_args, sort_keys=True, default=str)
+
+
+def combine_args(items):
+    args = dict(items[0].args)
+    for field in ignored_fields:
+        args.pop(field, None)
+
+    args["prompt"] = [item.args.get("prompt") or "" for item in items]
+    args["negative_prompt"] = [item.args.get("negative_prompt") or "" for item in items]
+    args["hr_prompt"] = [item.args.get("hr_prompt") or prompt for item, prompt in zip(items, args["prompt"])]
+    args["hr_negative_prompt"] = [item.args.get("hr_negative_prompt") or prompt for item, prompt in zip(items, args["negative_prompt"])]
+    args["seed"] = [processing.get_fixed_seed(item.args.get("seed")) for item in items]
+    args["subseed"] = [processing.get_fixed_seed(item.args.get("subseed")) for item in items]
+    args["batch_size"] = len(items)
+    args["n_iter"] = 1
+    args["do_not_save_grid"] = True
+
+    return args
+
+
+def split_info(info, index):
+    """Makes the info json of a combined batch look like the result of the index-th request made on its own."""
+
+    obj = json.loads(info)
+
+    for field in ["all_prompts", "all_negative_prompts", "all_seeds", "all_subseeds", "infotexts"]:
+        values = obj.get(field) or []
+        if index < len(values):
+            obj[field] = [values[index]]
+
+    obj["prompt"] = obj["all_prompts"][0]
+    obj["negative_prompt"] = obj["all_negative_prompts"][0]
+    obj["seed"] = obj["all_seeds"][0]
+    obj["subseed"] = obj["all_subseeds"][0]
+    obj["batch_size"] = 1
+    obj["index_of_first_image"] = 0
+
+    return json.dumps(obj)
+
+
+class Txt2ImgBatcher:
+    """
+    Coalesces compatible txt2img API requests into a single batch.
+
+    The first request for a given set of parameters becomes the leader of a pending batch: it waits for
+    api_txt2img_batching_window milliseconds, then for the queue lock, while other requests with the same parameters
+    join the batch. Once the leader gets the lock, the batch is closed, sampled with per-item prompts and seeds,
+    and the results are split back to each request.
+    """
+
+    def __init__(self, run_batch):
+        self.run_batch = run_batch
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def submit(self, task_id, args, request=None):
+        """Returns (processed, images, info) for this request, where images and info only cover this request's image."""
+
+        key = batch_key(args)
+        item = BatchItem(task_id, args)
+
+        with self.lock:
+            batch = self.pending.get(key)
+            is_leader = batch is None or batch.closed or len(batch.items) >= max(1, opts.api_txt2img_batching_max_size)
+            if is_leader:
+                batch = PendingBatch(key)
+                self.pending[key] = batch
+
+            batch.items.append(item)
+
+        if not is_leader:
+            batch.finished.wait()
+            if batch.error is not None:
+                raise batch.error
+
+            return item.processed, item.images, item.info
+
+        try:
+            time.sleep(max(opts.api_txt2img_batching_window, 0) / 1000)
+            batch.processed = self.run_batch(batch, request)
+            self.split_results(batch)
+        except Exception as e:
+            batch.error = e
+            raise
+        finally:
+            self.close_batch(batch)
+
+            for other in batch.items[1:]:
+                progress.finish_task(other.task_id)
+                progress.remove_task_from_queue(other.task_id)
+
+            batch.finished.set()
+
+        return item.processed, item.images, item.info
+
+    def close_batch(self, batch):
+        """Stops accepting new requests into the batch; run_batch must call this once it holds the queue lock."""
+
+        with self.lock:
+            batch.closed = True
+            if self.pending.get(batch.key) is batch:
+                del self.pending[batch.key]
+
+    def split_results(self, batch):
+        processed = batch.processed
+        count = len(batch.items)
+        first = processed.index_of_first_image
+        images = processed.images[first:]
+
+        # without one image per request there is no telling which image belongs to whom, and giving everyone
+        # everything would send images, prompts and seeds of other clients to each of them
+        if len(images) != count:
+            raise HTTPException(status_code=500, detail=f"Batched request produced {len(images)} images for {count} requests")
+
+        info = processed.js()
+
+        for index, item in enumerate(batch.items):
+            item.processed = processed
+            item.images = [images[index]]
+            item.info = split_info(info, index)
@@ -3,9 +3,21 @@ from functools import wraps
 import html
 import time
 
+import gradio as gr
+
 from modules import shared, progress, errors, devices, fifo_lock, profiling
 
-queue_lock = fifo_lock.FIFOLock()
+queue_lock = fifo_lock.PriorityFIFOLock(max_queue_depth=lambda: shared.opts.queue_max_depth)
+
+
+def gradio_client(args, kwargs):
+    """Returns an identifier of the browser session that made the call, for fair scheduling between UI users."""
+
+    for arg in list(args) + list(kwargs.values()):
+        if isinstance(arg, gr.Request):
+            return getattr(arg, "session_hash", None) or getattr(arg, "username", None) or (arg.client.host if arg.client else None) or "ui"
+
+    return "ui"
 
 
 def wrap_queued_call(func):
@@ -29,7 +41,13 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
         else:
             id_task = None
 
-        with queue_lock:
+        try:
+            queue_lock.acquire(priority=fifo_lock.PRIORITY_INTERACTIVE, client=gradio_client(args, kwargs), task_id=id_task)
+        except fifo_lock.QueueFullError:
+            progress.remove_task_from_queue(id_task)
+            raise
+
+        try:
             shared.state.begin(job=id_task)
             progress.start_task(id_task)
 
@@ -40,6 +58,8 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
                 progress.finish_task(id_task)
 
             shared.state.end()
+        finally:
+            queue_lock.release()
 
         return res
 
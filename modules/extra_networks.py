@@ -191,6 +191,22 @@ def parse_prompt(prompt):
     return prompt, res
 
 
+def extra_networks_key(*prompts):
+    """
+    Returns the extra networks used by the prompts as a JSON-serializable value that can be compared.
+
+    parse_prompts only activates extra networks of the first prompt in a batch, so prompts can only be generated
+    in one batch if they give the same value here.
+    """
+
+    res = []
+    for prompt in prompts:
+        _, extra_data = parse_prompt(prompt or "")
+        res.append(sorted([name, [params.items for params in params_list]] for name, params_list in extra_data.items()))
+
+    return res
+
+
 def parse_prompts(prompts):
     res = []
     extra_data = None
@@ -1,3 +1,5 @@
+import collections
+import concurrent.futures
 import os
 import re
 import shutil
@@ -7,10 +9,9 @@ import json
 import torch
 import tqdm
 
-from modules import shared, images, sd_models, sd_vae, sd_models_config, errors
+from modules import shared, images, sd_models, sd_vae, sd_models_config, errors, safetensors_stream
 from modules.ui_common import plaintext_to_html
 import gradio as gr
-import safetensors.torch
 
 
 def run_pnginfo(image):
@@ -127,7 +128,7 @@ def run_modelmerger(id_task, primary_model_name, secondary_model_name, tertiary_
         "No interpolation": (filename_nothing, None, None),
     }
     filename_generator, theta_func1, theta_func2 = theta_funcs[interp_method]
-    shared.state.job_count = (1 if theta_func1 else 0) + (1 if theta_func2 else 0)
+    shared.state.job_count = 1
 
     if not primary_model_name:
         return fail("Failed: Merging requires a primary model.")
@@ -147,51 +148,49 @@ def run_modelmerger(id_task, primary_model_name, secondary_model_name, tertiary_
     result_is_inpainting_model = False
     result_is_instruct_pix2pix_model = False
 
+    shared.state.textinfo = "Opening models"
+    print(f"Opening {primary_model_info.filename}...")
+    theta_0 = safetensors_stream.StateDictReader(primary_model_info.filename)
+
     if theta_func2:
-        shared.state.textinfo = "Loading B"
-        print(f"Loading {secondary_model_info.filename}...")
-        theta_1 = sd_models.read_state_dict(secondary_model_info.filename, map_location='cpu')
+        print(f"Opening {secondary_model_info.filename}...")
+        theta_1 = safetensors_stream.StateDictReader(secondary_model_info.filename)
     else:
         theta_1 = None
 
     if theta_func1:
-        shared.state.textinfo = "Loading C"
-        print(f"Loading {tertiary_model_info.filename}...")
-        theta_2 = sd_models.read_state_dict(tertiary_model_info.filename, map_location='cpu')
-
-        shared.state.textinfo = 'Merging B and C'
-        shared.state.sampling_steps = len(theta_1.keys())
-        for key in tqdm.tqdm(theta_1.keys()):
-            if key in checkpoint_dict_skip_on_merge:
-                continue
-
-            if 'model' in key:
-                if key in theta_2:
-                    t2 = theta_2.get(key, torch.zeros_like(theta_1[key]))
-                    theta_1[key] = theta_func1(theta_1[key], t2)
-                else:
-                    theta_1[key] = torch.zeros_like(theta_1[key])
+        print(f"Opening {tertiary_model_info.filename}...")
+        theta_2 = safetensors_stream.StateDictReader(tertiary_model_info.filename)
+    else:
+        theta_2 = None
 
-            shared.state.sampling_step += 1
-        del theta_2
+    vae_dict = {}
+    bake_in_vae_filename = sd_vae.vae_dict.get(bake_in_vae, None)
+    if bake_in_vae_filename is not None:
+        print(f"Baking in VAE from {bake_in_vae_filename}")
+        vae_dict = sd_vae.load_vae_dict(bake_in_vae_filename, map_location='cpu')
+
+    vae_keys = {'first_stage_model.' + key: key for key in vae_dict if 'first_stage_model.' + key in theta_0}
+
+    def read(source, key):
+        return source[key] if isinstance(source, dict) else source.get(key)
 
-        shared.state.nextjob()
+    def read_meta(source, key):
+        return torch.empty_like(source[key], device='meta') if isinstance(source, dict) else source.meta(key)
 
-    shared.state.textinfo = f"Loading {primary_model_info.filename}..."
-    print(f"Loading {primary_model_info.filename}...")
-    theta_0 = sd_models.read_state_dict(primary_model_info.filename, map_location='cpu')
+    def merge_tensor(key, get):
+        """Returns the tensor the merged model has at key; get is read or read_meta, the latter to find out its dtype and shape without reading anything."""
 
-    print("Merging...")
-    shared.state.textinfo = 'Merging A and B'
-    shared.state.sampling_steps = len(theta_0.keys())
-    for key in tqdm.tqdm(theta_0.keys()):
-        if theta_1 and 'model' in key and key in theta_1:
+        nonlocal result_is_inpainting_model, result_is_instruct_pix2pix_model
 
-            if key in checkpoint_dict_skip_on_merge:
-                continue
+        if key in vae_keys:
+            value = to_half(get(vae_dict, vae_keys[key]), save_as_half)
+        elif theta_1 is not None and 'model' in key and key in theta_1 and key not in checkpoint_dict_skip_on_merge:
+            a = get(theta_0, key)
+            b = get(theta_1, key)
 
-            a = theta_0[key]
-            b = theta_1[key]
+            if theta_func1:
+                b = theta_func1(b, get(theta_2, key)) if key in theta_2 else torch.zeros_like(b)
 
             # this enables merging an inpainting model (A) with another one (B);
             # where normal model would have 4 channels, for latenst space, inpainting model would
@@ -202,44 +201,38 @@ def run_modelmerger(id_task, primary_model_name, secondary_model_name, tertiary_
                 if a.shape[1] == 4 and b.shape[1] == 8:
                     raise RuntimeError("When merging instruct-pix2pix model with a normal one, A must be the instruct-pix2pix model.")
 
+                value = a.clone()
                 if a.shape[1] == 8 and b.shape[1] == 4:#If we have an Instruct-Pix2Pix model...
-                    theta_0[key][:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)#Merge only the vectors the models have in common.  Otherwise we get an error due to dimension mismatch.
+                    value[:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)#Merge only the vectors the models have in common.  Otherwise we get an error due to dimension mismatch.
                     result_is_instruct_pix2pix_model = True
                 else:
                     assert a.shape[1] == 9 and b.shape[1] == 4, f"Bad dimensions for merged layer {key}: A={a.shape}, B={b.shape}"
-                    theta_0[key][:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)
+                    value[:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)
                     result_is_inpainting_model = True
             else:
-                theta_0[key] = theta_func2(a, b, multiplier)
-
-            theta_0[key] = to_half(theta_0[key], save_as_half)
-
-        shared.state.sampling_step += 1
-
-    del theta_1
+                value = theta_func2(a, b, multiplier)
 
-    bake_in_vae_filename = sd_vae.vae_dict.get(bake_in_vae, None)
-    if bake_in_vae_filename is not None:
-        print(f"Baking in VAE from {bake_in_vae_filename}")
-        shared.state.textinfo = 'Baking in VAE'
-        vae_dict = sd_vae.load_vae_dict(bake_in_vae_filename, map_location='cpu')
+            value = to_half(value, save_as_half)
+        else:
+            value = get(theta_0, key)
 
-        for key in vae_dict.keys():
-            theta_0_key = 'first_stage_model.' + key
-            if theta_0_key in theta_0:
-                theta_0[theta_0_key] = to_half(vae_dict[key], save_as_half)
+        if save_as_half and not theta_func2:
+            value = to_half(value, save_as_half)
 
-        del vae_dict
-
-    if save_as_half and not theta_func2:
-        for key in theta_0.keys():
-            theta_0[key] = to_half(theta_0[key], save_as_half)
+        return value
 
+    keys = theta_0.keys()
     if discard_weights:
         regex = re.compile(discard_weights)
-        for key in list(theta_0):
-            if re.search(regex, key):
-                theta_0.pop(key, None)
+        keys = [key for key in keys if not re.search(regex, key)]
+
+    # find out dtypes and shapes of the merged tensors before reading any of them; this also finds
+    # errors like a mismatched inpainting model before any work is done
+    layout = []
+    for key in keys:
+        value = merge_tensor(key, read_meta)
+        if isinstance(value, torch.Tensor):
+            layout.append((key, value.dtype, tuple(value.shape)))
 
     ckpt_dir = shared.cmd_opts.ckpt_dir or sd_models.model_path
 
@@ -250,9 +243,30 @@ def run_modelmerger(id_task, primary_model_name, secondary_model_name, tertiary_
 
     output_modelname = os.path.join(ckpt_dir, filename)
 
-    shared.state.nextjob()
-    shared.state.textinfo = "Saving"
-    print(f"Saving to {output_modelname}...")
+    def merged_tensors():
+        """Yields (key, tensor) for the merged model in layout order; with more than one worker, following tensors are merged while the current one is written."""
+
+        workers = max(1, int(shared.opts.checkpoint_merger_workers))
+        if workers == 1:
+            for key, _, _ in layout:
+                yield key, merge_tensor(key, read)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="checkpoint_merger") as executor:
+            pending = collections.deque()
+            for key, _, _ in layout:
+                pending.append((key, executor.submit(merge_tensor, key, read)))
+                if len(pending) > workers:
+                    key, future = pending.popleft()
+                    yield key, future.result()
+
+            while pending:
+                key, future = pending.popleft()
+                yield key, future.result()
+
+    shared.state.textinfo = "Merging"
+    shared.state.sampling_steps = len(layout)
+    print(f"Merging and saving to {output_modelname}...")
 
     metadata = {}
 
@@ -312,9 +326,22 @@ def run_modelmerger(id_task, primary_model_name, secondary_model_name, tertiary_
 
     _, extension = os.path.splitext(output_modelname)
     if extension.lower() == ".safetensors":
-        safetensors.torch.save_file(theta_0, output_modelname, metadata=metadata if len(metadata)>0 else None)
+        with safetensors_stream.SafetensorsWriter(output_modelname, layout, metadata=metadata if len(metadata)>0 else None) as writer:
+            for key, tensor in tqdm.tqdm(merged_tensors(), total=len(layout)):
+                writer.write(key, tensor)
+                shared.state.sampling_step += 1
     else:
-        torch.save(theta_0, output_modelname)
+        state_dict = {}
+        for key, tensor in tqdm.tqdm(merged_tensors(), total=len(layout)):
+            state_dict[key] = tensor
+            shared.state.sampling_step += 1
+
+        torch.save(state_dict, output_modelname)
+        del state_dict
+
+    for reader in (theta_0, theta_1, theta_2):
+        if reader is not None:
+            reader.close()
 
     sd_models.list_models()
     created_model = next((ckpt for ckpt in sd_models.checkpoints_list.values() if ckpt.name == filename), None)
@@ -1,5 +1,7 @@
+import contextlib
 import threading
 import collections
+import time
 
 
 # reference: https://gist.github.com/vitaliyp/6d54dd76ca2c3cdfc1149d33007dc34a
@@ -35,3 +37,162 @@ class FIFOLock(object):
 
     def __exit__(self, t, v, tb):
         self.release()
+
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_API = "api"
+PRIORITY_BATCH = "batch"
+
+priorities = [PRIORITY_INTERACTIVE, PRIORITY_API, PRIORITY_BATCH]
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class QueuedWaiter:
+    def __init__(self, priority, client, task_id):
+        self.priority = priority
+        self.client = client
+        self.task_id = task_id
+        self.time_queued = time.time()
+        self.event = threading.Event()
+
+
+class PriorityFIFOLock(object):
+    """
+    A lock that hands itself over to waiting threads by priority class, then round-robin between clients within a class,
+    then in FIFO order for each client. Can be used as a drop-in replacement for FIFOLock; `with lock:` acquires it with
+    interactive priority.
+
+    max_queue_depth is a callable returning how many waiters are allowed; if the queue is full, acquire raises QueueFullError.
+    """
+
+    def __init__(self, max_queue_depth=None):
+        self._inner_lock = threading.Lock()
+        self._locked = False
+        self._pending = {priority: collections.OrderedDict() for priority in priorities}
+        self._max_queue_depth = max_queue_depth
+
+        self.holder = None
+        self.time_acquired = None
+        self.average_duration = {}
+
+    def _queue_depth(self):
+        return sum(len(waiters) for clients in self._pending.values() for waiters in clients.values())
+
+    def _pop_next_waiter(self):
+        for clients in self._pending.values():
+            if not clients:
+                continue
+
+            client, waiters = next(iter(clients.items()))
+            waiter = waiters.popleft()
+
+            del clients[client]
+            if waiters:
+                clients[client] = waiters  # moves the client to the end, so other clients of same priority go first
+
+            return waiter
+
+        return None
+
+    def _grant(self, waiter):
+        self._locked = True
+        self.holder = waiter
+        self.time_acquired = time.time()
+
+    def enqueue(self, *, priority=PRIORITY_INTERACTIVE, client=None, task_id=None):
+        """
+        Takes a place in the queue without waiting and returns the waiter; the lock is held once waiter.event is set,
+        which may already be the case on return. Raises QueueFullError if the queue is full.
+        """
+
+        if priority not in self._pending:
+            priority = PRIORITY_INTERACTIVE
+
+        waiter = QueuedWaiter(priority, client, task_id)
+
+        with self._inner_lock:
+            if not self._locked:
+                self._grant(waiter)
+                waiter.event.set()
+                return waiter
+
+            max_depth = self._max_queue_depth() if self._max_queue_depth else 0
+            if max_depth and self._queue_depth() >= max_depth:
+                raise QueueFullError(f"queue is full ({max_depth} tasks waiting)")
+
+            self._pending[priority].setdefault(client, collections.deque()).append(waiter)
+
+        return waiter
+
+    def acquire(self, blocking=True, *, priority=PRIORITY_INTERACTIVE, client=None, task_id=None):
+        if not blocking:
+            with self._inner_lock:
+                if self._locked:
+                    return False
+
+                self._grant(QueuedWaiter(priority if priority in self._pending else PRIORITY_INTERACTIVE, client, task_id))
+                return True
+
+        self.enqueue(priority=priority, client=client, task_id=task_id).event.wait()
+        return True
+
+    def release(self):
+        with self._inner_lock:
+            if self.holder is not None and self.time_acquired is not None:
+                duration = time.time() - self.time_acquired
+                previous = self.average_duration.get(self.holder.priority)
+                self.average_duration[self.holder.priority] = duration if previous is None else previous * 0.8 + duration * 0.2
+
+            waiter = self._pop_next_waiter()
+            if waiter is not None:
+                self._grant(waiter)
+                waiter.event.set()
+            else:
+                self._locked = False
+                self.holder = None
+                self.time_acquired = None
+
+    @contextlib.contextmanager
+    def queued(self, *, priority=PRIORITY_INTERACTIVE, client=None, task_id=None):
+        """Context manager version of acquire() that accepts scheduling parameters."""
+
+        self.acquire(priority=priority, client=client, task_id=task_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def waiters(self):
+        """Returns a list of waiters in the order they will acquire the lock."""
+
+        with self._inner_lock:
+            order = []
+            for clients in self._pending.values():
+                queues = [collections.deque(waiters) for waiters in clients.values()]
+                while queues:
+                    for waiters in queues:
+                        order.append(waiters.popleft())
+                    queues = [waiters for waiters in queues if waiters]
+
+            return order
+
+    def estimate_wait(self, position):
+        """Estimates how many seconds a waiter at zero-based position has to wait, based on how long previous holders held the lock."""
+
+        durations = list(self.average_duration.values())
+        if not durations:
+            return None
+
+        average = sum(durations) / len(durations)
+        holder_average = self.average_duration.get(self.holder.priority, average) if self.holder is not None else average
+        holder_elapsed = time.time() - self.time_acquired if self.time_acquired is not None else 0
+
+        return max(holder_average - holder_elapsed, 0) + average * position
+
+    __enter__ = acquire
+
+    def __exit__(self, t, v, tb):
+        self.release()
@@ -0,0 +1,168 @@
+import os
+import threading
+
+from modules import cache, errors
+
+
+class IndexedDir:
+    """
+    Contents of one directory as of the last time it was listed.
+
+    files maps file name to (name, size, mtime, ctime); dirs is the list of subdirectory names. mtime_ns is the
+    modification time of the directory itself, which changes whenever a file is added, removed or renamed in it.
+    """
+
+    def __init__(self, mtime_ns, files, dirs):
+        self.mtime_ns = mtime_ns
+        self.files = files
+        self.files_lower = {name.lower(): entry for name, entry in files.items()}
+        self.dirs = dirs
+
+    def __getstate__(self):
+        return self.mtime_ns, self.files, self.dirs
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class FileIndex:
+    """
+    An index of the files in model, Lora and embedding directories, shared by everything that lists them.
+
+    A directory is listed with a single scandir and remembered together with its mtime. Later lookups only stat the
+    directory and reuse the listing if its mtime has not changed, so a refresh of a large, mostly unchanged tree costs one
+    stat per directory instead of a listing and a stat per file. Listings are kept in the "file-index" cache, which makes
+    the first refresh after a restart just as cheap.
+
+    Files that are overwritten in place do not change the mtime of their directory; entries for those keep the size
+    and mtime they had when the directory was last listed.
+    """
+
+    def __init__(self):
+        self.dirs = {}
+        self.lock = threading.Lock()
+        self.scans = 0
+
+    def listdir(self, dirname):
+        """Returns IndexedDir for dirname, or None if it is not a directory."""
+
+        try:
+            mtime_ns = os.stat(dirname).st_mtime_ns
+        except OSError:
+            return None
+
+        key = os.path.abspath(dirname)
+
+        with self.lock:
+            indexed = self.dirs.get(key)
+
+        if indexed is None:
+            try:
+                indexed = cache.cache("file-index").get(key)
+            except Exception:
+                errors.report("Error reading file index", exc_info=True)
+
+        if indexed is not None and indexed.mtime_ns == mtime_ns:
+            with self.lock:
+                self.dirs[key] = indexed
+            return indexed
+
+        indexed = self.scan(dirname, mtime_ns)
+        if indexed is None:
+            return None
+
+        with self.lock:
+            self.dirs[key] = indexed
+
+        try:
+            cache.cache("file-index")[key] = indexed
+        except Exception:
+            errors.report("Error writing file index", exc_info=True)
+
+        return indexed
+
+    def scan(self, dirname, mtime_ns):
+        files = {}
+        dirs = []
+
+        try:
+            entries = list(os.scandir(dirname))
+        except OSError:
+            return None
+
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                    continue
+
+                stat = entry.stat()
+            except OSError:
+                continue
+
+            files[entry.name] = (entry.name, stat.st_size, stat.st_mtime, stat.st_ctime)
+
+        self.scans += 1
+
+        return IndexedDir(mtime_ns, files, dirs)
+
+    def find(self, path, ignore_case=False):
+        """Returns (name, size, mtime, ctime) for the file at path, or None if it does not exist."""
+
+        dirname, filename = os.path.split(path)
+        indexed = self.listdir(dirname or ".")
+        if indexed is None:
+            return None
+
+        entry = indexed.files.get(filename)
+        if entry is None and ignore_case:
+            entry = indexed.files_lower.get(filename.lower())
+
+        return entry
+
+    def walk(self, path):
+        """Like os.walk with followlinks=True, but using the index; yields (root, dirs, files) for path and all its subdirectories."""
+
+        visited = set()
+        pending = [path]
+
+        while pending:
+            root = pending.pop()
+
+            try:
+                real = os.path.realpath(root)
+            except OSError:
+                continue
+
+            # symlinks can create loops
+            if real in visited:
+                continue
+            visited.add(real)
+
+            indexed = self.listdir(root)
+            if indexed is None:
+                continue
+
+            yield root, indexed.dirs, list(indexed.files)
+
+            pending += [os.path.join(root, x) for x in reversed(indexed.dirs)]
+
+    def invalidate(self, dirname=None):
+        """Makes the next lookup list dirname (or all directories) again, even if its mtime has not changed."""
+
+        with self.lock:
+            if dirname is None:
+                self.dirs.clear()
+            else:
+                self.dirs.pop(os.path.abspath(dirname), None)
+
+        try:
+            if dirname is None:
+                cache.cache("file-index").clear()
+            else:
+                cache.cache("file-index").pop(os.path.abspath(dirname), None)
+        except Exception:
+            errors.report("Error clearing file index", exc_info=True)
+
+
+file_index = FileIndex()
@@ -1,5 +1,7 @@
+import concurrent.futures
 import hashlib
 import os.path
+import threading
 
 from modules import shared
 import modules.cache
@@ -7,16 +9,57 @@ import modules.cache
 dump_cache = modules.cache.dump_cache
 cache = modules.cache.cache
 
+read_block_size = 16 * 1024 * 1024
+
+hashing_executor = None
+hashing_lock = threading.Lock()
+hashing_futures = {}
+
 
 def calculate_sha256(filename):
+    return calculate_file_hashes(filename, with_addnet=False)[0]
+
+
+def calculate_file_hashes(filename, with_addnet=None):
+    """
+    Reads the file once and returns a tuple of (full sha256, kohya-ss addnet hash).
+
+    The addnet hash covers everything after the safetensors header; it is only computed when with_addnet is True,
+    or, if with_addnet is None, when the file is a .safetensors file. Otherwise the second element is None.
+    """
+
+    if with_addnet is None:
+        with_addnet = filename.lower().endswith(".safetensors")
+
     hash_sha256 = hashlib.sha256()
-    blksize = 1024 * 1024
+    hash_addnet = hashlib.sha256() if with_addnet else None
+    addnet_offset = None
 
-    with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(blksize), b""):
+    buffer = bytearray(read_block_size)
+    view = memoryview(buffer)
+    position = 0
+
+    with open(filename, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+
+            chunk = view[:size]
             hash_sha256.update(chunk)
 
-    return hash_sha256.hexdigest()
+            if hash_addnet is not None:
+                if addnet_offset is None:
+                    if size < 8:
+                        raise ValueError(f"{filename} is too short to be a safetensors file")
+                    addnet_offset = int.from_bytes(chunk[:8], "little") + 8
+
+                if position + size > addnet_offset:
+                    hash_addnet.update(chunk[max(0, addnet_offset - position):])
+
+            position += size
+
+    return hash_sha256.hexdigest(), hash_addnet.hexdigest() if hash_addnet is not None else None
 
 
 def sha256_from_cache(filename, title, use_addnet_hash=False):
@@ -38,38 +81,130 @@ def sha256_from_cache(filename, title, use_addnet_hash=False):
     return cached_sha256
 
 
-def sha256(filename, title, use_addnet_hash=False):
-    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
+def get_hashing_executor():
+    global hashing_executor
+
+    with hashing_lock:
+        if hashing_executor is None:
+            workers = max(1, int(getattr(shared.opts, "hashing_workers", 2) or 1))
+            hashing_executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashing")
+
+    return hashing_executor
+
+
+def hash_file_and_store(filename, title, use_addnet_hash):
+    """Hashes the file in one pass and stores both the full and addnet hash, so a later request for the other kind is free."""
+
+    mtime = os.path.getmtime(filename)
+    with_addnet = True if use_addnet_hash else None
+
+    print(f"Calculating sha256 for {filename}")
+    sha256_value, addnet_value = calculate_file_hashes(filename, with_addnet=with_addnet)
+
+    cache("hashes")[title] = {"mtime": mtime, "sha256": sha256_value}
+    if addnet_value is not None:
+        cache("hashes-addnet")[title] = {"mtime": mtime, "sha256": addnet_value}
+
+    dump_cache()
+
+    return addnet_value if use_addnet_hash else sha256_value
+
+
+def hashing_task(filename, title, use_addnet_hash):
+    pending = cache("hashes-pending")
+    key = (filename, use_addnet_hash)
+
+    try:
+        return hash_file_and_store(filename, title, use_addnet_hash)
+    finally:
+        pending.pop((title, use_addnet_hash), None)
+
+        with hashing_lock:
+            hashing_futures.pop(key, None)
+
+
+def sha256_async(filename, title, use_addnet_hash=False):
+    """
+    Returns a concurrent.futures.Future that resolves to the hash of the file.
+
+    The hash is calculated on a background thread pool; if the value is already cached, the returned future is already done.
+    If the file is already being hashed, the existing future is returned. Returns None if hashing is disabled.
+    """
 
     sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
     if sha256_value is not None:
-        return sha256_value
+        future = concurrent.futures.Future()
+        future.set_result(sha256_value)
+        return future
 
     if shared.cmd_opts.no_hashing:
         return None
 
-    print(f"Calculating sha256 for {filename}: ", end='')
-    if use_addnet_hash:
-        with open(filename, "rb") as file:
-            sha256_value = addnet_hash_safetensors(file)
-    else:
-        sha256_value = calculate_sha256(filename)
-    print(f"{sha256_value}")
+    executor = get_hashing_executor()
+    key = (filename, use_addnet_hash)
 
-    hashes[title] = {
-        "mtime": os.path.getmtime(filename),
-        "sha256": sha256_value,
-    }
+    with hashing_lock:
+        future = hashing_futures.get(key)
+        if future is not None:
+            return future
 
-    dump_cache()
+        cache("hashes-pending")[(title, use_addnet_hash)] = filename
+
+        future = executor.submit(hashing_task, filename, title, use_addnet_hash)
+        hashing_futures[key] = future
+
+    return future
+
+
+def hash_status(filename, title, use_addnet_hash=False):
+    """Returns "done" if the hash is cached, "pending" if it is being calculated, and None otherwise."""
+
+    if sha256_from_cache(filename, title, use_addnet_hash) is not None:
+        return "done"
+
+    with hashing_lock:
+        if (filename, use_addnet_hash) in hashing_futures:
+            return "pending"
+
+    return None
 
-    return sha256_value
+
+def sha256(filename, title, use_addnet_hash=False, wait=True):
+    """
+    Returns the hash of the file, calculating it if needed.
+
+    With wait=False, this does not block: the hash is scheduled on the background pool and None is returned until it is ready.
+    """
+
+    future = sha256_async(filename, title, use_addnet_hash)
+    if future is None:
+        return None
+
+    if not wait and not future.done():
+        return None
+
+    return future.result()
+
+
+def resume_pending():
+    """Schedules hashing for files that were queued but not finished before the last shutdown."""
+
+    pending = cache("hashes-pending")
+
+    for key in list(pending):
+        filename = pending.get(key)
+        if not filename or not os.path.isfile(filename):
+            pending.pop(key, None)
+            continue
+
+        title, use_addnet_hash = key
+        sha256_async(filename, title, use_addnet_hash)
 
 
 def addnet_hash_safetensors(b):
     """kohya-ss hash for safetensors from https://github.com/kohya-ss/sd-scripts/blob/main/library/train_util.py"""
     hash_sha256 = hashlib.sha256()
-    blksize = 1024 * 1024
+    blksize = read_block_size
 
     b.seek(0)
     header = b.read(8)
@@ -81,4 +216,3 @@ def addnet_hash_safetensors(b):
         hash_sha256.update(chunk)
 
     return hash_sha256.hexdigest()
-
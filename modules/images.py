@@ -20,8 +20,10 @@ import pillow_avif # noqa: F401
 import string
 import json
 import hashlib
+import threading
+import concurrent.futures
 
-from modules import sd_samplers, shared, script_callbacks, errors, stealth_infotext
+from modules import sd_samplers, shared, script_callbacks, errors, stealth_infotext, metrics, profiling
 from modules.paths_internal import roboto_ttf_file
 from modules.shared import opts
 
@@ -35,7 +37,24 @@ def get_font(fontsize: int):
         return ImageFont.truetype(roboto_ttf_file, fontsize)
 
 
+def image_size(img):
+    """Returns the size of img, which can also be a filename; then only the header of the file is read."""
+
+    if isinstance(img, str):
+        with Image.open(img) as image:
+            return image.size
+
+    return img.size
+
+
 def image_grid(imgs, batch_size=1, rows=None):
+    """
+    Puts images into a grid; imgs can also contain filenames, which are read one at a time while the grid is assembled.
+
+    Extensions that use on_image_grid expect PIL images in params.imgs, so if any are registered, filenames are read
+    before the callback is called.
+    """
+
     if rows is None:
         if opts.n_rows > 0:
             rows = opts.n_rows
@@ -53,14 +72,20 @@ def image_grid(imgs, batch_size=1, rows=None):
 
     cols = math.ceil(len(imgs) / rows)
 
+    if script_callbacks.callback_map['callbacks_image_grid'] and any(isinstance(img, str) for img in imgs):
+        imgs = [read(img) if isinstance(img, str) else img for img in imgs]
+
     params = script_callbacks.ImageGridLoopParams(imgs, cols, rows)
     script_callbacks.image_grid_callback(params)
 
-    w, h = map(max, zip(*(img.size for img in imgs)))
+    w, h = map(max, zip(*(image_size(img) for img in imgs)))
     grid_background_color = ImageColor.getcolor(opts.grid_background_color, 'RGBA')
     grid = Image.new('RGBA', size=(params.cols * w, params.rows * h), color=grid_background_color)
 
     for i, img in enumerate(params.imgs):
+        if isinstance(img, str):
+            img = read(img)
+
         img_w, img_h = img.size
         w_offset, h_offset = 0 if img_w == w else (w - img_w) // 2, 0 if img_h == h else (h - img_h) // 2
         grid.paste(img, box=(i % params.cols * w + w_offset, i // params.cols * h + h_offset))
@@ -577,6 +602,169 @@ def get_next_sequence_number(path, basename):
     return result + 1
 
 
+sequence_sidecar_filename = ".sequence_numbers.json"
+sequence_lock = threading.Lock()
+sequence_directories = {}
+
+
+class SequenceDirectory:
+    """Next free sequence numbers for a directory, valid as long as the directory's mtime is mtime_ns."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime_ns = None
+        self.next_numbers = {}
+        self.reserved = {}
+        self.writes_in_progress = 0
+
+    def sidecar_path(self):
+        return os.path.join(self.path, sequence_sidecar_filename)
+
+    def load_sidecar(self):
+        try:
+            with open(self.sidecar_path(), "r", encoding="utf8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except Exception:
+            errors.report(f"Error reading {self.sidecar_path()}", exc_info=True)
+            return
+
+        if data.get("mtime_ns") == self.mtime_ns:
+            self.next_numbers = {k: int(v) for k, v in data.get("next_numbers", {}).items()}
+
+    def save_sidecar(self):
+        # the file is rewritten in place, so that only its creation changes the directory's mtime
+        try:
+            with open(self.sidecar_path(), "w", encoding="utf8") as file:
+                json.dump({"mtime_ns": self.mtime_ns, "next_numbers": self.next_numbers}, file)
+        except Exception:
+            errors.report(f"Error writing {self.sidecar_path()}", exc_info=True)
+
+
+def reserve_sequence_number(path, basename, filename_for_number):
+    """
+    Returns the sequence number to use for a new image in the directory, and reserves it, so that concurrent
+    savers get different numbers.
+
+    Instead of listing the directory on every call, the next number is kept in memory and in a sidecar file in the
+    directory. It is only recalculated with get_next_sequence_number when the directory was changed by something
+    other than save_image. filename_for_number(number) returns the full filename for a number; numbers whose file
+    already exists are skipped.
+    """
+
+    key = os.path.abspath(path)
+
+    with sequence_lock:
+        directory = sequence_directories.get(key)
+        if directory is None:
+            directory = sequence_directories[key] = SequenceDirectory(key)
+
+        # while files are being written in the background, the mtime changes because of our own writes
+        mtime_ns = os.stat(path).st_mtime_ns
+        if directory.mtime_ns != mtime_ns and directory.writes_in_progress == 0:
+            directory.mtime_ns = mtime_ns
+            directory.next_numbers = {}
+            if opts.save_images_sequence_sidecar:
+                directory.load_sidecar()
+
+        number = directory.next_numbers.get(basename)
+        if number is None:
+            number = get_next_sequence_number(path, basename)
+
+        # numbers given to savers that are still writing their files are not visible in the directory yet
+        number = max(number, directory.reserved.get(basename, 0))
+
+        for _ in range(500):
+            if not os.path.exists(filename_for_number(number)):
+                break
+            number += 1
+
+        directory.next_numbers[basename] = number + 1
+        directory.reserved[basename] = number + 1
+        directory.writes_in_progress += 1
+
+    return number
+
+
+def sequence_directory_changed(path, reserved=False):
+    """
+    Tells the sequence number cache that save_image has finished writing files to the directory;
+    reserved must be True if the filename was obtained from reserve_sequence_number.
+    """
+
+    key = os.path.abspath(path)
+
+    with sequence_lock:
+        directory = sequence_directories.get(key)
+        if directory is None:
+            return
+
+        if reserved:
+            directory.writes_in_progress = max(0, directory.writes_in_progress - 1)
+
+        directory.mtime_ns = os.stat(path).st_mtime_ns
+        if opts.save_images_sequence_sidecar:
+            directory.save_sidecar()
+
+
+save_executor = None
+save_executor_lock = threading.Lock()
+save_slots = None
+save_futures = set()
+
+
+def get_save_executor():
+    global save_executor, save_slots
+
+    with save_executor_lock:
+        if save_executor is None:
+            save_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(opts.save_images_background_workers)), thread_name_prefix="image_save")
+            save_slots = threading.BoundedSemaphore(max(1, int(opts.save_images_background_queue)))
+
+    return save_executor
+
+
+def submit_background_save(func):
+    """
+    Runs func on the image saving thread pool. If too many saves are already pending,
+    blocks until one of them finishes, so that unsaved images do not pile up in memory.
+    """
+
+    executor = get_save_executor()
+    save_slots.acquire()
+
+    def task():
+        try:
+            func()
+        except Exception as e:
+            errors.display(e, "saving image")
+        finally:
+            save_slots.release()
+
+    future = executor.submit(task)
+
+    with save_executor_lock:
+        save_futures.add(future)
+    future.add_done_callback(lambda f: discard_save_future(f))
+
+    return future
+
+
+def discard_save_future(future):
+    with save_executor_lock:
+        save_futures.discard(future)
+
+
+def wait_for_background_saves():
+    """Blocks until all images given to save_image with background=True are written to disk."""
+
+    with save_executor_lock:
+        futures = list(save_futures)
+
+    concurrent.futures.wait(futures)
+
+
 def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_pnginfo=None, pnginfo_section_name='parameters'):
     """
     Saves image to filename, including geninfo as text information for generation info.
@@ -656,7 +844,7 @@ def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_p
         image.save(filename, format=image_format, quality=opts.jpeg_quality)
 
 
-def save_image(image, path, basename, seed=None, prompt=None, extension='png', info=None, short_filename=False, no_prompt=False, grid=False, pnginfo_section_name='parameters', p=None, existing_info=None, forced_filename=None, suffix="", save_to_dirs=None):
+def save_image(image, path, basename, seed=None, prompt=None, extension='png', info=None, short_filename=False, no_prompt=False, grid=False, pnginfo_section_name='parameters', p=None, existing_info=None, forced_filename=None, suffix="", save_to_dirs=None, background=False):
     """Save an image.
 
     Args:
@@ -682,6 +870,9 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             If specified, `basename` and filename pattern will be ignored.
         save_to_dirs (bool):
             If true, the image will be saved into a subdirectory of `path`.
+        background (bool):
+            If true, the image is encoded and written to disk on a background thread; the filenames are still
+            decided and returned immediately. Use `wait_for_background_saves` to wait until the files are written.
 
     Returns: (fullfn, txt_fullfn)
         fullfn (`str`):
@@ -690,6 +881,7 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             If a text file is saved for this image, this will be its full path. Otherwise None.
     """
     namegen = FilenameGenerator(p, seed, prompt, image, basename=basename)
+    reserved_number = False
 
     # WebP and JPG formats have maximum dimension limits of 16383 and 65535 respectively. switch to PNG which has a much higher limit
     if (image.height > 65535 or image.width > 65535) and extension.lower() in ("jpg", "jpeg") or (image.height > 16383 or image.width > 16383) and extension.lower() == "webp":
@@ -721,31 +913,47 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             file_decoration = f"-{file_decoration}"
 
         if add_number:
-            basecount = get_next_sequence_number(path, basename)
-            fullfn = None
-            for i in range(500):
-                fn = f"{basecount + i:05}" if basename == '' else f"{basename}-{basecount + i:04}"
-                fullfn = os.path.join(path, f"{fn}{file_decoration}.{extension}")
-                if not os.path.exists(fullfn):
-                    break
+            def filename_for_number(number):
+                fn = f"{number:05}" if basename == '' else f"{basename}-{number:04}"
+                return os.path.join(path, f"{fn}{file_decoration}.{extension}")
+
+            fullfn = filename_for_number(reserve_sequence_number(path, basename, filename_for_number))
+            reserved_number = True
         else:
             fullfn = os.path.join(path, f"{file_decoration}.{extension}")
     else:
         fullfn = os.path.join(path, f"{forced_filename}.{extension}")
 
-    pnginfo = existing_info or {}
-    if info is not None:
-        pnginfo[pnginfo_section_name] = info
+    # the reserved number is released when write_files finishes; if anything fails before that, release it here,
+    # or the directory would be considered busy and never rescanned again
+    try:
+        pnginfo = existing_info or {}
+        if info is not None:
+            pnginfo[pnginfo_section_name] = info
 
-    params = script_callbacks.ImageSaveParams(image, p, fullfn, pnginfo)
-    if opts.enable_pnginfo:
-        stealth_infotext.add_stealth_pnginfo(params)
+        params = script_callbacks.ImageSaveParams(image, p, fullfn, pnginfo)
+        if opts.enable_pnginfo:
+            stealth_infotext.add_stealth_pnginfo(params)
 
-    script_callbacks.before_image_saved_callback(params)
+        script_callbacks.before_image_saved_callback(params)
 
-    image = params.image
-    fullfn = params.filename
-    info = params.pnginfo.get(pnginfo_section_name, None)
+        image = params.image
+        fullfn = params.filename
+        info = params.pnginfo.get(pnginfo_section_name, None)
+
+        fullfn_without_extension, extension = os.path.splitext(params.filename)
+        if hasattr(os, 'statvfs'):
+            max_name_len = os.statvfs(path).f_namemax
+            fullfn_without_extension = fullfn_without_extension[:max_name_len - max(4, len(extension))]
+            params.filename = fullfn_without_extension + extension
+            fullfn = params.filename
+
+        image.already_saved_as = fullfn
+        txt_fullfn = f"{fullfn_without_extension}.txt" if opts.save_txt and info is not None else None
+    except BaseException:
+        if reserved_number:
+            sequence_directory_changed(path, reserved=True)
+        raise
 
     def _atomically_save_image(image_to_save, filename_without_extension, extension):
         """
@@ -763,44 +971,46 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
                 filename = f"{filename_without_extension}-{n}{extension}"
         os.replace(temp_file_path, filename)
 
-    fullfn_without_extension, extension = os.path.splitext(params.filename)
-    if hasattr(os, 'statvfs'):
-        max_name_len = os.statvfs(path).f_namemax
-        fullfn_without_extension = fullfn_without_extension[:max_name_len - max(4, len(extension))]
-        params.filename = fullfn_without_extension + extension
-        fullfn = params.filename
-    _atomically_save_image(image, fullfn_without_extension, extension)
+    @metrics.image_save.time()
+    @profiling.span("save_image")
+    def write_files():
+        nonlocal image
 
-    image.already_saved_as = fullfn
+        try:
+            _atomically_save_image(image, fullfn_without_extension, extension)
+
+            oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
+            if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
+                ratio = image.width / image.height
+                resize_to = None
+                if oversize and ratio > 1:
+                    resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
+                elif oversize:
+                    resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
+
+                if resize_to is not None:
+                    try:
+                        # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
+                        image = image.resize(resize_to, LANCZOS)
+                    except Exception:
+                        image = image.resize(resize_to)
+                try:
+                    _atomically_save_image(image, fullfn_without_extension, ".jpg")
+                except Exception as e:
+                    errors.display(e, "saving image as downscaled JPG")
 
-    oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
-    if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
-        ratio = image.width / image.height
-        resize_to = None
-        if oversize and ratio > 1:
-            resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
-        elif oversize:
-            resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
+            if txt_fullfn is not None:
+                with open(txt_fullfn, "w", encoding="utf8") as file:
+                    file.write(f"{info}\n")
+        finally:
+            sequence_directory_changed(path, reserved=reserved_number)
 
-        if resize_to is not None:
-            try:
-                # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
-                image = image.resize(resize_to, LANCZOS)
-            except Exception:
-                image = image.resize(resize_to)
-        try:
-            _atomically_save_image(image, fullfn_without_extension, ".jpg")
-        except Exception as e:
-            errors.display(e, "saving image as downscaled JPG")
+        script_callbacks.image_saved_callback(params)
 
-    if opts.save_txt and info is not None:
-        txt_fullfn = f"{fullfn_without_extension}.txt"
-        with open(txt_fullfn, "w", encoding="utf8") as file:
-            file.write(f"{info}\n")
+    if background and opts.save_images_background_workers > 0:
+        submit_background_save(write_files)
     else:
-        txt_fullfn = None
-
-    script_callbacks.image_saved_callback(params)
+        write_files()
 
     return fullfn, txt_fullfn
 
@@ -117,6 +117,10 @@ def initialize_rest(*, reload_script_modules=False):
     sd_models.list_models()
     startup_timer.record("list SD models")
 
+    from modules import hashes
+    hashes.resume_pending()
+    startup_timer.record("resume pending hashes")
+
     from modules import localization
     localization.list_localizations(cmd_opts.localizations_dir)
     startup_timer.record("list localizations")
@@ -0,0 +1,185 @@
+import bisect
+import contextlib
+import threading
+import time
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+registry = []
+collectors = []
+
+
+class Counter:
+    """A value that only goes up, like the number of images generated."""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        yield f"{self.name} {self.value}"
+
+
+class Histogram:
+    """
+    Counts observations, usually durations in seconds, in cumulative buckets, the way Prometheus histograms do.
+
+    Observing a value only takes a lock and a binary search, so it's cheap enough to do on every sampling step.
+    """
+
+    def __init__(self, name, documentation, buckets=default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def render(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}} {cumulative}'
+
+        cumulative += counts[-1]
+        yield f'{self.name}_bucket{{le="+Inf"}} {cumulative}'
+        yield f"{self.name}_sum {total}"
+        yield f"{self.name}_count {cumulative}"
+
+
+def gauge(name, documentation, values):
+    """Returns lines for a gauge; values is a list of (labels dict, value)."""
+
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in values:
+        label_text = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    return lines
+
+
+def add_collector(func):
+    """Adds a function that returns lines for gauges; it is called every time metrics are rendered."""
+
+    collectors.append(func)
+    return func
+
+
+def render():
+    """Returns all metrics in Prometheus text exposition format."""
+
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+
+    for collector in collectors:
+        try:
+            lines += collector()
+        except Exception as e:
+            lines.append(f"# collector {collector.__name__} failed: {type(e).__name__}")
+
+    return "\n".join(lines) + "\n"
+
+
+queue_wait = Histogram("sd_queue_wait_seconds", "Time API requests waited for the queue lock.")
+sampling_step = Histogram("sd_sampling_step_seconds", "Time per sampling step.", buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5, 10))
+clip_encode = Histogram("sd_clip_encode_seconds", "Time spent encoding prompts with the text encoder.")
+vae_decode = Histogram("sd_vae_decode_seconds", "Time spent decoding latents with the VAE.")
+model_load = Histogram("sd_model_load_seconds", "Time spent loading or switching checkpoints.", buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+lora_patch = Histogram("sd_lora_patch_seconds", "Time spent loading and applying Loras.")
+image_save = Histogram("sd_image_save_seconds", "Time spent encoding and writing image files.")
+main_thread_wait = Histogram("sd_main_thread_wait_seconds", "Time tasks waited for the main (GPU) thread.")
+api_encode = Histogram("sd_api_encode_seconds", "Time spent encoding images for API responses.")
+images_generated = Counter("sd_images_generated_total", "Number of images generated.")
+
+
+@add_collector
+def cuda_memory():
+    import torch
+
+    if not torch.cuda.is_available():
+        return []
+
+    stats = torch.cuda.memory_stats()
+    keys = {
+        "allocated_bytes.all.current": "sd_cuda_allocated_bytes",
+        "allocated_bytes.all.peak": "sd_cuda_allocated_peak_bytes",
+        "reserved_bytes.all.current": "sd_cuda_reserved_bytes",
+        "reserved_bytes.all.peak": "sd_cuda_reserved_peak_bytes",
+        "num_alloc_retries": "sd_cuda_alloc_retries",
+        "num_ooms": "sd_cuda_ooms",
+    }
+
+    lines = []
+    for key, name in keys.items():
+        lines += gauge(name, f"torch.cuda.memory_stats()['{key}']", [({}, stats.get(key, 0))])
+
+    return lines
+
+
+@add_collector
+def loaded_models():
+    from ldm_patched.modules import model_management
+
+    values = []
+    for loaded_model in list(model_management.current_loaded_models):
+        patcher = loaded_model.model
+        if patcher is None:
+            continue
+
+        labels = {"model": type(patcher.model).__name__, "device": loaded_model.device}
+        values.append((labels, loaded_model.model_loaded_memory()))
+
+    return gauge("sd_loaded_model_bytes", "Bytes of each model in model_management.current_loaded_models loaded to its device.", values)
+
+
+@add_collector
+def queue():
+    from modules import progress
+
+    return gauge("sd_queue_pending_tasks", "Number of tasks waiting in the queue.", [({}, len(progress.pending_tasks))])
+
+
+@add_collector
+def main_thread_queue():
+    from modules_forge import main_thread
+
+    running, waiting = main_thread.queued_tasks()
+
+    lines = gauge("sd_main_thread_waiting_tasks", "Number of tasks waiting for the main (GPU) thread.", [({}, len(waiting))])
+    lines += gauge("sd_main_thread_oldest_wait_seconds", "How long the oldest waiting task has been waiting for the main thread.", [({}, waiting[0].wait_time if waiting else 0)])
+    lines += gauge("sd_main_thread_busy", "1 if the main thread is running a task.", [({}, int(running is not None))])
+
+    return lines
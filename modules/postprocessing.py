@@ -1,3 +1,5 @@
+import collections
+import concurrent.futures
 import os
 
 from PIL import Image
@@ -6,7 +8,82 @@ from modules import shared, images, devices, scripts, scripts_postprocessing, ui
 from modules.shared import opts
 
 
-def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir, show_extras_results, *args, save_output: bool = True):
+def prefetch(items, func, count):
+    """
+    Yields func(item) for each of items, in order. Up to count items ahead of the one being yielded are
+    processed on a thread pool in the meantime, so that at most count + 1 results are held in memory.
+    """
+
+    if count <= 0:
+        yield from map(func, items)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count, thread_name_prefix="postprocessing_read") as executor:
+        pending = collections.deque()
+
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) > count:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def load_image(item):
+    """Reads an image for postprocessing along with its infotext; returns (image, name, pnginfo), or None if it can't be read."""
+
+    image_placeholder, name = item
+
+    if isinstance(image_placeholder, str):
+        try:
+            image_data = images.read(image_placeholder)
+        except Exception:
+            return None
+    else:
+        image_data = image_placeholder
+
+    image_data = image_data if image_data.mode in ("RGBA", "RGB") else image_data.convert("RGB")
+
+    parameters, existing_pnginfo = images.read_info_from_image(image_data)
+    if parameters:
+        existing_pnginfo["parameters"] = parameters
+
+    return image_data, name, existing_pnginfo
+
+
+def save_caption(fullfn, caption):
+    caption_filename = os.path.splitext(fullfn)[0] + ".txt"
+    existing_caption = ""
+    try:
+        with open(caption_filename, encoding="utf8") as file:
+            existing_caption = file.read().strip()
+    except FileNotFoundError:
+        pass
+
+    action = shared.opts.postprocessing_existing_caption_action
+    if action == 'Prepend' and existing_caption:
+        caption = f"{existing_caption} {caption}"
+    elif action == 'Append' and existing_caption:
+        caption = f"{caption} {existing_caption}"
+    elif action == 'Keep' and existing_caption:
+        caption = existing_caption
+
+    caption = caption.strip()
+    if caption:
+        with open(caption_filename, "w", encoding="utf8") as file:
+            file.write(caption)
+
+
+def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir, show_extras_results, *args, save_output: bool = True, on_image_ready=None):
+    """
+    Runs postprocessing scripts on one image or a batch of images; returns (images, html info, '').
+
+    Images are read in a thread pool ahead of the one being processed, and saved in images' background saving pool.
+    If on_image_ready is given, it is called with (image, infotext) for every result instead of collecting results
+    in the returned list, so that a batch of any size can be streamed without keeping it in memory.
+    """
+
     devices.torch_gc()
 
     shared.state.begin(job="extras")
@@ -20,7 +97,7 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
                     image = images.fix_image(img)
                     fn = ''
                 else:
-                    image = images.read(os.path.abspath(img.name))
+                    image = os.path.abspath(img.name)
                     fn = os.path.splitext(img.orig_name)[0]
                 yield image, fn
         elif extras_mode == 2:
@@ -44,29 +121,18 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
     data_to_process = list(get_images(extras_mode, image, image_folder, input_dir))
     shared.state.job_count = len(data_to_process)
 
-    for image_placeholder, name in data_to_process:
-        image_data: Image.Image
-
+    for loaded in prefetch(data_to_process, load_image, opts.postprocessing_prefetch_images):
         shared.state.nextjob()
-        shared.state.textinfo = name
         shared.state.skipped = False
 
         if shared.state.interrupted or shared.state.stopping_generation:
             break
 
-        if isinstance(image_placeholder, str):
-            try:
-                image_data = images.read(image_placeholder)
-            except Exception:
-                continue
-        else:
-            image_data = image_placeholder
-
-        image_data = image_data if image_data.mode in ("RGBA", "RGB") else image_data.convert("RGB")
+        if loaded is None:
+            continue
 
-        parameters, existing_pnginfo = images.read_info_from_image(image_data)
-        if parameters:
-            existing_pnginfo["parameters"] = parameters
+        image_data, name, existing_pnginfo = loaded
+        shared.state.textinfo = name
 
         initial_pp = scripts_postprocessing.PostprocessedImage(image_data)
 
@@ -95,35 +161,20 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
             shared.state.assign_current_image(pp.image)
 
             if save_output:
-                fullfn, _ = images.save_image(pp.image, path=outpath, basename=basename, extension=opts.samples_format, info=infotext, short_filename=True, no_prompt=True, grid=False, pnginfo_section_name="extras", existing_info=existing_pnginfo, forced_filename=forced_filename, suffix=suffix)
-
-                if pp.caption:
-                    caption_filename = os.path.splitext(fullfn)[0] + ".txt"
-                    existing_caption = ""
-                    try:
-                        with open(caption_filename, encoding="utf8") as file:
-                            existing_caption = file.read().strip()
-                    except FileNotFoundError:
-                        pass
-
-                    action = shared.opts.postprocessing_existing_caption_action
-                    if action == 'Prepend' and existing_caption:
-                        caption = f"{existing_caption} {pp.caption}"
-                    elif action == 'Append' and existing_caption:
-                        caption = f"{pp.caption} {existing_caption}"
-                    elif action == 'Keep' and existing_caption:
-                        caption = existing_caption
-                    else:
-                        caption = pp.caption
-
-                    caption = caption.strip()
-                    if caption:
-                        with open(caption_filename, "w", encoding="utf8") as file:
-                            file.write(caption)
-
-            if extras_mode != 2 or show_extras_results:
+                fullfn, _ = images.save_image(pp.image, path=outpath, basename=basename, extension=opts.samples_format, info=infotext, short_filename=True, no_prompt=True, grid=False, pnginfo_section_name="extras", existing_info=existing_pnginfo, forced_filename=forced_filename, suffix=suffix, background=True)
+
+                if pp.caption and opts.save_images_background_workers > 0:
+                    images.submit_background_save(lambda fullfn=fullfn, caption=pp.caption: save_caption(fullfn, caption))
+                elif pp.caption:
+                    save_caption(fullfn, pp.caption)
+
+            if on_image_ready is not None:
+                on_image_ready(pp.image, infotext)
+            elif extras_mode != 2 or show_extras_results:
                 outputs.append(pp.image)
 
+    images.wait_for_background_saves()
+
     devices.torch_gc()
     shared.state.end()
     return outputs, ui_common.plaintext_to_html(infotext), ''
@@ -133,7 +184,7 @@ def run_postprocessing_webui(id_task, *args, **kwargs):
     return run_postprocessing(*args, **kwargs)
 
 
-def run_extras(extras_mode, resize_mode, image, image_folder, input_dir, output_dir, show_extras_results, gfpgan_visibility, codeformer_visibility, codeformer_weight, upscaling_resize, upscaling_resize_w, upscaling_resize_h, upscaling_crop, extras_upscaler_1, extras_upscaler_2, extras_upscaler_2_visibility, upscale_first: bool, save_output: bool = True, max_side_length: int = 0):
+def run_extras(extras_mode, resize_mode, image, image_folder, input_dir, output_dir, show_extras_results, gfpgan_visibility, codeformer_visibility, codeformer_weight, upscaling_resize, upscaling_resize_w, upscaling_resize_h, upscaling_crop, extras_upscaler_1, extras_upscaler_2, extras_upscaler_2_visibility, upscale_first: bool, save_output: bool = True, max_side_length: int = 0, on_image_ready=None):
     """old handler for API"""
 
     args = scripts.scripts_postproc.create_args_for_run({
@@ -160,4 +211,4 @@ def run_extras(extras_mode, resize_mode, image, image_folder, input_dir, output_
         },
     })
 
-    return run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir, show_extras_results, *args, save_output=save_output)
+    return run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir, show_extras_results, *args, save_output=save_output, on_image_ready=on_image_ready)
@@ -4,6 +4,7 @@ import json
 import logging
 import math
 import os
+import time
 import sys
 import hashlib
 from dataclasses import dataclass, field
@@ -14,10 +15,10 @@ from PIL import Image, ImageOps
 import random
 import cv2
 from skimage import exposure
-from typing import Any
+from typing import Any, Callable
 
 import modules.sd_hijack
-from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling
+from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling, metrics
 from modules.rng import slerp # noqa: F401
 from modules.sd_hijack import model_hijack
 from modules.sd_samplers_common import images_tensor_to_samples, decode_first_stage, approximation_indexes
@@ -33,6 +34,7 @@ import modules.sd_vae as sd_vae
 from ldm.data.util import AddMiDaS
 from ldm.models.diffusion.ddpm import LatentDepth2ImageDiffusion
 from ldm_patched.modules.model_sampling import rescale_zero_terminal_snr_sigmas
+from ldm_patched.modules import model_management
 
 from einops import repeat, rearrange
 from blendmodes.blend import blendLayers, BlendType
@@ -184,6 +186,7 @@ class StableDiffusionProcessing:
     token_merging_ratio = 0
     token_merging_ratio_hr = 0
     disable_extra_networks: bool = False
+    trace: bool = False
     firstpass_image: Image = None
 
     scripts_value: scripts.ScriptRunner = field(default=None, init=False)
@@ -229,6 +232,7 @@ class StableDiffusionProcessing:
     sd_vae_hash: str = field(default=None, init=False)
 
     is_api: bool = field(default=False, init=False)
+    on_image_ready: Callable = field(default=None, init=False)
 
     latents_after_sampling = []
     pixels_after_sampling = []
@@ -473,6 +477,27 @@ class StableDiffusionProcessing:
             opts.emphasis,
         )
 
+    def conditioning_cache_key(self, cached_params):
+        """Returns a hashable, stable representation of cached_params, excluding the prompts, for prompt_parser.conditioning_cache"""
+
+        def stable(value):
+            if value is None or isinstance(value, (str, int, float, bool)):
+                return value
+            if isinstance(value, (list, tuple)):
+                return tuple(stable(x) for x in value)
+            if isinstance(value, dict):
+                return tuple(sorted((str(k), stable(v)) for k, v in value.items()))
+            if isinstance(value, sd_models.CheckpointInfo):
+                return value.filename, value.sha256 or value.shorthash
+            if isinstance(value, extra_networks.ExtraNetworkParams):
+                return stable(value.items), stable(value.named)
+
+            return repr(value)
+
+        embedding_db = modules.sd_hijack.model_hijack.embedding_db
+
+        return stable(cached_params[1:]) + (getattr(embedding_db, 'cache_key', ''), )
+
     def get_conds_with_caching(self, function, required_prompts, steps, caches, extra_network_data, hires_steps=None):
         """
         Returns the result of calling function(shared.sd_model, required_prompts, steps)
@@ -502,7 +527,10 @@ class StableDiffusionProcessing:
 
         cache = caches[0]
 
-        with devices.autocast():
+        size = int(opts.cond_cache_size) if opts.persistent_cond_cache else 0
+        conditioning_cache_key = self.conditioning_cache_key(cached_params) if size > 0 else None
+
+        with devices.autocast(), prompt_parser.conditioning_cache.scope(conditioning_cache_key, modules.sd_hijack.model_hijack.extra_generation_params, size, opts.cond_cache_disk):
             cache[1] = function(shared.sd_model, required_prompts, steps, hires_steps, shared.opts.use_old_scheduling)
             if len(cache) > 2:
                 cache[2] = modules.sd_hijack.model_hijack.extra_generation_params
@@ -645,7 +673,8 @@ class DecodedSamples(list):
 
 def decode_latent_batch(model, batch, target_device=None, check_for_nans=False):
     samples = DecodedSamples()
-    samples_pytorch = decode_first_stage(model, batch).to(target_device)
+    with metrics.vae_decode.time(), profiling.span("decode_latent_batch"):
+        samples_pytorch = decode_first_stage(model, batch).to(target_device)
 
     for x in samples_pytorch:
         samples.append(x)
@@ -797,6 +826,32 @@ def create_infotext(p, all_prompts, all_seeds, all_subseeds, comments=None, iter
     return f"{prompt_text}{negative_prompt_text}\n{generation_params_text}".strip()
 
 
+def job_model_uses(p: StableDiffusionProcessing) -> list:
+    """Returns the model patchers that processing p is going to use, in order, for model_management.residency_planner."""
+
+    forge_objects = getattr(p.sd_model, "forge_objects_original", None)
+    if forge_objects is None:
+        return []
+
+    clip = getattr(forge_objects.clip, "patcher", None)
+    vae = getattr(forge_objects.vae, "patcher", None)
+
+    uses = [clip, forge_objects.unet, vae]
+    if getattr(p, "enable_hr", False):
+        uses += [forge_objects.unet, vae]
+
+    return [x for x in uses * p.n_iter if x is not None]
+
+
+def trace_filename(p: StableDiffusionProcessing):
+    """Returns the filename for the trace of processing p, which is saved next to its images, or None if it should not be traced."""
+
+    if not p.trace:
+        return None
+
+    return os.path.join(p.outpath_samples or opts.outdir_samples or paths.data_path, f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{p.seed}.json")
+
+
 def process_images(p: StableDiffusionProcessing) -> Processed:
     if p.scripts is not None:
         p.scripts.before_process(p)
@@ -822,7 +877,7 @@ def process_images(p: StableDiffusionProcessing) -> Processed:
         # backwards compatibility, fix sampler and scheduler if invalid
         sd_samplers.fix_p_invalid_sampler_and_scheduler(p)
 
-        with profiling.Profiler():
+        with profiling.Profiler(), profiling.Tracer(trace_filename(p), "process_images"), model_management.residency_planner.job(job_model_uses(p)):
             res = process_images_inner(p)
 
     finally:
@@ -865,6 +920,10 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
         p.width, p.height = shared.sd_model.fix_dimensions(p.width, p.height)
 
     p.sd_model_name = shared.sd_model.sd_checkpoint_info.name_for_extra
+    if shared.sd_model.sd_model_hash is None:
+        # the hash is calculated in background after the model is loaded; until then, it is left out of infotext
+        shared.sd_model.sd_model_hash = shared.sd_model.sd_checkpoint_info.calculate_shorthash(wait=False)
+
     p.sd_model_hash = shared.sd_model.sd_model_hash
     p.sd_vae_name = sd_vae.get_loaded_vae_name()
     p.sd_vae_hash = sd_vae.get_loaded_vae_hash()
@@ -945,7 +1004,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             if p.scripts is not None:
                 p.scripts.process_batch(p, batch_number=n, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
 
-            p.setup_conds()
+            with profiling.span("setup_conds"):
+                p.setup_conds()
 
             p.extra_generation_params.update(model_hijack.extra_generation_params)
 
@@ -984,7 +1044,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     sd_models.apply_alpha_schedule_override(p.sd_model, p, force_apply=force_apply_ztsnr)
                 p.sd_model.forge_objects.unet.model.model_sampling.set_sigmas(rescale_zero_terminal_snr_sigmas(p.sd_model.forge_objects.unet.model.model_sampling.sigmas).to(p.sd_model.forge_objects.unet.model.device))
 
-            samples_ddim = p.sample(conditioning=p.c, unconditional_conditioning=p.uc, seeds=p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, prompts=p.prompts)
+            with profiling.span("sample"):
+                samples_ddim = p.sample(conditioning=p.c, unconditional_conditioning=p.uc, seeds=p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, prompts=p.prompts)
 
             if samples_ddim is not None:
                 for x_sample in samples_ddim:
@@ -1052,7 +1113,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
                 if p.restore_faces:
                     if save_samples and opts.save_images_before_face_restoration:
-                        images.save_image(Image.fromarray(x_sample), p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-before-face-restoration")
+                        images.save_image(Image.fromarray(x_sample), p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-before-face-restoration", background=True)
 
                     devices.torch_gc()
 
@@ -1083,7 +1144,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                 if p.color_corrections is not None and i < len(p.color_corrections):
                     if save_samples and opts.save_images_before_color_correction:
                         image_without_cc, _ = apply_overlay(image, p.paste_to, overlay_image)
-                        images.save_image(image_without_cc, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-before-color-correction")
+                        images.save_image(image_without_cc, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-before-color-correction", background=True)
                     image = apply_color_correction(p.color_corrections[i], image)
 
                 # If the intention is to show the output from the model
@@ -1100,26 +1161,30 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     image = pp.image
 
                 if save_samples:
-                    images.save_image(image, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p)
+                    images.save_image(image, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, background=True)
 
                 text = infotext(i)
                 infotexts.append(text)
                 if opts.enable_pnginfo:
                     image.info["parameters"] = text
                 output_images.append(image)
+                metrics.images_generated.inc()
+
+                if p.on_image_ready is not None:
+                    p.on_image_ready(image, text)
 
                 if mask_for_overlay is not None:
                     if opts.return_mask or opts.save_mask:
                         image_mask = mask_for_overlay.convert('RGB')
                         if save_samples and opts.save_mask:
-                            images.save_image(image_mask, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask")
+                            images.save_image(image_mask, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask", background=True)
                         if opts.return_mask:
                             output_images.append(image_mask)
 
                     if opts.return_mask_composite or opts.save_mask_composite:
                         image_mask_composite = Image.composite(original_denoised_image.convert('RGBA').convert('RGBa'), Image.new('RGBa', image.size), images.resize_image(2, mask_for_overlay, image.width, image.height).convert('L')).convert('RGBA')
                         if save_samples and opts.save_mask_composite:
-                            images.save_image(image_mask_composite, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask-composite")
+                            images.save_image(image_mask_composite, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask-composite", background=True)
                         if opts.return_mask_composite:
                             output_images.append(image_mask_composite)
 
@@ -1145,13 +1210,15 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                 output_images.insert(0, grid)
                 index_of_first_image = 1
             if opts.grid_save:
-                images.save_image(grid, p.outpath_grids, "grid", p.all_seeds[0], p.all_prompts[0], opts.grid_format, info=infotext(use_main_prompt=True), short_filename=not opts.grid_extended_filename, p=p, grid=True)
+                images.save_image(grid, p.outpath_grids, "grid", p.all_seeds[0], p.all_prompts[0], opts.grid_format, info=infotext(use_main_prompt=True), short_filename=not opts.grid_extended_filename, p=p, grid=True, background=True)
 
     if not p.disable_extra_networks and p.extra_network_data:
         extra_networks.deactivate(p, p.extra_network_data)
 
     devices.torch_gc()
 
+    images.wait_for_background_saves()
+
     res = Processed(
         p,
         images_list=output_images,
@@ -1407,7 +1474,7 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
                 image = sd_samplers.sample_to_image(image, index, approximation=0)
 
             info = create_infotext(self, self.all_prompts, self.all_seeds, self.all_subseeds, [], iteration=self.iteration, position_in_batch=index)
-            images.save_image(image, self.outpath_samples, "", seeds[index], prompts[index], opts.samples_format, info=info, p=self, suffix="-before-highres-fix")
+            images.save_image(image, self.outpath_samples, "", seeds[index], prompts[index], opts.samples_format, info=info, p=self, suffix="-before-highres-fix", background=True)
 
         img2img_sampler_name = self.hr_sampler_name or self.sampler_name
 
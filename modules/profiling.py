@@ -1,6 +1,12 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
 import torch
 
-from modules import shared, ui_gradio_extensions
+from modules import shared
 
 
 class Profiler:
@@ -42,5 +48,111 @@ class Profiler:
 
 
 def webpath():
+    from modules import ui_gradio_extensions
+
     return ui_gradio_extensions.webpath(shared.opts.profiling_filename)
 
+
+class Trace:
+    """
+    Spans recorded while processing one request, saved in the Chrome trace event format that chrome://tracing and
+    ui.perfetto.dev can open. Spans from other threads, such as background image saving, end up in their own rows.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def add(self, name, category, started, ended, args=None):
+        tid = threading.get_ident()
+        event = {"name": name, "cat": category, "ph": "X", "ts": started * 1e6, "dur": (ended - started) * 1e6, "pid": self.pid, "tid": tid}
+        if args:
+            event["args"] = args
+
+        with self.lock:
+            self.events.append(event)
+            self.threads.setdefault(tid, threading.current_thread().name)
+
+    def save(self, filename):
+        with self.lock:
+            metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}} for tid, name in self.threads.items()]
+            events = metadata + self.events
+
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        with open(filename, "w", encoding="utf8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+current_trace = None
+
+
+def record(name, started, ended, category="webui", **args):
+    """Adds a span that has already finished to the trace being recorded, if there is one; times are from time.perf_counter()."""
+
+    trace = current_trace
+    if trace is not None:
+        trace.add(name, category, started, ended, args)
+
+
+@contextlib.contextmanager
+def span(name, category="webui", **args):
+    """Records the time spent in the block as a span, if a trace is being recorded."""
+
+    if current_trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, started, time.perf_counter(), category, **args)
+
+
+def traced(items, category, describe):
+    """Yields items; if a trace is being recorded, the time each of them is in use is recorded as a span named describe(item)."""
+
+    if current_trace is None:
+        yield from items
+        return
+
+    for item in items:
+        with span(describe(item), category):
+            yield item
+
+
+class Tracer:
+    """Records a trace of everything done inside the block to filename; does nothing if filename is None."""
+
+    def __init__(self, filename, name="request"):
+        self.filename = filename
+        self.name = name
+        self.trace = None
+        self.started = None
+
+    def __enter__(self):
+        global current_trace
+
+        if self.filename is not None:
+            self.trace = current_trace = Trace()
+            self.started = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc, exc_tb):
+        global current_trace
+
+        if self.trace is None:
+            return
+
+        self.trace.add(self.name, "webui", self.started, time.perf_counter())
+        current_trace = None
+
+        try:
+            self.trace.save(self.filename)
+            print(f"Trace saved to {self.filename}")
+        except Exception as e:
+            print(f"Error saving trace to {self.filename}: {e}")
+
@@ -1,5 +1,3 @@
-import base64
-import io
 import time
 
 import gradio as gr
@@ -52,9 +50,37 @@ def record_results(id_task, res):
 def add_task_to_queue(id_job):
     pending_tasks[id_job] = time.time()
 
+
+def remove_task_from_queue(id_job):
+    pending_tasks.pop(id_job, None)
+
+
+def get_queue_positions():
+    """Returns a dict of task id -> (zero-based position in queue, priority class, estimated wait in seconds or None) for tasks in pending_tasks."""
+
+    from modules.call_queue import queue_lock
+
+    res = {}
+    position = 0
+    for waiter in queue_lock.waiters():
+        if waiter.task_id is not None and waiter.task_id in pending_tasks:
+            res[waiter.task_id] = (position, waiter.priority, queue_lock.estimate_wait(position))
+        position += 1
+
+    return res
+
+
+class PendingTaskItem(BaseModel):
+    id_task: str = Field(title="Task ID")
+    position: int = Field(default=None, title="Position in queue", description="zero-based; None if the task has not reached the queue yet")
+    priority: str = Field(default=None, title="Priority class")
+    eta: float = Field(default=None, title="Estimated wait in secs")
+
+
 class PendingTasksResponse(BaseModel):
     size: int = Field(title="Pending task size")
     tasks: List[str] = Field(title="Pending task ids")
+    queue: List[PendingTaskItem] = Field(default=[], title="Pending tasks with their queue positions and wait estimates")
 
 class ProgressRequest(BaseModel):
     id_task: str = Field(default=None, title="Task ID", description="id of the task to get progress for")
@@ -81,7 +107,14 @@ def setup_progress_api(app):
 def get_pending_tasks():
     pending_tasks_ids = list(pending_tasks)
     pending_len = len(pending_tasks_ids)
-    return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids)
+    positions = get_queue_positions()
+
+    queue = []
+    for id_task in pending_tasks_ids:
+        position, priority, eta = positions.get(id_task, (None, None, None))
+        queue.append(PendingTaskItem(id_task=id_task, position=position, priority=priority, eta=eta))
+
+    return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids, queue=queue)
 
 
 def progressapi(req: ProgressRequest):
@@ -91,11 +124,21 @@ def progressapi(req: ProgressRequest):
 
     if not active:
         textinfo = "Waiting..."
+        eta = None
         if queued:
-            sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
-            queue_index = sorted_queued.index(req.id_task)
-            textinfo = "In queue: {}/{}".format(queue_index + 1, len(sorted_queued))
-        return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo)
+            positions = get_queue_positions()
+            if req.id_task in positions:
+                queue_index, _, eta = positions[req.id_task]
+                queue_size = max(queue_index + 1, len(positions))
+            else:
+                sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
+                queue_index = sorted_queued.index(req.id_task)
+                queue_size = len(sorted_queued)
+
+            textinfo = "In queue: {}/{}".format(queue_index + 1, queue_size)
+            if eta is not None:
+                textinfo += ", about {:.0f} sec. wait".format(eta)
+        return ProgressResponse(active=active, queued=queued, completed=completed, eta=eta, id_live_preview=-1, textinfo=textinfo)
 
     progress = 0
 
@@ -119,24 +162,9 @@ def progressapi(req: ProgressRequest):
     if opts.live_previews_enable and req.live_preview:
         shared.state.set_current_image()
         if shared.state.id_live_preview != req.id_live_preview:
-            image = shared.state.current_image
-            if image is not None:
-                buffered = io.BytesIO()
-
-                if opts.live_previews_image_format == "png":
-                    # using optimize for large images takes an enormous amount of time
-                    if max(*image.size) <= 256:
-                        save_kwargs = {"optimize": True}
-                    else:
-                        save_kwargs = {"optimize": False, "compress_level": 1}
-
-                else:
-                    save_kwargs = {}
-
-                image.save(buffered, format=opts.live_previews_image_format, **save_kwargs)
-                base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
-                live_preview = f"data:image/{opts.live_previews_image_format};base64,{base64_image}"
-                id_live_preview = shared.state.id_live_preview
+            live_preview, id_live_preview = shared.state.live_preview_data_url()
+            if live_preview is None:
+                id_live_preview = req.id_live_preview
 
     return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
 
@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import contextlib
+import functools
 import re
-from collections import namedtuple
+import threading
+from collections import namedtuple, OrderedDict
 import lark
 import math
 
 import logging
 
+from modules import metrics
+
 # a prompt like this: "fantasy landscape with a [mountain:lake:0.25] and [an oak:a christmas tree:0.75][ in foreground::0.6][: in background:0.25] [shoddy:masterful:0.5]"
 # will be represented with prompt_schedule like this (assuming steps=100):
 # [25, 'fantasy landscape with a mountain and an oak in foreground shoddy']
@@ -15,6 +20,10 @@ import logging
 # [75, 'fantasy landscape with a lake and an oak in background masterful']
 # [100, 'fantasy landscape with a lake and a christmas tree in background masterful']
 
+# number of distinct prompts for which parse results of parse_prompt_attention and
+# get_learned_conditioning_prompt_schedules are remembered
+parse_cache_size = 4096
+
 schedule_parser = lark.Lark(r"""
 !start: (prompt | /[][():]/+)*
 prompt: (emphasized | scheduled | alternate | plain | WHITESPACE)*
@@ -66,6 +75,20 @@ def get_learned_conditioning_prompt_schedules(prompts, base_steps, hires_steps=N
     [[5, 'a  c'], [10, 'a b c']]
     """
 
+    promptdict = {prompt: get_prompt_schedule(prompt, base_steps, hires_steps, use_old_scheduling) for prompt in set(prompts)}
+    return [promptdict[prompt] for prompt in prompts]
+
+
+def get_prompt_schedule(prompt, base_steps, hires_steps=None, use_old_scheduling=False):
+    """Returns the schedule for a single prompt as a list of [step, text] pairs; uses parsed_prompt_schedule's cache."""
+
+    return [[step, text] for step, text in parsed_prompt_schedule(prompt, base_steps, hires_steps, use_old_scheduling)]
+
+
+@functools.lru_cache(maxsize=parse_cache_size)
+def parsed_prompt_schedule(prompt, base_steps, hires_steps=None, use_old_scheduling=False):
+    """Parses the prompt and returns its schedule as a tuple of (step, text) tuples; results are cached."""
+
     if hires_steps is None or use_old_scheduling:
         int_offset = 0
         flt_offset = 0
@@ -122,18 +145,16 @@ def get_learned_conditioning_prompt_schedules(prompts, base_steps, hires_steps=N
                     yield child
         return AtStep().transform(tree)
 
-    def get_schedule(prompt):
-        try:
-            tree = schedule_parser.parse(prompt)
-        except lark.exceptions.LarkError:
-            if 0:
-                import traceback
-                traceback.print_exc()
-            return [[steps, prompt]]
-        return [[t, at_step(t, tree)] for t in collect_steps(steps, tree)]
-
-    promptdict = {prompt: get_schedule(prompt) for prompt in set(prompts)}
-    return [promptdict[prompt] for prompt in prompts]
+    try:
+        tree = schedule_parser.parse(prompt)
+    except lark.exceptions.LarkError:
+        if 0:
+            import traceback
+            traceback.print_exc()
+        return ((steps, prompt), )
+    return tuple((t, at_step(t, tree)) for t in collect_steps(steps, tree))
+
+
 
 
 ScheduledPromptConditioning = namedtuple("ScheduledPromptConditioning", ["end_at_step", "cond"])
@@ -157,6 +178,106 @@ class SdConditioning(list):
 
 
 
+def merge_extra_generation_params(target, params):
+    for k, v in params.items():
+        if k == "TI hashes" and target.get(k):
+            parts = [x for x in target[k].split(", ") if x]
+            parts += [x for x in v.split(", ") if x and x not in parts]
+            target[k] = ", ".join(parts)
+        else:
+            target[k] = v
+
+
+class ConditioningCacheScope:
+    def __init__(self, key, extra_generation_params, size, use_disk):
+        self.key = key
+        self.extra_generation_params = extra_generation_params
+        self.size = size
+        self.use_disk = use_disk
+
+
+class LearnedConditioningCache:
+    """
+    A bounded LRU cache of conditioning schedules for individual prompts, so that prompts and negative prompts that
+    were encoded before - by this or by another request - are not run through the text encoder again.
+
+    Entries are keyed on the prompt, its schedule parameters, and a key describing everything else the result depends on
+    (model, clip skip, extra networks, etc.); the cache is only used inside scope(). With use_disk, entries are also
+    written to the on-disk cache, so they survive restarts.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def scope(self, key, extra_generation_params, size, use_disk=False):
+        previous = getattr(self.local, "scope", None)
+        self.local.scope = ConditioningCacheScope(key, extra_generation_params, size, use_disk) if size > 0 else None
+        try:
+            yield
+        finally:
+            self.local.scope = previous
+
+    def current(self):
+        return getattr(self.local, "scope", None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def disk(self):
+        from modules import cache
+        return cache.cache("conds")
+
+    def get(self, scope, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        if entry is None and scope.use_disk:
+            entry = self.disk().get(key)
+            if entry is not None:
+                from modules import devices
+                cond_schedule, params = entry
+                entry = [ScheduledPromptConditioning(x.end_at_step, move_cond(x.cond, devices.device)) for x in cond_schedule], params
+                self.store(scope, key, entry)
+
+        if entry is None:
+            return None
+
+        cond_schedule, params = entry
+        merge_extra_generation_params(scope.extra_generation_params, params)
+
+        return cond_schedule
+
+    def put(self, scope, key, cond_schedule, params):
+        self.store(scope, key, (cond_schedule, params))
+
+        if scope.use_disk:
+            from modules import devices
+            self.disk()[key] = [ScheduledPromptConditioning(x.end_at_step, move_cond(x.cond, devices.cpu)) for x in cond_schedule], params
+
+    def store(self, scope, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > scope.size:
+                self.entries.popitem(last=False)
+
+
+def move_cond(cond, device):
+    if isinstance(cond, dict):
+        return {k: v.to(device) for k, v in cond.items()}
+
+    return cond.to(device)
+
+
+conditioning_cache = LearnedConditioningCache()
+
+
 def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps, hires_steps=None, use_old_scheduling=False):
     """converts a list of prompts into a list of prompt schedules - each schedule is a list of ScheduledPromptConditioning, specifying the comdition (cond),
     and the sampling step at which this condition is to be replaced by the next one.
@@ -179,6 +300,7 @@ def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps,
 
     prompt_schedules = get_learned_conditioning_prompt_schedules(prompts, steps, hires_steps, use_old_scheduling)
     cache = {}
+    scope = conditioning_cache.current()
 
     for prompt, prompt_schedule in zip(prompts, prompt_schedules):
 
@@ -187,11 +309,27 @@ def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps,
             res.append(cached)
             continue
 
-        texts = SdConditioning([x[1] for x in prompt_schedule], copy_from=prompts)
-        conds = model.get_learned_conditioning(texts)
+        if scope is not None:
+            persistent_key = (scope.key, prompt, getattr(prompts, 'is_negative_prompt', False), getattr(prompts, 'width', None), getattr(prompts, 'height', None), steps, hires_steps, use_old_scheduling)
+            cached = conditioning_cache.get(scope, persistent_key)
+            if cached is not None:
+                cache[prompt] = cached
+                res.append(cached)
+                continue
+
+            params_before = dict(scope.extra_generation_params)
+
+        # alternating prompts like [a|b] repeat the same texts at many steps; each distinct text is only encoded once
+        unique_texts = list(dict.fromkeys(x[1] for x in prompt_schedule))
+        text_indexes = {text: i for i, text in enumerate(unique_texts)}
+
+        texts = SdConditioning(unique_texts, copy_from=prompts)
+        with metrics.clip_encode.time():
+            conds = model.get_learned_conditioning(texts)
 
         cond_schedule = []
-        for i, (end_at_step, _) in enumerate(prompt_schedule):
+        for end_at_step, text in prompt_schedule:
+            i = text_indexes[text]
             if isinstance(conds, dict):
                 cond = {k: v[i] for k, v in conds.items()}
             else:
@@ -202,6 +340,14 @@ def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps,
         cache[prompt] = cond_schedule
         res.append(cond_schedule)
 
+        if scope is not None:
+            params = {k: v for k, v in scope.extra_generation_params.items() if params_before.get(k) != v}
+            if "TI hashes" in params and params_before.get("TI hashes"):
+                parts_before = params_before["TI hashes"].split(", ")
+                params["TI hashes"] = ", ".join(x for x in params["TI hashes"].split(", ") if x not in parts_before)
+
+            conditioning_cache.put(scope, persistent_key, cond_schedule, params)
+
     return res
 
 
@@ -429,6 +575,13 @@ def parse_prompt_attention(text):
     [['hello world, a poem, ', 0.8]]
     """
 
+    return [[text, weight] for text, weight in parsed_prompt_attention(text)]
+
+
+@functools.lru_cache(maxsize=parse_cache_size)
+def parsed_prompt_attention(text):
+    """Implementation of parse_prompt_attention; since results are cached, returns them as a tuple of (text, weight) tuples."""
+
     res = []
     round_brackets = []
     square_brackets = []
@@ -498,8 +651,8 @@ def parse_prompt_attention(text):
             curr_text, curr_weight = next_text, next_weight
     merged.append([curr_text, curr_weight])
     logging.debug(merged)
-    
-    return merged
+
+    return tuple((text, weight) for text, weight in merged)
 
 if __name__ == "__main__":
     import doctest
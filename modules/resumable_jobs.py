@@ -0,0 +1,232 @@
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from PIL import Image
+
+from modules import cache, errors, images, shared
+
+jobs_dir = os.path.join(cache.cache_dir, "jobs")
+
+
+def fingerprint(value):
+    """Returns a JSON-serializable stand-in for value that changes whenever value does; images are replaced by hashes of their pixels."""
+
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+
+    if isinstance(value, (list, tuple)):
+        return [fingerprint(x) for x in value]
+
+    if isinstance(value, dict):
+        return {str(k): fingerprint(v) for k, v in value.items()}
+
+    if isinstance(value, Image.Image):
+        return hashlib.sha256(value.tobytes()).hexdigest()
+
+    if hasattr(value, "tobytes"):
+        return hashlib.sha256(value.tobytes()).hexdigest()
+
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {f.name: fingerprint(getattr(value, f.name, None)) for f in dataclasses.fields(value)}
+
+    return type(value).__name__
+
+
+def prune_jobs(keep=None):
+    """
+    Removes directories of unfinished jobs that have not been updated for resumable_script_jobs_max_age days, then the
+    least recently updated ones until all together take no more than resumable_script_jobs_max_size MB. The directory
+    keep, if given, is left alone.
+    """
+
+    max_age = shared.opts.resumable_script_jobs_max_age * 24 * 60 * 60
+    max_size = shared.opts.resumable_script_jobs_max_size * 1024 * 1024
+
+    jobs = []
+    try:
+        for kind in os.scandir(jobs_dir):
+            if not kind.is_dir():
+                continue
+
+            for job in os.scandir(kind.path):
+                if not job.is_dir() or job.path == keep:
+                    continue
+
+                files = [entry.stat() for entry in os.scandir(job.path) if entry.is_file()]
+                mtime = max([stat.st_mtime for stat in files], default=job.stat().st_mtime)
+                jobs.append((mtime, sum(stat.st_size for stat in files), job.path))
+    except OSError:
+        return
+
+    jobs.sort()
+    total = sum(size for _, size, _ in jobs)
+    now = time.time()
+
+    for mtime, size, path in jobs:
+        too_old = max_age > 0 and now - mtime > max_age
+        too_big = max_size > 0 and total > max_size
+        if not too_old and not too_big:
+            continue
+
+        print(f"Removing saved progress of an unfinished job: {path}")
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def processing_params(p):
+    """Returns the parameters p was created with, for use in a job fingerprint."""
+
+    params = {f.name: fingerprint(getattr(p, f.name, None)) for f in dataclasses.fields(p) if f.init and f.name not in ("extra_generation_params", "firstpass_image")}
+    params["init_images"] = fingerprint(getattr(p, "init_images", None))
+    params["image_mask"] = fingerprint(getattr(p, "image_mask", None))
+    params["script_args"] = fingerprint(getattr(p, "script_args", None))
+    params["sd_model_checkpoint"] = shared.opts.sd_model_checkpoint
+    params["sd_vae"] = shared.opts.sd_vae
+
+    return params
+
+
+class JobManifest:
+    """
+    Progress of a long script job, like an X/Y/Z plot, kept on disk so that the job can be resumed after it was interrupted.
+
+    A job is identified by its kind and a hash of the parameters it was started with. Images of every finished cell
+    are saved as PNG files into the job's directory, and the rest of the cell's results go into manifest.json there,
+    so starting the job again with the same parameters finds the cell and does not generate it again. Values picked
+    at random when the job started, like seeds, should go through value(), so that a resumed job uses the same ones.
+
+    Used as a context manager around the job, it removes the directory when the job completes, unless it was
+    interrupted or failed is set because some cell did not produce images. Directories of jobs that are never
+    resumed are removed by prune_jobs when another job starts. If the resumable_script_jobs setting is disabled,
+    nothing is read or written.
+    """
+
+    def __init__(self, kind, params):
+        self.enabled = shared.opts.resumable_script_jobs
+        self.key = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf8")).hexdigest()[:16]
+        self.path = os.path.join(jobs_dir, kind, self.key)
+        self.lock = threading.Lock()
+        self.data = {"kind": kind, "values": {}, "cells": {}}
+        self.saved = {}
+        self.failed = False
+
+        if not self.enabled:
+            return
+
+        prune_jobs(keep=self.path)
+
+        try:
+            with open(os.path.join(self.path, "manifest.json"), "r", encoding="utf8") as file:
+                self.data = json.load(file)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            errors.report(f"Error reading job manifest from {self.path}; starting the job from the beginning", exc_info=True)
+
+        if self.data["cells"]:
+            print(f"Resuming {kind} job: {len(self.data['cells'])} finished cells found in {self.path}")
+
+    def value(self, name, func):
+        """Returns the value stored under name, or calls func and stores what it returns; the value must be JSON-serializable."""
+
+        with self.lock:
+            if name not in self.data["values"]:
+                self.data["values"][name] = func()
+
+            return self.data["values"][name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.finish()
+
+    def is_done(self, cell):
+        return self.enabled and cell in self.data["cells"]
+
+    def image_path(self, cell, index=0):
+        """Returns the filename for the cell's index-th image, or None if it is not saved; the file may still be being written in background."""
+
+        entry = self.saved.get(cell) or self.data["cells"].get(cell)
+        if entry is None or index >= len(entry["images"]):
+            return None
+
+        return os.path.join(self.path, entry["images"][index])
+
+    def load(self, cell):
+        """Returns the results saved for cell: a dict with images (loaded from disk), infotexts, all_prompts, all_seeds and index_of_first_image."""
+
+        entry = dict(self.data["cells"][cell])
+        entry["images"] = [images.read(os.path.join(self.path, filename)) for filename in entry["images"]]
+
+        for image in entry["images"]:
+            image.load()
+
+        return entry
+
+    def save(self, cell, cell_images, infotexts, all_prompts, all_seeds, index_of_first_image=0):
+        """Saves images and results of a finished cell; files are written on the image saving thread pool."""
+
+        if not self.enabled or not cell_images:
+            return
+
+        with self.lock:
+            number = self.data.get("next_number", 0)
+            self.data["next_number"] = number + 1
+
+        filenames = [f"{number:05}-{i}.png" for i in range(len(cell_images))]
+        infotexts = list(infotexts)
+
+        entry = {
+            "images": filenames,
+            "infotexts": infotexts,
+            "all_prompts": list(all_prompts),
+            "all_seeds": [int(x) for x in all_seeds],
+            "index_of_first_image": index_of_first_image,
+        }
+
+        self.saved[cell] = entry
+
+        def write():
+            os.makedirs(self.path, exist_ok=True)
+
+            for i, (image, filename) in enumerate(zip(cell_images, filenames)):
+                images.save_image_with_geninfo(image, infotexts[i] if i < len(infotexts) else "", os.path.join(self.path, filename))
+
+            with self.lock:
+                self.data["cells"][cell] = entry
+                self.write_manifest()
+
+        images.submit_background_save(write)
+
+    def write_manifest(self):
+        filename = os.path.join(self.path, "manifest.json")
+
+        try:
+            with open(filename + ".tmp", "w", encoding="utf8") as file:
+                json.dump(self.data, file, indent=1, default=str)
+
+            os.replace(filename + ".tmp", filename)
+        except Exception:
+            errors.report(f"Error writing job manifest to {filename}", exc_info=True)
+
+    def finish(self):
+        """Removes the job's directory if the job has completed; otherwise tells how to resume it."""
+
+        if not self.enabled:
+            return
+
+        images.wait_for_background_saves()
+
+        if self.failed or shared.state.interrupted or shared.state.stopping_generation:
+            if self.data["cells"]:
+                print(f"Job is not complete; run it again with the same settings to resume it ({len(self.data['cells'])} finished cells saved in {self.path})")
+            return
+
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,179 @@
+import json
+import math
+import os
+import threading
+
+import torch
+import safetensors
+
+from modules import sd_models
+
+dtypes = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+
+if hasattr(torch, "float8_e4m3fn"):
+    dtypes[torch.float8_e4m3fn] = "F8_E4M3"
+    dtypes[torch.float8_e5m2] = "F8_E5M2"
+
+dtypes_by_name = {v: k for k, v in dtypes.items()}
+
+
+class StateDictReader:
+    """
+    Reads tensors of a checkpoint one at a time, with the same key names sd_models.read_state_dict would give them.
+
+    .safetensors files are opened with safe_open, which memory-maps the file, so only the tensors that were asked for are
+    read, and shapes and dtypes are known without reading any. Other formats are loaded with torch.load, memory-mapped
+    if the file and torch version allow it.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+        self.state_dict = None
+        self.infos = {}
+        self.names = {}
+
+        _, extension = os.path.splitext(filename)
+        if extension.lower() == ".safetensors":
+            self.file = safetensors.safe_open(filename, framework="pt", device="cpu")
+
+            for name in self.file.keys():
+                tensor_slice = self.file.get_slice(name)
+                self.infos[name] = (dtypes_by_name[tensor_slice.get_dtype()], tuple(tensor_slice.get_shape()))
+
+            turbo_key = 'conditioner.embedders.0.model.ln_final.weight'
+            is_sd2_turbo = turbo_key in self.infos and self.infos[turbo_key][1][0] == 1024
+            replacements = sd_models.checkpoint_dict_replacements_sd2_turbo if is_sd2_turbo else sd_models.checkpoint_dict_replacements_sd1
+
+            for name in self.infos:
+                self.names[sd_models.transform_checkpoint_dict_key(name, replacements)] = name
+        else:
+            try:
+                pl_sd = torch.load(filename, map_location="cpu", mmap=True)
+            except Exception:
+                pl_sd = torch.load(filename, map_location="cpu")
+
+            self.state_dict = sd_models.get_state_dict_from_checkpoint(pl_sd)
+            self.names = {name: name for name in self.state_dict}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, key):
+        return key in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def get(self, key):
+        if self.state_dict is not None:
+            return self.state_dict[key]
+
+        return self.file.get_tensor(self.names[key])
+
+    def meta(self, key):
+        """Returns a tensor on the meta device with the dtype and shape of the tensor at key, without reading it."""
+
+        if self.state_dict is not None:
+            value = self.state_dict[key]
+            if not isinstance(value, torch.Tensor):
+                return value
+
+            return torch.empty_like(value, device="meta")
+
+        dtype, shape = self.infos[self.names[key]]
+        return torch.empty(shape, dtype=dtype, device="meta")
+
+    def close(self):
+        self.file = None
+        self.state_dict = None
+
+
+class SafetensorsWriter:
+    """
+    Writes a .safetensors file one tensor at a time.
+
+    The header is written first, so dtypes and shapes of all tensors, in the order they will be written, must be known
+    in advance; layout is a list of (key, dtype, shape). The file is written under a temporary name and only renamed
+    to filename by close(), after all tensors were written.
+    """
+
+    def __init__(self, filename, layout, metadata=None):
+        self.filename = filename
+        self.layout = list(layout)
+        self.position = 0
+        self.lock = threading.Lock()
+
+        header = {}
+        if metadata:
+            for k, v in metadata.items():
+                if not isinstance(v, str):
+                    raise ValueError(f"Metadata value for {k} must be a string, not {type(v).__name__}")
+
+            header["__metadata__"] = metadata
+
+        offset = 0
+        for key, dtype, shape in self.layout:
+            size = math.prod(shape) * torch.empty([], dtype=dtype).element_size()
+            header[key] = {"dtype": dtypes[dtype], "shape": list(shape), "data_offsets": [offset, offset + size]}
+            offset += size
+
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf8")
+        header_bytes += b" " * (-len(header_bytes) % 8)
+
+        self.file = open(filename + ".tmp", "wb")
+        self.file.write(len(header_bytes).to_bytes(8, "little"))
+        self.file.write(header_bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, key, tensor):
+        """Writes the next tensor; key, dtype and shape must match the next entry of the layout."""
+
+        with self.lock:
+            expected_key, dtype, shape = self.layout[self.position]
+            assert key == expected_key, f"Expected tensor {expected_key}, got {key}"
+            assert tensor.dtype == dtype and tuple(tensor.shape) == tuple(shape), f"Tensor {key} is {tensor.dtype} {tuple(tensor.shape)}, expected {dtype} {tuple(shape)}"
+
+            if tensor.numel() > 0:
+                self.file.write(tensor.detach().to("cpu").contiguous().reshape(-1).view(torch.uint8).numpy().data)
+
+            self.position += 1
+
+    def close(self):
+        assert self.position == len(self.layout), f"Only {self.position} out of {len(self.layout)} tensors were written to {self.filename}"
+
+        self.file.close()
+        os.replace(self.filename + ".tmp", self.filename)
+
+    def abort(self):
+        self.file.close()
+
+        try:
+            os.remove(self.filename + ".tmp")
+        except OSError:
+            pass
@@ -7,7 +7,7 @@ from dataclasses import dataclass
 
 import gradio as gr
 
-from modules import shared, paths, script_callbacks, extensions, script_loading, scripts_postprocessing, errors, timer, util
+from modules import shared, paths, script_callbacks, extensions, script_loading, scripts_postprocessing, errors, timer, util, profiling
 
 topological_sort = util.topological_sort
 
@@ -835,7 +835,11 @@ class ScriptRunner:
         return callbacks
 
     def ordered_scripts(self, method_name):
-        return [x.callback for x in self.ordered_callbacks(method_name)]
+        scripts = [x.callback for x in self.ordered_callbacks(method_name)]
+        if profiling.current_trace is None:
+            return scripts
+
+        return profiling.traced(scripts, "script", lambda script: f"{method_name}: {os.path.relpath(script.filename or '', paths.script_path)}")
 
     def before_process(self, p):
         for script in self.ordered_scripts('before_process'):
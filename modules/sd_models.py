@@ -14,6 +14,7 @@ import ldm.modules.midas as midas
 import gc
 
 from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
+from modules import metrics
 from modules.timer import Timer
 import numpy as np
 from modules_forge import forge_loader
@@ -222,11 +223,13 @@ class CheckpointInfo:
         for id in self.ids:
             checkpoint_aliases[id] = self
 
-    def calculate_shorthash(self):
-        self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
-        if self.sha256 is None:
+    def calculate_shorthash(self, wait=True):
+        sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}", wait=wait)
+        if sha256 is None:
             return
 
+        self.sha256 = sha256
+
         shorthash = self.sha256[0:10]
         if self.shorthash == self.sha256[0:10]:
             return self.shorthash
@@ -623,7 +626,7 @@ def force_memory_deallocation():
     
     # 2. Clear all caches that might hold model references
     global checkpoints_loaded
-    if len(checkpoints_loaded) > 0:
+    if len(checkpoints_loaded) > 0 and checkpoint_cache_budget() == 0:
         print(f"Clearing {len(checkpoints_loaded)} cached state dictionaries")
         checkpoints_loaded.clear()
     
@@ -700,22 +703,84 @@ def force_memory_deallocation():
     
     return f"Memory cleanup: {post_mem/(1024*1024*1024):.2f} GB used"
 
-disable_checkpoint_caching = True  # Global flag to completely disable checkpoint caching
+disable_checkpoint_caching = True  # Global flag to completely disable checkpoint caching; superseded by sd_checkpoint_cache_ram_gb
+
+
+def checkpoint_cache_budget():
+    """Returns the size limit in bytes for state dicts cached in RAM; 0 means caching is disabled."""
+
+    return int(max(shared.opts.sd_checkpoint_cache_ram_gb or 0, 0) * 1024 ** 3)
+
+
+def state_dict_size(state_dict):
+    return sum(v.nbytes for v in state_dict.values() if isinstance(v, torch.Tensor))
+
+
+def checkpoint_cache_size():
+    return sum(size for _, size, _ in checkpoints_loaded.values())
+
+
+def cache_checkpoint_state_dict(checkpoint_info, state_dict, timer):
+    """
+    Stores a CPU copy of state_dict in checkpoints_loaded (filename -> (state dict, size in bytes, mtime)), evicting least
+    recently used entries to stay within budget.
+    """
+
+    budget = checkpoint_cache_budget()
+    size = state_dict_size(state_dict)
+    if size > budget:
+        return state_dict
+
+    pin = shared.opts.sd_checkpoint_cache_pin_memory and torch.cuda.is_available()
+
+    cached = {}
+    for k, v in state_dict.items():
+        if isinstance(v, torch.Tensor):
+            v = v.to(devices.cpu)
+            if pin and not v.is_pinned():
+                v = v.pin_memory()
+        cached[k] = v
+
+    checkpoints_loaded.pop(checkpoint_info.filename, None)
+    while checkpoints_loaded and checkpoint_cache_size() + size > budget:
+        evicted_filename, _ = checkpoints_loaded.popitem(last=False)
+        print(f"Removing {os.path.basename(evicted_filename)} from RAM checkpoint cache")
+
+    checkpoints_loaded[checkpoint_info.filename] = (cached, size, os.path.getmtime(checkpoint_info.filename))
+    timer.record("cache weights in RAM")
+
+    return dict(cached)
+
 
 def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
     global disable_checkpoint_caching
     
-    sd_model_hash = checkpoint_info.calculate_shorthash()
+    sd_model_hash = checkpoint_info.calculate_shorthash(wait=False) or "hash pending"
     timer.record("calculate hash")
-    
-    # Completely disable checkpoint caching - always load fresh
+
+    use_cache = checkpoint_cache_budget() > 0
+
+    cached_entry = checkpoints_loaded.get(checkpoint_info.filename) if use_cache else None
+    if cached_entry is not None and cached_entry[2] != os.path.getmtime(checkpoint_info.filename):
+        checkpoints_loaded.pop(checkpoint_info.filename, None)
+        cached_entry = None
+
+    if cached_entry is not None:
+        print(f"Loading weights [{sd_model_hash}] from RAM cache")
+        checkpoints_loaded.move_to_end(checkpoint_info.filename)
+        timer.record("load weights from RAM cache")
+
+        # shallow copy, because model loading pops keys from the dict it is given
+        return dict(cached_entry[0])
+
     print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
     
     # Use a more direct loading approach to avoid duplicate copies
+    # When caching, load to CPU, since that's where the cached copy lives
+    device = devices.cpu if use_cache else shared.weight_load_location or model_management.get_torch_device()
+
     if checkpoint_info.is_safetensors:
         import safetensors.torch
-        # Load directly to the appropriate device
-        device = shared.weight_load_location or model_management.get_torch_device()
         
         if shared.opts.disable_mmap_load_safetensors:
             with torch.no_grad():
@@ -734,11 +799,15 @@ def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
         # For regular checkpoints
         res = torch.load(
             checkpoint_info.filename, 
-            map_location=shared.weight_load_location or model_management.get_torch_device()
+            map_location=device
         )
         res = get_state_dict_from_checkpoint(res)
     
     timer.record("load weights from disk")
+
+    if use_cache:
+        res = cache_checkpoint_state_dict(checkpoint_info, res, timer)
+
     return res
 
 
@@ -1171,6 +1240,7 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None, forced_relo
         timer.record("calculate empty prompt")
 
         print(f"Model {checkpoint_info.title} loaded in {timer.summary()}.")
+        metrics.model_load.observe(timer.total)
         
         # One final cleanup to release any temporary objects
         force_memory_deallocation()
@@ -1,4 +1,5 @@
 import inspect
+import time
 from collections import namedtuple
 import numpy as np
 import torch
@@ -6,7 +7,7 @@ from PIL import Image
 from modules import devices, images, sd_vae_approx, sd_samplers, sd_vae_taesd, shared, sd_models
 from modules.shared import opts, state
 from modules_forge.forge_sampler import sampling_prepare, sampling_cleanup
-from modules import extra_networks
+from modules import extra_networks, metrics, profiling
 if opts.sd_sampling == "A1111":
     from k_diffusion import sampling
 elif opts.sd_sampling == "ldm patched (Comfy)":
@@ -80,8 +81,18 @@ def sample_to_image(samples, index=0, approximation=None):
     return single_sample_to_image(samples[index], approximation)
 
 
+def samples_to_image_list(samples, approximation=None):
+    """Like single_sample_to_image for every sample, but decodes all of them in one call."""
+
+    x_samples = samples_to_images_tensor(samples, approximation) * 0.5 + 0.5
+    x_samples = torch.clamp(x_samples, min=0.0, max=1.0)
+    x_samples = (255. * np.moveaxis(x_samples.cpu().numpy(), 1, 3)).astype(np.uint8)
+
+    return [Image.fromarray(x_sample) for x_sample in x_samples]
+
+
 def samples_to_image_grid(samples, approximation=None):
-    return images.image_grid([single_sample_to_image(sample, approximation) for sample in samples])
+    return images.image_grid(samples_to_image_list(samples, approximation))
 
 
 def images_tensor_to_samples(image, approximation=None, model=None):
@@ -117,6 +128,9 @@ def store_latent(decoded):
     if opts.live_previews_enable and opts.show_progress_every_n_steps > 0 and shared.state.sampling_step % opts.show_progress_every_n_steps == 0:
         if not shared.parallel_processing_allowed:
             shared.state.assign_current_image(sample_to_image(decoded))
+        else:
+            # rendered on the live preview thread, so that it's ready by the time the browser asks for it
+            shared.state.set_current_image()
 
 
 def is_sampler_using_eta_noise_seed_delta(p):
@@ -233,6 +247,7 @@ class TorchHijack:
 class Sampler:
     def __init__(self, funcname):
         self.funcname = funcname
+        self.step_started = None
         self.func = funcname
         self.extra_params = []
         self.sampler_noises = None
@@ -272,11 +287,18 @@ class Sampler:
         state.sampling_step = step
         shared.total_tqdm.update()
 
+        now = time.perf_counter()
+        if self.step_started is not None:
+            metrics.sampling_step.observe(now - self.step_started)
+            profiling.record("sampling step", self.step_started, now, step=step)
+        self.step_started = now
+
     def launch_sampling(self, steps, func):
         self.model_wrap_cfg.steps = steps
         self.model_wrap_cfg.total_steps = self.config.total_steps(steps)
         state.sampling_steps = steps
         state.sampling_step = 0
+        self.step_started = time.perf_counter()
 
         try:
             return func()
@@ -5,7 +5,6 @@ from dataclasses import dataclass
 from modules import paths, shared, devices, script_callbacks, sd_models, extra_networks, lowvram, sd_hijack, hashes
 from ldm_patched.modules import diffusers_convert
 
-import glob
 from copy import deepcopy
 
 
@@ -32,7 +31,7 @@ def get_loaded_vae_hash():
     if loaded_vae_file is None:
         return None
 
-    sha256 = hashes.sha256(loaded_vae_file, 'vae')
+    sha256 = hashes.sha256(loaded_vae_file, 'vae', wait=False)
 
     return sha256[0:10] if sha256 else None
 
@@ -73,32 +72,23 @@ def get_filename(filepath):
 def refresh_vae_list():
     vae_dict.clear()
 
+    vae_suffixes = ('.vae.ckpt', '.vae.pt', '.vae.safetensors')
+    suffixes = ('.ckpt', '.pt', '.safetensors')
+
     paths = [
-        os.path.join(sd_models.model_path, '**/*.vae.ckpt'),
-        os.path.join(sd_models.model_path, '**/*.vae.pt'),
-        os.path.join(sd_models.model_path, '**/*.vae.safetensors'),
-        os.path.join(vae_path, '**/*.ckpt'),
-        os.path.join(vae_path, '**/*.pt'),
-        os.path.join(vae_path, '**/*.safetensors'),
+        (sd_models.model_path, vae_suffixes),
+        (vae_path, suffixes),
     ]
 
     if shared.cmd_opts.ckpt_dir is not None and os.path.isdir(shared.cmd_opts.ckpt_dir):
-        paths += [
-            os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.ckpt'),
-            os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.pt'),
-            os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.safetensors'),
-        ]
+        paths.append((shared.cmd_opts.ckpt_dir, vae_suffixes))
 
     if shared.cmd_opts.vae_dir is not None and os.path.isdir(shared.cmd_opts.vae_dir):
-        paths += [
-            os.path.join(shared.cmd_opts.vae_dir, '**/*.ckpt'),
-            os.path.join(shared.cmd_opts.vae_dir, '**/*.pt'),
-            os.path.join(shared.cmd_opts.vae_dir, '**/*.safetensors'),
-        ]
+        paths.append((shared.cmd_opts.vae_dir, suffixes))
 
     candidates = []
-    for path in paths:
-        candidates += glob.iglob(path, recursive=True)
+    for path, allowed_suffixes in paths:
+        candidates += [x for x in shared.walk_files(path, allowed_extensions=suffixes) if x.lower().endswith(allowed_suffixes)]
 
     for filepath in candidates:
         name = get_filename(filepath)
@@ -37,6 +37,9 @@ options_templates.update(options_section(('saving-images', "Saving images/grids"
     "samples_format": OptionInfo('png', 'File format for images', ui_components.DropdownEditable, {"choices": ("png", "jpg", "jpeg", "webp", "avif")}).info("manual input of <a href='https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html' target='_blank'>other formats</a> is possible, but compatibility is not guaranteed"),
     "samples_filename_pattern": OptionInfo("", "Images filename pattern", component_args=hide_dirs).link("wiki", "https://github.com/AUTOMATIC1111/stable-diffusion-webui/wiki/Custom-Images-Filename-Name-and-Subdirectory"),
     "save_images_add_number": OptionInfo(True, "Add number to filename when saving", component_args=hide_dirs),
+    "save_images_sequence_sidecar": OptionInfo(True, "Remember filename numbers in a hidden file in each directory", component_args=hide_dirs).info("avoids listing the whole directory to find the next number after a restart"),
+    "save_images_background_workers": OptionInfo(2, "Number of threads for saving images in the background", gr.Slider, {"minimum": 0, "maximum": 16, "step": 1}).info("encode and write generated images while the next batch is being generated; 0 = save on the generation thread").needs_restart(),
+    "save_images_background_queue": OptionInfo(8, "Maximum number of images waiting to be saved in the background", gr.Slider, {"minimum": 1, "maximum": 64, "step": 1}).info("generation pauses when this many images are waiting").needs_restart(),
     "save_images_replace_action": OptionInfo("Replace", "Saving the image to an existing file", gr.Radio, {"choices": ["Replace", "Add number suffix"], **hide_dirs}),
     "grid_save": OptionInfo(True, "Always save all generated image grids"),
     "grid_format": OptionInfo('png', 'File format for grids', ui_components.DropdownEditable, {"choices": ("png", "jpg", "jpeg", "webp", "avif")}).info("manual input of <a href='https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html' target='_blank'>other formats</a> is possible, but compatibility is not guaranteed"),
@@ -99,6 +102,7 @@ options_templates.update(options_section(('saving-to-dirs', "Saving to a directo
 
 options_templates.update(options_section(('upscaling', "Upscaling", "postprocessing"), {
     "unload_sd_during_upscale": OptionInfo(False, "Unload SD Model from VRAM to RAM during upscale"),
+    "upscale_tile_batch_size": OptionInfo(4, "Tiles per upscaler model call", gr.Slider, {"minimum": 1, "maximum": 32, "step": 1}).info("run several tiles through the upscaler at once; higher = faster, but uses more VRAM"),
     "ESRGAN_tile": OptionInfo(256, "Tile size for ESRGAN upscalers.", gr.Slider, {"minimum": 0, "maximum": 4096, "step": 16}).info("0 = no tiling"),
     "ESRGAN_tile_overlap": OptionInfo(32, "Tile overlap for ESRGAN upscalers.", gr.Slider, {"minimum": 0, "maximum": 2048, "step": 8}).info("Low values = visible seam"),
     "RCAN_tile": OptionInfo(512, "Tile size for RCAN upscaler. 0 = no tiling.", gr.Slider, {"minimum": 0, "maximum": 4096, "step": 16}),
@@ -148,6 +152,12 @@ options_templates.update(options_section(('system', "System", "system"), {
     "hide_ldm_prints": OptionInfo(True, "Prevent Stability-AI's ldm/sgm modules from printing noise to console."),
     "dump_stacks_on_signal": OptionInfo(False, "Print stack traces before exiting the program with ctrl+c."),
     "concurrent_git_fetch_limit": OptionInfo(16, "Number of simultaneous extension update checks ", gr.Slider, {"step": 1, "minimum": 1, "maximum": 100}).info("reduce extension update check time"),
+    "hashing_workers": OptionInfo(2, "Number of files to hash in parallel in background", gr.Slider, {"step": 1, "minimum": 1, "maximum": 16}).info("for sha256 of checkpoints, LoRAs, VAEs and embeddings").needs_restart(),
+    "checkpoint_merger_workers": OptionInfo(1, "Number of tensors to merge in parallel in checkpoint merger", gr.Slider, {"step": 1, "minimum": 1, "maximum": 16}).info("more workers use more RAM; each one holds a few tensors at a time"),
+    "resumable_script_jobs": OptionInfo(True, "Save progress of X/Y/Z plot and prompts from file jobs so that they can be resumed").info("running an interrupted job again with the same settings skips images that are already done"),
+    "resumable_script_jobs_max_age": OptionInfo(7, "Remove saved progress of unfinished jobs after this many days", gr.Number, {"precision": 0}).info("0 = never"),
+    "resumable_script_jobs_max_size": OptionInfo(2048, "Maximum size of saved progress of unfinished jobs, in MB", gr.Number, {"precision": 0}).info("least recently updated jobs are removed first; 0 = unlimited"),
+    "queue_max_depth": OptionInfo(0, "Maximum number of tasks waiting in queue", gr.Number, {"precision": 0}).info("0 = unlimited; further API requests are rejected with HTTP 429"),
 }))
 
 options_templates.update(options_section(('profiler', "Profiler", "system"), {
@@ -170,6 +180,10 @@ options_templates.update(options_section(('API', "API", "system"), {
     "api_enable_requests": OptionInfo(True, "Allow http:// and https:// URLs for input images in API", restrict_api=True),
     "api_forbid_local_requests": OptionInfo(True, "Forbid URLs to local resources", restrict_api=True),
     "api_useragent": OptionInfo("", "User agent for requests", restrict_api=True),
+    "api_encode_workers": OptionInfo(4, "Number of threads for encoding images in API responses", gr.Slider, {"minimum": 1, "maximum": 32, "step": 1}).needs_restart(),
+    "api_txt2img_batching": OptionInfo(False, "Combine compatible txt2img API requests into one batch").info("requests that differ only in prompts and seeds, and use no scripts, are sampled together"),
+    "api_txt2img_batching_max_size": OptionInfo(8, "Maximum batch size for combined txt2img API requests", gr.Slider, {"minimum": 1, "maximum": 64, "step": 1}),
+    "api_txt2img_batching_window": OptionInfo(50, "Time to wait for more txt2img API requests to combine", gr.Number, {"precision": 0}).info("in milliseconds"),
 }))
 
 options_templates.update(options_section(('training', "Training", "training"), {
@@ -192,6 +206,8 @@ options_templates.update(options_section(('sd', "Stable Diffusion", "sd"), {
     "sd_checkpoints_limit": OptionInfo(1, "Maximum number of checkpoints loaded at the same time", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
     "sd_checkpoints_keep_in_cpu": OptionInfo(True, "Only keep one model on device").info("will keep models other than the currently used one in RAM rather than VRAM"),
     "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the two settings above instead"),
+    "sd_checkpoint_cache_ram_gb": OptionInfo(0.0, "RAM for caching checkpoint weights", gr.Number).info("in GB; 0 = disable; recently used checkpoints are kept in RAM so switching back to them does not read from disk"),
+    "sd_checkpoint_cache_pin_memory": OptionInfo(False, "Use pinned memory for cached checkpoint weights").info("faster transfer to GPU, but pinned memory can not be swapped out"),
     "sd_unet": OptionInfo("Automatic", "SD Unet", gr.Dropdown, lambda: {"choices": shared_items.sd_unet_items()}, refresh=shared_items.refresh_unet_list).info("choose Unet model: Automatic = use one with same filename as checkpoint; None = use Unet from checkpoint"),
     "sd_text_encoder": OptionInfo("Automatic", "Text Encoder", gr.Dropdown, lambda: {"choices": shared_items.sd_text_encoder_items()}, refresh=shared_items.refresh_text_encoder_list).info("choose Text Encoder model: Automatic = use one with same filename as checkpoint; None = use Text Encoder from checkpoint"),
     "enable_quantization": OptionInfo(False, "Enable quantization in K samplers for sharper and cleaner results. This may change existing seeds").needs_reload_ui(),
@@ -276,9 +292,13 @@ options_templates.update(options_section(('optimizations', "Optimizations", "sd"
     "pad_cond_uncond": OptionInfo(False, "Pad prompt/negative prompt", infotext='Pad conds').info("improves performance when prompt and negative prompt have different lengths; changes seeds"),
     "pad_cond_uncond_v0": OptionInfo(False, "Pad prompt/negative prompt (v0)", infotext='Pad conds v0').info("alternative implementation for the above; used prior to 1.6.0 for DDIM sampler; overrides the above if set; WARNING: truncates negative prompt if it's too long; changes seeds"),
     "persistent_cond_cache": OptionInfo(True, "Persistent cond cache").info("do not recalculate conds from prompts if prompts have not changed since previous calculation"),
+    "cond_cache_size": OptionInfo(64, "Prompt cond cache size", gr.Number, {"precision": 0}).info("number of individual prompts whose conds are kept in memory and reused across generations and API requests; requires persistent cond cache; 0 = disable"),
+    "cond_cache_disk": OptionInfo(False, "Keep prompt cond cache on disk").info("also store cached conds in the cache directory so they survive restarts"),
     "batch_cond_uncond": OptionInfo(True, "Batch cond/uncond").info("do both conditional and unconditional denoising in one batch; uses a bit more VRAM during sampling, but improves speed; previously this was controlled by --always-batch-cond-uncond commandline argument"),
     "fp8_storage": OptionInfo("Disable", "FP8 weight", gr.Radio, {"choices": ["Disable", "Enable for SDXL", "Enable"]}).info("Use FP8 to store Linear/Conv layers' weight. Require pytorch>=2.1.0."),
     "cache_fp16_weight": OptionInfo(False, "Cache FP16 weight for LoRA").info("Cache fp16 weight when enabling FP8, will increase the quality of LoRA. Use more system ram."),
+    "lowvram_patch_cache_mb": OptionInfo(1024, "Memory for Lora-patched weights in lowvram mode (MB)", gr.Number, {"precision": 0}).info("when model weights are streamed to the GPU, keep weights with Lora applied in RAM instead of recalculating them for every step; 0 = disable"),
+    "xyz_grid_max_batch_size": OptionInfo(8, "X/Y/Z plot: maximum number of cells to generate in one batch", gr.Slider, {"minimum": 1, "maximum": 64, "step": 1}).info("cells that only differ in seed, variation seed or prompt are sampled together; 1 = disable"),
 }))
 
 options_templates.update(options_section(('compatibility', "Compatibility", "sd"), {
@@ -330,6 +350,7 @@ options_templates.update(options_section(('extra_networks', "Extra Networks", "s
     "textual_inversion_add_hashes_to_infotext": OptionInfo(True, "Add Textual Inversion hashes to infotext"),
     "sd_hypernetwork": OptionInfo("None", "Add hypernetwork to prompt", gr.Dropdown, lambda: {"choices": ["None", *shared.hypernetworks]}, refresh=shared_items.reload_hypernetworks),
     "textual_inversion_image_embedding_data_cache": OptionInfo(False, 'Cache the data of image embeddings').info('potentially increase TI load time at the cost some disk space'),
+    "textual_inversion_loaded_limit": OptionInfo(64, "Maximum number of Textual Inversion embeddings kept in memory", gr.Number, {"precision": 0}).info("embeddings are loaded when a prompt uses them; least recently used ones are unloaded over this number; 0 = no limit"),
 }))
 
 options_templates.update(options_section(('ui_prompt_editing', "Prompt editing", "ui"), {
@@ -805,6 +826,7 @@ options_templates.update(options_section(('postprocessing', "Postprocessing", "p
     'postprocessing_operation_order': OptionInfo([], "Postprocessing operation order", ui_components.DropdownMulti, lambda: {"choices": [x.name for x in shared_items.postprocessing_scripts(filter_out_main_ui_only=True)]}),
     'upscaling_max_images_in_cache': OptionInfo(5, "Maximum number of images in upscaling cache", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}),
     'postprocessing_existing_caption_action': OptionInfo("Ignore", "Action for existing captions", gr.Radio, {"choices": ["Ignore", "Keep", "Prepend", "Append"]}).info("when generating captions using postprocessing; Ignore = use generated; Keep = use original; Prepend/Append = combine both"),
+    'postprocessing_prefetch_images': OptionInfo(4, "Number of images to read ahead when postprocessing a batch", gr.Slider, {"minimum": 0, "maximum": 16, "step": 1}).info("images are decoded on background threads while the previous ones are processed; 0 = read each image when it's needed"),
 }))
 
 options_templates.update(options_section((None, "Hidden options"), {
@@ -1,4 +1,6 @@
+import base64
 import datetime
+import io
 import logging
 import threading
 import time
@@ -11,6 +13,120 @@ from typing import Optional
 log = logging.getLogger(__name__)
 
 
+def encode_live_preview(image):
+    """Encodes a live preview image in the live_previews_image_format format as a data: URL."""
+
+    buffered = io.BytesIO()
+
+    if shared.opts.live_previews_image_format == "png":
+        # using optimize for large images takes an enormous amount of time
+        if max(*image.size) <= 256:
+            save_kwargs = {"optimize": True}
+        else:
+            save_kwargs = {"optimize": False, "compress_level": 1}
+
+    else:
+        save_kwargs = {}
+
+    image.save(buffered, format=shared.opts.live_previews_image_format, **save_kwargs)
+    base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
+    return f"data:image/{shared.opts.live_previews_image_format};base64,{base64_image}"
+
+
+class LivePreviewWorker:
+    """
+    Renders live previews on a background thread, so that decoding and encoding them does not hold up sampling.
+
+    request() hands the worker the latest latent. If the worker is still busy with an earlier one, latents that
+    were not rendered yet are dropped, so that previews never fall behind sampling. On CUDA, previews are decoded on
+    a separate stream. Time spent and frames rendered or dropped are counted in State.preview_stats for every job.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.condition = threading.Condition()
+        self.pending = None
+        self.thread = None
+        self.stream = None
+
+    def request(self, latent):
+        # samplers may update the latent in place while the preview is being decoded, so the worker gets its own copy
+        latent = latent.detach().clone()
+
+        event = None
+        if latent.device.type == "cuda":
+            event = torch.cuda.Event()
+            event.record()
+
+        with self.condition:
+            if self.pending is not None:
+                self.state.preview_stats["dropped"] += 1
+
+            self.pending = (latent, event)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True, name="live_preview")
+                self.thread.start()
+
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+
+                latent, event = self.pending
+                self.pending = None
+
+            try:
+                self.render(latent, event)
+            except Exception:
+                # when switching models during generation, VAE would be on CPU, so creating an image will fail.
+                # we silently ignore this error
+                errors.record_exception()
+
+    @torch.inference_mode()
+    def render(self, latent, event):
+        import modules.sd_samplers_common
+
+        started = time.perf_counter()
+
+        if event is not None:
+            if self.stream is None:
+                self.stream = torch.cuda.Stream(device=latent.device)
+
+            with torch.cuda.stream(self.stream):
+                self.stream.wait_event(event)
+                # the copy was allocated on the sampling stream; keep the allocator from reusing its memory
+                # there until the decode on this stream is done with it
+                latent.record_stream(self.stream)
+                image = self.decode(latent, modules.sd_samplers_common)
+        else:
+            image = self.decode(latent, modules.sd_samplers_common)
+
+        decoded = time.perf_counter()
+
+        if shared.opts.live_previews_image_format == 'jpeg' and image.mode in ('RGBA', 'P'):
+            image = image.convert('RGB')
+        data_url = encode_live_preview(image)
+
+        encoded = time.perf_counter()
+
+        self.state.assign_current_image(image, data_url=data_url)
+
+        stats = self.state.preview_stats
+        stats["rendered"] += 1
+        stats["decode_time"] += decoded - started
+        stats["encode_time"] += encoded - decoded
+
+    def decode(self, latent, sd_samplers_common):
+        if shared.opts.show_progress_grid:
+            return sd_samplers_common.samples_to_image_grid(latent)
+
+        return sd_samplers_common.sample_to_image(latent)
+
+
 class State:
     skipped = False
     interrupted = False
@@ -24,6 +140,7 @@ class State:
     sampling_steps = 0
     current_latent = None
     current_image = None
+    current_image_data_url = None
     current_image_sampling_step = 0
     id_live_preview = 0
     textinfo = None
@@ -34,6 +151,13 @@ class State:
 
     def __init__(self):
         self.server_start = time.time()
+        self.preview_lock = threading.Lock()
+        self.preview_worker = LivePreviewWorker(self)
+        self.preview_stats = self.new_preview_stats()
+
+    @staticmethod
+    def new_preview_stats():
+        return {"rendered": 0, "dropped": 0, "decode_time": 0.0, "encode_time": 0.0}
 
     @property
     def need_restart(self) -> bool:
@@ -105,6 +229,7 @@ class State:
             "job_no": self.job_no,
             "sampling_step": self.sampling_step,
             "sampling_steps": self.sampling_steps,
+            "preview": dict(self.preview_stats),
         }
 
         return obj
@@ -118,8 +243,10 @@ class State:
         self.job_timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
         self.current_latent = None
         self.current_image = None
+        self.current_image_data_url = None
         self.current_image_sampling_step = 0
         self.id_live_preview = 0
+        self.preview_stats = self.new_preview_stats()
         self.skipped = False
         self.interrupted = False
         self.stopping_generation = False
@@ -131,14 +258,18 @@ class State:
     def end(self):
         duration = time.time() - self.time_start
         log.info("Ending job %s (%.2f seconds)", self.job, duration)
+
+        stats = self.preview_stats
+        if stats["rendered"]:
+            log.info("Live previews: %d rendered, %d dropped, %.2f ms decode and %.2f ms encode per preview", stats["rendered"], stats["dropped"], stats["decode_time"] * 1000 / stats["rendered"], stats["encode_time"] * 1000 / stats["rendered"])
+
         self.job = ""
         self.job_count = 0
 
         devices.torch_gc()
 
-    @torch.inference_mode()
     def set_current_image(self):
-        """if enough sampling steps have been made after the last call to this, sets self.current_image from self.current_latent, and modifies self.id_live_preview accordingly"""
+        """if enough sampling steps have been made after the last call to this, asks the preview worker to set self.current_image from self.current_latent, and modify self.id_live_preview accordingly"""
         if not shared.parallel_processing_allowed:
             return
 
@@ -147,7 +278,13 @@ class State:
 
     @torch.inference_mode()
     def do_set_current_image(self):
-        if self.current_latent is None:
+        latent = self.current_latent
+        if latent is None:
+            return
+
+        if shared.parallel_processing_allowed:
+            self.preview_worker.request(latent)
+            self.current_image_sampling_step = self.sampling_step
             return
 
         import modules.sd_samplers
@@ -168,8 +305,29 @@ class State:
             errors.record_exception()
 
     @torch.inference_mode()
-    def assign_current_image(self, image):
+    def assign_current_image(self, image, data_url=None):
         if shared.opts.live_previews_image_format == 'jpeg' and image.mode in ('RGBA', 'P'):
             image = image.convert('RGB')
-        self.current_image = image
-        self.id_live_preview += 1
+
+        with self.preview_lock:
+            self.current_image = image
+            self.current_image_data_url = data_url
+            self.id_live_preview += 1
+
+    def live_preview_data_url(self):
+        """Returns (data: URL of the current preview, its id); the URL is None if there is no preview."""
+
+        with self.preview_lock:
+            image, data_url, id_live_preview = self.current_image, self.current_image_data_url, self.id_live_preview
+
+        if image is None:
+            return None, id_live_preview
+
+        if data_url is None:
+            data_url = encode_live_preview(image)
+
+            with self.preview_lock:
+                if self.id_live_preview == id_live_preview:
+                    self.current_image_data_url = data_url
+
+        return data_url, id_live_preview
@@ -1,5 +1,7 @@
 import os
-from collections import namedtuple
+import functools
+import hashlib
+from collections import namedtuple, OrderedDict
 from contextlib import closing
 
 import torch
@@ -12,8 +14,9 @@ import safetensors.torch
 import numpy as np
 from PIL import Image, PngImagePlugin
 
-from modules import shared, devices, sd_hijack, sd_models, images, sd_samplers, sd_hijack_checkpoint, errors, hashes, cache
+from modules import shared, devices, sd_hijack, sd_models, images, sd_samplers, sd_hijack_checkpoint, errors, hashes, cache, prompt_parser
 import modules.textual_inversion.dataset
+from modules.file_index import file_index
 from modules.textual_inversion.learn_schedule import LearnRateScheduler
 
 from modules.textual_inversion.image_embedding import embedding_to_b64, embedding_from_b64, insert_image_data_embed, extract_image_data_embed, caption_image_overlay
@@ -36,9 +39,25 @@ def list_textual_inversion_templates():
     return textual_inversion_templates
 
 
+loaded_embeddings = OrderedDict()
+
+
+def remember_loaded(embedding):
+    """Marks a lazily loaded embedding as recently used; unloads the least recently used ones over textual_inversion_loaded_limit."""
+
+    loaded_embeddings[id(embedding)] = embedding
+    loaded_embeddings.move_to_end(id(embedding))
+
+    limit = shared.opts.textual_inversion_loaded_limit
+    while limit > 0 and len(loaded_embeddings) > limit:
+        _, embedding = loaded_embeddings.popitem(last=False)
+        embedding.unload()
+
+
 class Embedding:
     def __init__(self, vec, name, step=None):
-        self.vec = vec
+        self._vec = vec
+        self.loader = None
         self.name = name
         self.step = step
         self.shape = None
@@ -48,9 +67,33 @@ class Embedding:
         self.sd_checkpoint_name = None
         self.optimizer_state_dict = None
         self.filename = None
+        self.mtime = None
         self.hash = None
         self.shorthash = None
 
+    @property
+    def vec(self):
+        """Vectors of the embedding; if the embedding has a loader, they are read from disk when first needed."""
+
+        if self.loader is not None:
+            if self._vec is None:
+                self._vec = self.loader()
+            remember_loaded(self)
+
+        return self._vec
+
+    @vec.setter
+    def vec(self, value):
+        self._vec = value
+
+    def unload(self):
+        """Drops the vectors of a lazily loaded embedding; they are loaded again on next use."""
+
+        if self.loader is not None:
+            self._vec = None
+
+        loaded_embeddings.pop(id(self), None)
+
     def save(self, filename):
         embedding_data = {
             "string_to_token": {"*": 265},
@@ -87,6 +130,25 @@ class Embedding:
         self.hash = v
         self.shorthash = self.hash[0:12]
 
+    def read_hash(self, filename):
+        """Sets the hash of the embedding's file without waiting for it to be calculated; if it is not known yet, it's set once it's ready."""
+
+        title = "textual_inversion/" + self.name
+
+        self.set_hash(hashes.sha256(filename, title, wait=False) or '')
+        if self.hash:
+            return
+
+        future = hashes.sha256_async(filename, title)
+        if future is None:
+            return
+
+        def on_done(f):
+            if f.exception() is None:
+                self.set_hash(f.result() or '')
+
+        future.add_done_callback(on_done)
+
 
 class DirWithTextualInversionEmbeddings:
     def __init__(self, path):
@@ -116,7 +178,9 @@ class EmbeddingDatabase:
         self.expected_shape = -1
         self.embedding_dirs = {}
         self.previously_displayed_embeddings = ()
+        self.cache_key = ''
         self.image_embedding_cache = cache.cache('image-embedding')
+        self.catalogue = cache.cache('textual-inversion-catalogue')
 
     def add_embedding_dir(self, path):
         self.embedding_dirs[path] = DirWithTextualInversionEmbeddings(path)
@@ -127,8 +191,19 @@ class EmbeddingDatabase:
     def register_embedding(self, embedding, model):
         return self.register_embedding_by_name(embedding, model, embedding.name)
 
-    def register_embedding_by_name(self, embedding, model, name):
-        ids = model.cond_stage_model.tokenize([name])[0]
+    def register_embeddings(self, embeddings, model):
+        """Registers many embeddings at once, tokenizing all their names in a single call."""
+
+        if not embeddings:
+            return
+
+        all_ids = model.cond_stage_model.tokenize([x.name for x in embeddings])
+        for embedding, ids in zip(embeddings, all_ids):
+            self.register_embedding_by_name(embedding, model, embedding.name, ids=ids)
+
+    def register_embedding_by_name(self, embedding, model, name, ids=None):
+        if ids is None:
+            ids = model.cond_stage_model.tokenize([name])[0]
         first_id = ids[0]
         if first_id not in self.ids_lookup:
             self.ids_lookup[first_id] = []
@@ -176,53 +251,119 @@ class EmbeddingDatabase:
             errors.report(f"Error loading embedding {path}", exc_info=True)
         return None, None
 
-    def load_from_file(self, path, filename):
+    def read_embedding_data(self, path, filename):
+        """Reads the embedding file at path; returns (data, name), with data being None if the file is not an embedding."""
+
         name, ext = os.path.splitext(filename)
         ext = ext.upper()
 
         if ext in ['.PNG', '.WEBP', '.JXL', '.AVIF']:
             _, second_ext = os.path.splitext(name)
             if second_ext.upper() == '.PREVIEW':
-                return
+                return None, name
 
-            data, name = self.read_embedding_from_image(path, name)
-            if data is None:
-                return
+            return self.read_embedding_from_image(path, name)
         elif ext in ['.BIN', '.PT']:
-            data = torch.load(path, map_location="cpu")
+            return torch.load(path, map_location="cpu"), name
         elif ext in ['.SAFETENSORS']:
-            data = safetensors.torch.load_file(path, device="cpu")
+            return safetensors.torch.load_file(path, device="cpu"), name
+
+        return None, name
+
+    def read_embedding_vec(self, path, filename):
+        data, _ = self.read_embedding_data(path, filename)
+        vec, _, _ = embedding_vec_from_data(data, filename)
+        return vec
+
+    def read_from_file(self, path, filename):
+        """
+        Returns the Embedding for the file at path, or None if it's not an embedding.
+
+        Name, shape and other information about embeddings are kept in the "textual-inversion-catalogue" cache, so files
+        that have not changed since they were seen last are not read at all; their vectors are loaded when a prompt uses them.
+        The file is always stat'ed, rather than taken from the file index, because a file overwritten in place (e.g. by
+        training) does not change the mtime of its directory, and a stale entry would give the wrong number of vectors.
+        """
+
+        _, ext = os.path.splitext(filename)
+        if ext.upper() not in ['.PNG', '.WEBP', '.JXL', '.AVIF', '.BIN', '.PT', '.SAFETENSORS']:
+            return None
+
+        stat = os.stat(path)
+        if stat.st_size == 0:
+            return None
+
+        mtime = stat.st_mtime
+        size = stat.st_size
+
+        info = self.catalogue.get(path)
+        if info is not None and info['mtime'] == mtime and info.get('size') == size:
+            if info['name'] is None:
+                return None
+
+            embedding = Embedding(None, info['name'], step=info['step'])
+            embedding.sd_checkpoint = info['sd_checkpoint']
+            embedding.sd_checkpoint_name = info['sd_checkpoint_name']
+            embedding.vectors = info['vectors']
+            embedding.shape = info['shape']
+            embedding.filename = path
+            embedding.read_hash(path)
         else:
-            return
+            data, name = self.read_embedding_data(path, filename)
+            if data is None:
+                self.catalogue[path] = {'mtime': mtime, 'size': size, 'name': None}
+                return None
 
-        if data is not None:
             embedding = create_embedding_from_data(data, name, filename=filename, filepath=path)
+            self.catalogue[path] = {
+                'mtime': mtime,
+                'size': size,
+                'name': embedding.name,
+                'step': embedding.step,
+                'sd_checkpoint': embedding.sd_checkpoint,
+                'sd_checkpoint_name': embedding.sd_checkpoint_name,
+                'vectors': embedding.vectors,
+                'shape': embedding.shape,
+            }
 
-            if self.expected_shape == -1 or self.expected_shape == embedding.shape:
-                self.register_embedding(embedding, shared.sd_model)
-            else:
-                self.skipped_embeddings[name] = embedding
-        else:
-            print(f"Unable to load Textual inversion embedding due to data issue: '{name}'.")
+        embedding.mtime = mtime
+        embedding.loader = functools.partial(self.read_embedding_vec, path, filename)
+        if embedding._vec is not None:
+            remember_loaded(embedding)
+
+        return embedding
+
+    def load_from_file(self, path, filename):
+        embedding = self.read_from_file(path, filename)
+        if embedding is None:
+            return
 
+        if self.expected_shape == -1 or self.expected_shape == embedding.shape:
+            self.register_embedding(embedding, shared.sd_model)
+        else:
+            self.skipped_embeddings[embedding.name] = embedding
 
     def load_from_dir(self, embdir):
+        """Returns a list of embeddings found in embdir."""
+
         if not os.path.isdir(embdir.path):
-            return
+            return []
 
-        for root, _, fns in os.walk(embdir.path, followlinks=True):
+        embeddings = []
+        for root, _, fns in file_index.walk(embdir.path):
             for fn in fns:
                 try:
                     fullfn = os.path.join(root, fn)
 
-                    if os.stat(fullfn).st_size == 0:
-                        continue
-
-                    self.load_from_file(fullfn, fn)
+                    embedding = self.read_from_file(fullfn, fn)
+                    if embedding is not None:
+                        embeddings.append(embedding)
                 except Exception:
                     errors.report(f"Error loading embedding {fn}", exc_info=True)
                     continue
 
+        return embeddings
+
     def load_textual_inversion_embeddings(self, force_reload=False):
         if not force_reload:
             need_reload = False
@@ -239,16 +380,36 @@ class EmbeddingDatabase:
         self.skipped_embeddings.clear()
         self.expected_shape = self.get_expected_shape()
 
+        for embedding in list(loaded_embeddings.values()):
+            embedding.unload()
+
+        embeddings = []
         for embdir in self.embedding_dirs.values():
-            self.load_from_dir(embdir)
+            embeddings += self.load_from_dir(embdir)
             embdir.update()
 
+        matching = []
+        for embedding in embeddings:
+            if self.expected_shape == -1 or self.expected_shape == embedding.shape:
+                matching.append(embedding)
+            else:
+                self.skipped_embeddings[embedding.name] = embedding
+
+        self.register_embeddings(matching, shared.sd_model)
+
         # re-sort word_embeddings because load_from_dir may not load in alphabetic order.
         # using a temporary copy so we don't reinitialize self.word_embeddings in case other objects have a reference to it.
         sorted_word_embeddings = {e.name: e for e in sorted(self.word_embeddings.values(), key=lambda e: e.name.lower())}
         self.word_embeddings.clear()
         self.word_embeddings.update(sorted_word_embeddings)
 
+        # conditioning cached for prompts may refer to embeddings that have just changed
+        # a single digest rather than a tuple with an entry per embedding, since it goes into every cache key;
+        # mtimes are the ones the files had when they were just loaded
+        key = "\n".join(f"{e.name}\t{e.filename}\t{e.mtime}" for e in self.word_embeddings.values())
+        self.cache_key = hashlib.sha256(key.encode("utf8")).hexdigest()
+        prompt_parser.conditioning_cache.clear()
+
         displayed_embeddings = (tuple(self.word_embeddings.keys()), tuple(self.skipped_embeddings.keys()))
         if shared.opts.textual_inversion_print_at_load and self.previously_displayed_embeddings != displayed_embeddings:
             self.previously_displayed_embeddings = displayed_embeddings
@@ -298,7 +459,9 @@ def create_embedding(name, num_vectors_per_token, overwrite_old, init_text='*'):
     return fn
 
 
-def create_embedding_from_data(data, name, filename='unknown embedding file', filepath=None):
+def embedding_vec_from_data(data, filename='unknown embedding file'):
+    """Returns (vec, shape, vectors) for the contents of an embedding file."""
+
     if 'string_to_param' in data:  # textual inversion embeddings
         param_dict = data['string_to_param']
         param_dict = getattr(param_dict, '_parameters', param_dict)  # fix for torch 1.12.1 loading saved file from torch 1.11
@@ -323,6 +486,12 @@ def create_embedding_from_data(data, name, filename='unknown embedding file', fi
     else:
         raise Exception(f"Couldn't identify {filename} as neither textual inversion embedding nor diffuser concept.")
 
+    return vec, shape, vectors
+
+
+def create_embedding_from_data(data, name, filename='unknown embedding file', filepath=None):
+    vec, shape, vectors = embedding_vec_from_data(data, filename)
+
     embedding = Embedding(vec, name)
     embedding.step = data.get('step', None)
     embedding.sd_checkpoint = data.get('sd_checkpoint', None)
@@ -332,7 +501,7 @@ def create_embedding_from_data(data, name, filename='unknown embedding file', fi
 
     if filepath:
         embedding.filename = filepath
-        embedding.set_hash(hashes.sha256(filepath, "textual_inversion/" + name) or '')
+        embedding.read_hash(filepath)
 
     return embedding
 
@@ -450,6 +619,9 @@ def train_embedding(id_task, embedding_name, learn_rate, batch_size, gradient_st
     hijack = sd_hijack.model_hijack
 
     embedding = hijack.embedding_db.word_embeddings[embedding_name]
+    # keep the embedding being trained in memory; its vectors may not have been read from disk yet
+    embedding.vec = embedding.vec
+    embedding.loader = None
     checkpoint = sd_models.select_checkpoint()
 
     initial_step = embedding.step or 0
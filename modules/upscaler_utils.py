@@ -1,12 +1,12 @@
 import logging
-from typing import Callable
+from typing import Callable, Optional
 
 import numpy as np
 import torch
 import tqdm
 from PIL import Image
 
-from modules import devices, images, shared, torch_utils
+from modules import devices, shared, torch_utils
 
 logger = logging.getLogger(__name__)
 
@@ -62,30 +62,42 @@ def upscale_with_model(
         logger.debug("=> %s", output)
         return output
 
-    grid = images.split_grid(img, tile_size, tile_size, tile_overlap)
-    newtiles = []
-
-    with tqdm.tqdm(total=grid.tile_count, desc=desc, disable=not shared.opts.enable_upscale_progressbar) as p:
-        for y, h, row in grid.tiles:
-            newrow = []
-            for x, w, tile in row:
-                if shared.state.interrupted:
-                    return img
-                output = upscale_pil_patch(model, tile)
-                scale_factor = output.width // tile.width
-                newrow.append([x * scale_factor, w * scale_factor, output])
-                p.update(1)
-            newtiles.append([y * scale_factor, h * scale_factor, newrow])
-
-    newgrid = images.Grid(
-        newtiles,
-        tile_w=grid.tile_w * scale_factor,
-        tile_h=grid.tile_h * scale_factor,
-        image_w=grid.image_w * scale_factor,
-        image_h=grid.image_h * scale_factor,
-        overlap=grid.overlap * scale_factor,
-    )
-    return images.combine_grid(newgrid)
+    param = torch_utils.get_param(model)
+    tensor = pil_image_to_torch_bgr(img).to(dtype=param.dtype).unsqueeze(0)  # add batch dimension
+
+    with torch.inference_mode(), devices.without_autocast():
+        output = tiled_upscale_2(
+            tensor,
+            model,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+            scale=None,
+            desc=desc,
+            device=param.device,
+        )
+
+    if shared.state.interrupted:
+        return img
+
+    return torch_bgr_to_pil_image(output)
+
+
+def feather_window(size: int, overlap: int) -> torch.Tensor:
+    """
+    Returns a (size, size) blending window that ramps up linearly over `overlap` pixels at each edge.
+
+    Overlapping tiles are blended with these weights, so that seams fade out instead of showing as hard edges.
+    The window is never zero, so pixels covered by a single tile (e.g. at image borders) keep their value.
+    """
+
+    overlap = max(0, min(overlap, size // 2))
+    ramp = torch.ones(size)
+    if overlap > 0:
+        edge = torch.arange(1, overlap + 1, dtype=torch.float32) / (overlap + 1)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge.flip(0)
+
+    return ramp[:, None] * ramp[None, :]
 
 
 def tiled_upscale_2(
@@ -94,14 +106,17 @@ def tiled_upscale_2(
     *,
     tile_size: int,
     tile_overlap: int,
-    scale: int,
+    scale: Optional[int],
     device: torch.device,
     desc="Tiled upscale",
 ):
-    # Alternative implementation of `upscale_with_model` originally used by
-    # SwinIR and ScuNET.  It differs from `upscale_with_model` in that tiling and
-    # weighting is done in PyTorch space, as opposed to `images.Grid` doing it in
-    # Pillow space without weighting.
+    # Tiling engine shared by all upscalers: tiling and weighting is done in PyTorch space,
+    # which replaced the Pillow-space `images.Grid` tiling that had no weighting.
+    #
+    # Up to `upscale_tile_batch_size` tiles are run through the model in a single call, and overlapping
+    # tiles are blended with a feathered window. Blending happens on the CPU: while the model works on a
+    # batch of tiles, the previous batch is copied back and accumulated. If scale is None, it is inferred
+    # from the size of the model's output.
 
     b, c, h, w = img.size()
     tile_size = min(tile_size, h, w)
@@ -110,54 +125,69 @@ def tiled_upscale_2(
         logger.debug("Upscaling %s without tiling", img.shape)
         return model(img)
 
+    tile_overlap = max(0, min(tile_overlap, tile_size - 1))
     stride = tile_size - tile_overlap
     h_idx_list = list(range(0, h - tile_size, stride)) + [h - tile_size]
     w_idx_list = list(range(0, w - tile_size, stride)) + [w - tile_size]
-    result = torch.zeros(
-        b,
-        c,
-        h * scale,
-        w * scale,
-        device=device,
-        dtype=img.dtype,
-    )
-    weights = torch.zeros_like(result)
-    logger.debug("Upscaling %s to %s with tiles", img.shape, result.shape)
-    with tqdm.tqdm(total=len(h_idx_list) * len(w_idx_list), desc=desc, disable=not shared.opts.enable_upscale_progressbar) as pbar:
-        for h_idx in h_idx_list:
+    positions = [(h_idx, w_idx) for h_idx in h_idx_list for w_idx in w_idx_list]
+    tile_batch_size = max(1, int(getattr(shared.opts, "upscale_tile_batch_size", 1) or 1))
+
+    use_events = torch.device(device).type == "cuda"
+    result = None
+    weights = None
+    window = None
+
+    def accumulate(pending):
+        nonlocal result, weights, window, scale
+
+        batch_positions, out_patches, event = pending
+        if event is not None:
+            event.synchronize()
+
+        if scale is None:
+            scale = out_patches.shape[-1] // tile_size
+
+        if result is None:
+            result = torch.zeros(b, c, h * scale, w * scale, dtype=torch.float32)
+            weights = torch.zeros(h * scale, w * scale, dtype=torch.float32)
+            window = feather_window(tile_size * scale, tile_overlap * scale)
+            logger.debug("Upscaling %s to %s with tiles", img.shape, result.shape)
+
+        out_patches = out_patches.float().view(len(batch_positions), b, c, tile_size * scale, tile_size * scale)
+        for (h_idx, w_idx), out_patch in zip(batch_positions, out_patches):
+            area = (..., slice(h_idx * scale, (h_idx + tile_size) * scale), slice(w_idx * scale, (w_idx + tile_size) * scale))
+            result[area].add_(out_patch * window)
+            weights[area[1:]].add_(window)
+
+    pending = None
+    with tqdm.tqdm(total=len(positions), desc=desc, disable=not shared.opts.enable_upscale_progressbar) as pbar:
+        for i in range(0, len(positions), tile_batch_size):
             if shared.state.interrupted or shared.state.skipped:
                 break
 
-            for w_idx in w_idx_list:
-                if shared.state.interrupted or shared.state.skipped:
-                    break
-
-                # Only move this patch to the device if it's not already there.
-                in_patch = img[
-                    ...,
-                    h_idx : h_idx + tile_size,
-                    w_idx : w_idx + tile_size,
-                ].to(device=device)
+            batch_positions = positions[i:i + tile_batch_size]
+            in_patches = torch.cat([img[..., h_idx:h_idx + tile_size, w_idx:w_idx + tile_size] for h_idx, w_idx in batch_positions]).to(device=device)
 
-                out_patch = model(in_patch)
+            out_patches = model(in_patches).to(device="cpu", non_blocking=use_events)
+            event = None
+            if use_events:
+                event = torch.cuda.Event()
+                event.record()
 
-                result[
-                    ...,
-                    h_idx * scale : (h_idx + tile_size) * scale,
-                    w_idx * scale : (w_idx + tile_size) * scale,
-                ].add_(out_patch)
+            if pending is not None:
+                accumulate(pending)
+            pending = (batch_positions, out_patches, event)
 
-                out_patch_mask = torch.ones_like(out_patch)
+            pbar.update(len(batch_positions))
 
-                weights[
-                    ...,
-                    h_idx * scale : (h_idx + tile_size) * scale,
-                    w_idx * scale : (w_idx + tile_size) * scale,
-                ].add_(out_patch_mask)
+    if pending is not None:
+        accumulate(pending)
 
-                pbar.update(1)
+    if result is None:
+        return img
 
-    output = result.div_(weights)
+    # blending is done on the CPU in float32; return the result where and how the model produced it, like before
+    output = result.div_(weights).to(device=device, dtype=img.dtype)
 
     return output
 
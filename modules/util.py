@@ -2,6 +2,7 @@ import os
 import re
 
 from modules import shared
+from modules.file_index import file_index
 from modules.paths_internal import script_path, cwd
 
 
@@ -35,7 +36,7 @@ def walk_files(path, allowed_extensions=None):
     if allowed_extensions is not None:
         allowed_extensions = set(allowed_extensions)
 
-    items = list(os.walk(path, followlinks=True))
+    items = list(file_index.walk(path))
     items = sorted(items, key=lambda x: natural_sort_key(x[0]))
 
     for root, _, files in items:
@@ -76,8 +77,8 @@ class MassFileListerCachedDir:
         self.files_cased = None
         self.dirname = dirname
 
-        stats = ((x.name, x.stat(follow_symlinks=False)) for x in os.scandir(self.dirname))
-        files = [(n, s.st_mtime, s.st_ctime) for n, s in stats]
+        indexed = file_index.listdir(self.dirname)
+        files = [(name, mtime, ctime) for name, _, mtime, ctime in indexed.files.values()] if indexed is not None else []
         self.files = {x[0].lower(): x for x in files}
         self.files_cased = {x[0]: x for x in files}
 
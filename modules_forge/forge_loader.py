@@ -504,7 +504,7 @@ def load_model_for_a1111(timer, checkpoint_info=None, state_dict=None):
         raise NotImplementedError('Bad Clip Class Name:' + type(sd_model.cond_stage_model).__name__)
 
     timer.record("forge set components")
-    sd_model_hash = checkpoint_info.calculate_shorthash()
+    sd_model_hash = checkpoint_info.calculate_shorthash(wait=False)
     timer.record("calculate hash")
 
     if getattr(sd_model, 'parameterization', None) == 'v':
@@ -3,66 +3,127 @@
 # By using one single thread to process all major calls, model moving is significantly faster.
 
 
+import concurrent.futures
 import time
 import traceback
 import threading
 
+from modules import metrics
+
 
 lock = threading.Lock()
+condition = threading.Condition(lock)
 last_id = 0
 waiting_list = []
-finished_list = []
+current_task = None
+
 
+class Task(concurrent.futures.Future):
+    """
+    A call to be made on the main thread; also a future for its result.
+
+    Tasks that have not started yet can be cancelled with cancel(). created, started and finished are
+    time.perf_counter() values, set as the task moves through the queue.
+    """
 
-class Task:
     def __init__(self, task_id, func, args, kwargs):
+        super().__init__()
         self.task_id = task_id
         self.func = func
         self.args = args
         self.kwargs = kwargs
-        self.result = None
+        self.created = time.perf_counter()
+        self.started = None
+        self.finished = None
+
+    @property
+    def name(self):
+        return getattr(self.func, "__name__", repr(self.func))
+
+    @property
+    def wait_time(self):
+        """Seconds the task waited in the queue, so far if it has not started yet."""
+
+        return (self.started or time.perf_counter()) - self.created
+
+    @property
+    def run_time(self):
+        """Seconds the task has been running, or ran for; None if it has not started."""
+
+        if self.started is None:
+            return None
+
+        return (self.finished or time.perf_counter()) - self.started
 
     def work(self):
-        self.result = self.func(*self.args, **self.kwargs)
+        if not self.set_running_or_notify_cancel():
+            return
+
+        self.started = time.perf_counter()
+        metrics.main_thread_wait.observe(self.started - self.created)
+
+        try:
+            result = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            print(e)
+            self.finished = time.perf_counter()
+            self.set_exception(e)
+        else:
+            self.finished = time.perf_counter()
+            self.set_result(result)
 
 
 def loop():
-    global lock, last_id, waiting_list, finished_list
+    global current_task
+
     while True:
-        time.sleep(0.01)
-        if len(waiting_list) > 0:
-            with lock:
-                task = waiting_list.pop(0)
-            try:
-                task.work()
-            except Exception as e:
-                traceback.print_exc()
-                print(e)
-            with lock:
-                finished_list.append(task)
+        with condition:
+            while not waiting_list:
+                condition.wait()
 
+            task = waiting_list.pop(0)
+            current_task = task
 
-def async_run(func, *args, **kwargs):
-    global lock, last_id, waiting_list, finished_list
-    with lock:
+        try:
+            task.work()
+        finally:
+            with condition:
+                current_task = None
+
+
+def submit(func, *args, **kwargs) -> Task:
+    """Queues func(*args, **kwargs) to run on the main thread and returns its Task."""
+
+    global last_id
+
+    with condition:
         last_id += 1
         new_task = Task(task_id=last_id, func=func, args=args, kwargs=kwargs)
         waiting_list.append(new_task)
-    return new_task.task_id
+        condition.notify()
+
+    return new_task
+
+
+def async_run(func, *args, **kwargs):
+    return submit(func, *args, **kwargs).task_id
 
 
 def run_and_wait_result(func, *args, **kwargs):
-    global lock, last_id, waiting_list, finished_list
-    current_id = async_run(func, *args, **kwargs)
-    while True:
-        time.sleep(0.01)
-        finished_task = None
-        for t in finished_list.copy():  # thread safe shallow copy without needing a lock
-            if t.task_id == current_id:
-                finished_task = t
-                break
-        if finished_task is not None:
-            with lock:
-                finished_list.remove(finished_task)
-            return finished_task.result
+    """Runs func on the main thread and waits for it; if it raises, the error is printed and None is returned."""
+
+    task = submit(func, *args, **kwargs)
+
+    try:
+        return task.result()
+    except (Exception, concurrent.futures.CancelledError):
+        return None
+
+
+def queued_tasks():
+    """Returns a snapshot of the running task (or None) and the list of tasks waiting to run, in order."""
+
+    with condition:
+        return current_task, list(waiting_list)
 
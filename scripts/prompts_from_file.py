@@ -5,7 +5,7 @@ import shlex
 import modules.scripts as scripts
 import gradio as gr
 
-from modules import sd_samplers, errors, sd_models
+from modules import sd_samplers, errors, sd_models, resumable_jobs
 from modules.processing import Processed, process_images
 from modules.shared import state
 
@@ -130,6 +130,8 @@ class Script(scripts.Script):
     def run(self, p, checkbox_iterate, checkbox_iterate_batch, prompt_position, prompt_txt: str):
         lines = [x for x in (x.strip() for x in prompt_txt.splitlines()) if x]
 
+        manifest = resumable_jobs.JobManifest("prompts_from_file", resumable_jobs.processing_params(p))
+
         p.do_not_save_grid = True
 
         job_count = 0
@@ -151,14 +153,25 @@ class Script(scripts.Script):
 
         print(f"Will process {len(lines)} lines in {job_count} jobs.")
         if (checkbox_iterate or checkbox_iterate_batch) and p.seed == -1:
-            p.seed = int(random.randrange(4294967294))
+            p.seed = manifest.value("seed", lambda: int(random.randrange(4294967294)))
 
-        state.job_count = job_count
+        state.job_count = job_count - sum(args.get("n_iter", p.n_iter) for i, args in enumerate(jobs) if manifest.is_done(str(i)))
 
         images = []
         all_prompts = []
         infotexts = []
-        for args in jobs:
+        for i, args in enumerate(jobs):
+            if manifest.is_done(str(i)):
+                entry = manifest.load(str(i))
+                images += entry["images"]
+                all_prompts += entry["all_prompts"]
+                infotexts += entry["infotexts"]
+
+                if checkbox_iterate:
+                    p.seed = p.seed + (p.batch_size * p.n_iter)
+
+                continue
+
             state.job = f"{state.job_no + 1} out of {state.job_count}"
 
             copy_p = copy.copy(p)
@@ -183,9 +196,16 @@ class Script(scripts.Script):
             proc = process_images(copy_p)
             images += proc.images
 
+            if proc.images:
+                manifest.save(str(i), proc.images, proc.infotexts, proc.all_prompts, proc.all_seeds, proc.index_of_first_image)
+            else:
+                manifest.failed = True
+
             if checkbox_iterate:
                 p.seed = p.seed + (p.batch_size * p.n_iter)
             all_prompts += proc.all_prompts
             infotexts += proc.infotexts
 
+        manifest.finish()
+
         return Processed(p, images, p.seed, "", all_prompts=all_prompts, infotexts=infotexts)
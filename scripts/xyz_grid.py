@@ -1,6 +1,6 @@
 from collections import namedtuple
 from copy import copy
-from itertools import permutations, chain
+from itertools import permutations, chain, product
 import random
 import csv
 import os.path
@@ -8,11 +8,12 @@ from io import StringIO
 from PIL import Image
 import numpy as np
 import gc
+import json
 
 import modules.scripts as scripts
 import gradio as gr
 
-from modules import images, sd_samplers, processing, sd_models, sd_vae, sd_schedulers, errors
+from modules import images, sd_samplers, processing, sd_models, sd_vae, sd_schedulers, errors, resumable_jobs, extra_networks
 from modules.processing import process_images, Processed, StableDiffusionProcessingTxt2Img
 from modules.shared import opts, state
 import modules.shared as shared
@@ -213,7 +214,7 @@ def csv_string_to_list_strip(data_str):
 
 
 class AxisOption:
-    def __init__(self, label, type, apply, format_value=format_value_add_label, confirm=None, cost=0.0, choices=None, prepare=None):
+    def __init__(self, label, type, apply, format_value=format_value_add_label, confirm=None, cost=0.0, choices=None, prepare=None, batchable=False):
         self.label = label
         self.type = type
         self.apply = apply
@@ -222,6 +223,7 @@ class AxisOption:
         self.cost = cost
         self.prepare = prepare
         self.choices = choices
+        self.batchable = batchable  # only changes fields processing accepts per image (prompts and seeds), so cells differing in it can share a batch
 
 
 class AxisOptionImg2Img(AxisOption):
@@ -238,15 +240,15 @@ class AxisOptionTxt2Img(AxisOption):
 
 axis_options = [
     AxisOption("Nothing", str, do_nothing, format_value=format_nothing),
-    AxisOption("Seed", int, apply_field("seed")),
-    AxisOption("Var. seed", int, apply_field("subseed")),
+    AxisOption("Seed", int, apply_field("seed"), batchable=True),
+    AxisOption("Var. seed", int, apply_field("subseed"), batchable=True),
     AxisOption("Var. strength", float, apply_field("subseed_strength")),
     AxisOption("Steps", int, apply_field("steps")),
     AxisOptionTxt2Img("Hires steps", int, apply_field("hr_second_pass_steps")),
     AxisOption("CFG Scale", float, apply_field("cfg_scale")),
     AxisOptionImg2Img("Image CFG Scale", float, apply_field("image_cfg_scale")),
-    AxisOption("Prompt S/R", str, apply_prompt, format_value=format_value),
-    AxisOption("Prompt order", str_permutations, apply_order, format_value=format_value_join_list),
+    AxisOption("Prompt S/R", str, apply_prompt, format_value=format_value, batchable=True),
+    AxisOption("Prompt order", str_permutations, apply_order, format_value=format_value_join_list, batchable=True),
     AxisOptionTxt2Img("Sampler", str, apply_field("sampler_name"), format_value=format_value, confirm=confirm_samplers, choices=lambda: [x.name for x in sd_samplers.samplers if x.name not in opts.hide_samplers]),
     AxisOptionTxt2Img("Hires sampler", str, apply_field("hr_sampler_name"), confirm=confirm_samplers, choices=lambda: [x.name for x in sd_samplers.samplers_for_img2img if x.name not in opts.hide_samplers]),
     AxisOptionImg2Img("Sampler", str, apply_field("sampler_name"), format_value=format_value, confirm=confirm_samplers, choices=lambda: [x.name for x in sd_samplers.samplers_for_img2img if x.name not in opts.hide_samplers]),
@@ -286,7 +288,7 @@ axis_options = [
 ]
 
 
-def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend, draw_individual_labels, include_lone_images, include_sub_grids, first_axes_processed, second_axes_processed, margin_size):
+def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend, draw_individual_labels, include_lone_images, include_sub_grids, first_axes_processed, second_axes_processed, margin_size, cell_image_path=None):
     hor_texts = [[images.GridAnnotation(x)] for x in x_labels]
     ver_texts = [[images.GridAnnotation(y)] for y in y_labels]
     title_texts = [[images.GridAnnotation(z)] for z in z_labels]
@@ -374,13 +376,21 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
             processed_result.all_prompts[idx] = processed.prompt
             processed_result.all_seeds[idx] = processed.seed
             processed_result.infotexts[idx] = processed.infotexts[0]
+
+            # if the cell's image is saved on disk, keep only its filename, and read it back when the grid is assembled
+            if cell_image_path is not None and process_image is processed.images[0]:
+                processed_result.images[idx] = cell_image_path(x, y, z, ix, iy, iz) or process_image
         else:
             cell_mode = "P"
             cell_size = (processed_result.width, processed_result.height)
-            if processed_result.images[0] is not None:
-                cell_mode = processed_result.images[0].mode
+            first_image = processed_result.images[0]
+            if isinstance(first_image, str):
+                images.wait_for_background_saves()
+                first_image = images.read(first_image)
+            if first_image is not None:
+                cell_mode = first_image.mode
                 # This corrects size in case of batches:
-                cell_size = processed_result.images[0].size
+                cell_size = first_image.size
             processed_result.images[idx] = Image.new(cell_mode, cell_size)
 
     if first_axes_processed == 'x':
@@ -423,12 +433,15 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
 
     z_count = len(zs)
 
+    if any(isinstance(img, str) for img in processed_result.images):
+        images.wait_for_background_saves()
+
     for i in range(z_count):
         start_index = (i * len(xs) * len(ys)) + i
         end_index = start_index + len(xs) * len(ys)
         grid = images.image_grid(processed_result.images[start_index:end_index], rows=len(ys))
         if draw_legend:
-            grid_max_w, grid_max_h = map(max, zip(*(img.size for img in processed_result.images[start_index:end_index])))
+            grid_max_w, grid_max_h = map(max, zip(*(images.image_size(img) for img in processed_result.images[start_index:end_index])))
             grid = images.draw_grid_annotations(grid, grid_max_w, grid_max_h, hor_texts, ver_texts, margin_size)
         processed_result.images.insert(i, grid)
         processed_result.all_prompts.insert(i, processed_result.all_prompts[start_index])
@@ -445,6 +458,136 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
     return processed_result
 
 
+def split_processed(processed, index):
+    """Returns a Processed for the index-th image of a batch, as if it was generated on its own; None if there is no such image."""
+
+    first = processed.index_of_first_image
+    images = processed.images[first:]
+    if index >= len(images):
+        return None
+
+    res = copy(processed)
+    res.images = [images[index]]
+    res.infotexts = processed.infotexts[first + index:first + index + 1]
+
+    for field in ["all_prompts", "all_negative_prompts", "all_seeds", "all_subseeds"]:
+        values = getattr(processed, field) or []
+        setattr(res, field, values[index:index + 1] or values[:1])
+
+    res.prompt = res.all_prompts[0]
+    res.negative_prompt = res.all_negative_prompts[0]
+    res.seed = res.all_seeds[0]
+    res.subseed = res.all_subseeds[0]
+    res.batch_size = 1
+    res.index_of_first_image = 0
+
+    return res
+
+
+class CellBatcher:
+    """
+    A cell function for draw_xyz_grid that generates cells which only differ in batchable axes (like seed or prompt S/R)
+    together, up to max_batch_size at a time.
+
+    draw_xyz_grid still asks for cells one by one in the order picked by AxisOption.cost; the first request for a cell
+    generates its whole batch with run_batch, and results of the other cells in the batch are kept until they are asked for.
+
+    If key is given, it is called with a cell's (x, y, z, ix, iy, iz), and only cells with equal keys are put into one batch.
+    """
+
+    def __init__(self, run_batch, axes, max_batch_size, skip=None, key=None):
+        self.run_batch = run_batch
+        self.axes = axes
+        self.max_batch_size = max_batch_size
+        self.skip = skip
+        self.key = key
+        self.keys = {}
+        self.results = {}
+        self.done = set()
+
+    def group(self, indices):
+        group = tuple(None if opt.batchable else index for (opt, _), index in zip(self.axes, indices))
+
+        if self.key is not None:
+            if indices not in self.keys:
+                (_, xs), (_, ys), (_, zs) = self.axes
+                ix, iy, iz = indices
+                self.keys[indices] = json.dumps(self.key(xs[ix], ys[iy], zs[iz], ix, iy, iz), default=str)
+
+            group += (self.keys[indices], )
+
+        return group
+
+    def batch_for(self, indices):
+        group = self.group(indices)
+        batch = [indices]
+
+        (_, xs), (_, ys), (_, zs) = self.axes
+        for iz, iy, ix in product(range(len(zs)), range(len(ys)), range(len(xs))):
+            if len(batch) >= self.max_batch_size:
+                break
+
+            other = (ix, iy, iz)
+            if other == indices or other in self.done or self.group(other) != group:
+                continue
+
+            if self.skip is not None and self.skip(xs[ix], ys[iy], zs[iz], ix, iy, iz):
+                continue
+
+            batch.append(other)
+
+        return batch
+
+    def __call__(self, x, y, z, ix, iy, iz):
+        indices = (ix, iy, iz)
+
+        if indices not in self.results:
+            (_, xs), (_, ys), (_, zs) = self.axes
+            batch = self.batch_for(indices)
+            cells = [(xs[i], ys[j], zs[k], i, j, k) for i, j, k in batch]
+
+            for key, res in zip(batch, self.run_batch(cells)):
+                self.results[key] = res
+
+            self.done.update(batch)
+
+        return self.results.pop(indices)
+
+
+def cell_key(x, y, z, ix, iy, iz):
+    return json.dumps([ix, iy, iz, x, y, z], default=str)
+
+
+class ResumableCells:
+    """
+    A cell function for draw_xyz_grid that saves finished cells to the job manifest, and loads cells finished by an
+    earlier run of the same job from there instead of generating them again.
+    """
+
+    def __init__(self, manifest, p, cell):
+        self.manifest = manifest
+        self.p = p
+        self.cell = cell
+
+    def __call__(self, x, y, z, ix, iy, iz):
+        key = cell_key(x, y, z, ix, iy, iz)
+
+        if self.manifest.is_done(key):
+            entry = self.manifest.load(key)
+            res = Processed(self.p, entry["images"], entry["all_seeds"][0], entry["infotexts"][0], all_prompts=entry["all_prompts"], all_seeds=entry["all_seeds"], infotexts=entry["infotexts"], index_of_first_image=entry["index_of_first_image"])
+            res.prompt = entry["all_prompts"][0]
+            return res
+
+        res = self.cell(x, y, z, ix, iy, iz)
+
+        if res.images:
+            self.manifest.save(key, res.images, res.infotexts, res.all_prompts, res.all_seeds, res.index_of_first_image)
+        else:
+            self.manifest.failed = True
+
+        return res
+
+
 class SharedSettingsStackHelper(object):
     def __enter__(self):
         pass
@@ -619,8 +762,11 @@ class Script(scripts.Script):
         no_fixed_seeds, vary_seeds_x, vary_seeds_y, vary_seeds_z, margin_size, csv_mode):
         x_type, y_type, z_type = x_type or 0, y_type or 0, z_type or 0  # if axle type is None set to 0
 
+        manifest = resumable_jobs.JobManifest("xyz_grid", resumable_jobs.processing_params(p))
+
         if not no_fixed_seeds:
             modules.processing.fix_seed(p)
+            p.seed, p.subseed = manifest.value("seeds", lambda: [p.seed, p.subseed])
 
         if not opts.return_grid:
             p.batch_size = 1
@@ -719,16 +865,16 @@ class Script(scripts.Script):
         grid_mp = round(len(xs) * len(ys) * len(zs) * p.width * p.height / 1000000)
         assert grid_mp < opts.img_max_size_mp, f'Error: Resulting grid would be too large ({grid_mp} MPixels) (max configured size is {opts.img_max_size_mp} MPixels)'
 
-        def fix_axis_seeds(axis_opt, axis_list):
+        def fix_axis_seeds(axis_opt, axis_list, name):
             if axis_opt.label in ['Seed', 'Var. seed']:
-                return [int(random.randrange(4294967294)) if val is None or val == '' or val == -1 else val for val in axis_list]
+                return manifest.value(name, lambda: [int(random.randrange(4294967294)) if val is None or val == '' or val == -1 else val for val in axis_list])
             else:
                 return axis_list
 
         if not no_fixed_seeds:
-            xs = fix_axis_seeds(x_opt, xs)
-            ys = fix_axis_seeds(y_opt, ys)
-            zs = fix_axis_seeds(z_opt, zs)
+            xs = fix_axis_seeds(x_opt, xs, "xs")
+            ys = fix_axis_seeds(y_opt, ys, "ys")
+            zs = fix_axis_seeds(z_opt, zs, "zs")
 
         if x_opt.label == 'Steps':
             total_steps = sum(xs) * len(ys) * len(zs)
@@ -787,12 +933,9 @@ class Script(scripts.Script):
             else:
                 second_axes_processed = 'y'
 
-        grid_infotext = [None] * (1 + len(zs))
+        grid_infotext = manifest.value("grid_infotext", lambda: [None] * (1 + len(zs)))
 
-        def cell(x, y, z, ix, iy, iz):
-            if shared.state.interrupted or state.stopping_generation:
-                return Processed(p, [], p.seed, "")
-            
+        def prepare_cell(x, y, z, ix, iy, iz):
             pc = copy(p)
             pc.styles = pc.styles[:]
             x_opt.apply(pc, x, xs)
@@ -807,81 +950,77 @@ class Script(scripts.Script):
                 pc.seed += iy * xdim
             if vary_seeds_z:
                 pc.seed += iz * xdim * ydim
+
+            return pc
+
+        def label_cell(res, x, y, z, ix, iy, iz):
+            # If draw_individual_labels is enabled, save the labeled image immediately
+            if draw_individual_labels and res.images:
+                # Create a copy of the image and add labels
+                labeled_image = res.images[0].copy()
+                label = f"X: {x_opt.format_value(p, x_opt, x)}\nY: {y_opt.format_value(p, y_opt, y)}\nZ: {z_opt.format_value(p, z_opt, z)}"
                 
-            try:
-                res = process_images(pc)
+                # Draw label directly here instead of using a separate method
+                from PIL import ImageDraw, ImageFont
+                draw = ImageDraw.Draw(labeled_image)
+                try:
+                    font = ImageFont.truetype("arial.ttf", 20)
+                except:
+                    font = ImageFont.load_default()
                 
-                # If draw_individual_labels is enabled, save the labeled image immediately
-                if draw_individual_labels and res.images:
-                    # Create a copy of the image and add labels
-                    labeled_image = res.images[0].copy()
-                    label = f"X: {x_opt.format_value(p, x_opt, x)}\nY: {y_opt.format_value(p, y_opt, y)}\nZ: {z_opt.format_value(p, z_opt, z)}"
-                    
-                    # Draw label directly here instead of using a separate method
-                    from PIL import ImageDraw, ImageFont
-                    draw = ImageDraw.Draw(labeled_image)
+                margin = 10
+                lines = label.split('\n')
+                max_width = 0
+                total_height = 0
+                
+                # Calculate total size needed for all lines
+                for line in lines:
                     try:
-                        font = ImageFont.truetype("arial.ttf", 20)
-                    except:
-                        font = ImageFont.load_default()
-                    
-                    margin = 10
-                    lines = label.split('\n')
-                    max_width = 0
-                    total_height = 0
-                    
-                    # Calculate total size needed for all lines
-                    for line in lines:
-                        try:
-                            left, top, right, bottom = draw.textbbox((margin, margin), line, font=font)
-                            width = right - left
-                            height = bottom - top
-                        except AttributeError:
-                            width = len(line) * 10
-                            height = 20
-                            
-                        max_width = max(max_width, width)
-                        total_height += height
+                        left, top, right, bottom = draw.textbbox((margin, margin), line, font=font)
+                        width = right - left
+                        height = bottom - top
+                    except AttributeError:
+                        width = len(line) * 10
+                        height = 20
+                        
+                    max_width = max(max_width, width)
+                    total_height += height
 
-                    # Draw background rectangle for all lines
-                    draw.rectangle([(margin, margin), (margin + max_width, margin + total_height)], fill='black')
-                    
-                    # Draw each line of text
-                    current_height = margin
-                    for line in lines:
-                        draw.text((margin, current_height), line, fill='white', font=font)
-                        try:
-                            left, top, right, bottom = draw.textbbox((margin, margin), line, font=font)
-                            height = bottom - top
-                        except AttributeError:
-                            height = 20
-                        current_height += height
-                    
-                    # Generate a unique filename based on coordinates
-                    filename = f"xyz_grid_x{ix}_y{iy}_z{iz}"
-                    
-                    # Save the labeled image
-                    if opts.grid_save:
-                        images.save_image(
-                            labeled_image,
-                            p.outpath_grids,
-                            filename,
-                            info=res.infotexts[0],
-                            extension=opts.grid_format,
-                            prompt=res.all_prompts[0],
-                            seed=res.all_seeds[0],
-                            grid=False,
-                            p=res
-                        )
-                    
-                    # Use the labeled image for the grid
-                    res.images[0] = labeled_image
-                    
-            except Exception as e:
-                errors.display(e, "generating image for xyz plot")
-                res = Processed(p, [], p.seed, "")
+                # Draw background rectangle for all lines
+                draw.rectangle([(margin, margin), (margin + max_width, margin + total_height)], fill='black')
+                
+                # Draw each line of text
+                current_height = margin
+                for line in lines:
+                    draw.text((margin, current_height), line, fill='white', font=font)
+                    try:
+                        left, top, right, bottom = draw.textbbox((margin, margin), line, font=font)
+                        height = bottom - top
+                    except AttributeError:
+                        height = 20
+                    current_height += height
+                
+                # Generate a unique filename based on coordinates
+                filename = f"xyz_grid_x{ix}_y{iy}_z{iz}"
+                
+                # Save the labeled image
+                if opts.grid_save:
+                    images.save_image(
+                        labeled_image,
+                        p.outpath_grids,
+                        filename,
+                        info=res.infotexts[0],
+                        extension=opts.grid_format,
+                        prompt=res.all_prompts[0],
+                        seed=res.all_seeds[0],
+                        grid=False,
+                        p=res
+                    )
+                
+                # Use the labeled image for the grid
+                res.images[0] = labeled_image
 
-            # Rest of the original cell function code...
+        def record_grid_infotext(pc, ix, iy, iz, position_in_batch=0):
             subgrid_index = 1 + iz
             if grid_infotext[subgrid_index] is None and ix == 0 and iy == 0:
                 pc.extra_generation_params = copy(pc.extra_generation_params)
@@ -896,7 +1035,7 @@ class Script(scripts.Script):
                     pc.extra_generation_params["Y Values"] = y_values
                     if y_opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
                         pc.extra_generation_params["Fixed Y Values"] = ", ".join([str(y) for y in ys])
-                grid_infotext[subgrid_index] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds)
+                grid_infotext[subgrid_index] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds, position_in_batch=position_in_batch)
 
             if grid_infotext[0] is None and ix == 0 and iy == 0 and iz == 0:
                 pc.extra_generation_params = copy(pc.extra_generation_params)
@@ -905,11 +1044,112 @@ class Script(scripts.Script):
                     pc.extra_generation_params["Z Values"] = z_values
                     if z_opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
                         pc.extra_generation_params["Fixed Z Values"] = ", ".join([str(z) for z in zs])
-                grid_infotext[0] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds)
-            
+                grid_infotext[0] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds, position_in_batch=position_in_batch)
+
+        def cell(x, y, z, ix, iy, iz):
+            if shared.state.interrupted or state.stopping_generation:
+                return Processed(p, [], p.seed, "")
+
+            pc = prepare_cell(x, y, z, ix, iy, iz)
+
+            try:
+                res = process_images(pc)
+                label_cell(res, x, y, z, ix, iy, iz)
+            except Exception as e:
+                errors.display(e, "generating image for xyz plot")
+                res = Processed(p, [], p.seed, "")
+
+            record_grid_infotext(pc, ix, iy, iz)
+
             return res
 
-        with SharedSettingsStackHelper():
+        def cell_batch(cells):
+            """Generates images for cells that only differ in batchable axes with one process_images call; returns a Processed for each cell."""
+
+            nonlocal total_steps
+
+            if len(cells) == 1:
+                return [cell(*cells[0])]
+
+            if shared.state.interrupted or state.stopping_generation:
+                return [Processed(p, [], p.seed, "") for _ in cells]
+
+            pcs = [prepare_cell(*c) for c in cells]
+
+            pb = copy(pcs[0])
+            pb.prompt = [pc.prompt for pc in pcs]
+            pb.negative_prompt = [pc.negative_prompt for pc in pcs]
+            pb.seed = [processing.get_fixed_seed(pc.seed) for pc in pcs]
+            pb.subseed = [processing.get_fixed_seed(pc.subseed) for pc in pcs]
+            pb.batch_size = len(cells)
+            pb.n_iter = 1
+            pb.do_not_save_grid = True
+
+            # job count and total steps were calculated for one process_images call per cell; the batch is one call,
+            # so the other cells in it are taken out. With hires fix, processing has already doubled the job count.
+            batched_cells = len(cells) - 1
+            cell_steps = pb.steps
+            if isinstance(pb, StableDiffusionProcessingTxt2Img) and pb.enable_hr:
+                cell_steps += pb.hr_second_pass_steps or pb.steps
+
+            state.job_count -= batched_cells * (2 if state.processing_has_refined_job_count else 1)
+            total_steps -= batched_cells * cell_steps
+            shared.total_tqdm.updateTotal(total_steps)
+
+            try:
+                processed = process_images(pb)
+            except Exception as e:
+                errors.display(e, "generating images for xyz plot")
+                return [Processed(p, [], p.seed, "") for _ in cells]
+
+            results = []
+            for position_in_batch, (x, y, z, ix, iy, iz) in enumerate(cells):
+                res = split_processed(processed, position_in_batch) or Processed(p, [], p.seed, "")
+
+                try:
+                    label_cell(res, x, y, z, ix, iy, iz)
+                except Exception as e:
+                    errors.display(e, "labeling image for xyz plot")
+
+                record_grid_infotext(pb, ix, iy, iz, position_in_batch=position_in_batch)
+                results.append(res)
+
+            return results
+
+        def cell_extra_networks(x, y, z, ix, iy, iz):
+            """
+            Returns the extra networks used by the cell's prompts. Extra networks of a batch are taken from its first
+            prompt, so cells can only share a batch if these are equal (Prompt S/R over Lora weights is a common plot).
+            Cells in a batch only differ in batchable axes, so only those are applied here.
+            """
+
+            pc = copy(p)
+            for opt, value, values in [(x_opt, x, xs), (y_opt, y, ys), (z_opt, z, zs)]:
+                if opt.batchable:
+                    opt.apply(pc, value, values)
+
+            return extra_networks.extra_networks_key(pc.prompt, pc.negative_prompt, getattr(pc, "hr_prompt", ""), getattr(pc, "hr_negative_prompt", ""))
+
+        # cells are only sampled together if each of them would otherwise be a single image
+        max_batch_size = opts.xyz_grid_max_batch_size if p.batch_size == 1 and p.n_iter == 1 else 1
+
+        def grid_cell(xs, ys, zs):
+            """Returns the cell function for a grid with these axis values; it generates cells in batches where it can."""
+
+            axes = [(x_opt, xs), (y_opt, ys), (z_opt, zs)]
+            if max_batch_size <= 1 or not any(opt.batchable and len(values) > 1 for opt, values in axes):
+                return ResumableCells(manifest, p, cell)
+
+            batcher = CellBatcher(cell_batch, axes, max_batch_size, skip=lambda *args: manifest.is_done(cell_key(*args)), key=cell_extra_networks)
+            return ResumableCells(manifest, p, batcher)
+
+        def cell_image_path(x, y, z, ix, iy, iz):
+            return manifest.image_path(cell_key(x, y, z, ix, iy, iz))
+
+        # with images of finished cells saved by the manifest, the grid does not need to keep them all in memory
+        release_cell_images = cell_image_path if manifest.enabled and not include_lone_images else None
+
+        with SharedSettingsStackHelper(), manifest:
             if items_per_grid > 0 and not skip_grid:
                 items_per_grid = max(1, int(items_per_grid))
                 
@@ -939,14 +1179,15 @@ class Script(scripts.Script):
                             'x_labels': [x_opt.format_value(p, x_opt, x) for x in (chunk if main_axis == 'x' else xs)],
                             'y_labels': [y_opt.format_value(p, y_opt, y) for y in (chunk if main_axis == 'y' else ys)],
                             'z_labels': [z_opt.format_value(p, z_opt, z) for z in (chunk if main_axis == 'z' else zs)],
-                            'cell': cell,
+                            'cell': grid_cell(chunk if main_axis == 'x' else xs, chunk if main_axis == 'y' else ys, chunk if main_axis == 'z' else zs),
                             'draw_legend': draw_legend,
                             'draw_individual_labels': draw_individual_labels,
                             'include_lone_images': include_lone_images,
                             'include_sub_grids': include_sub_grids,
                             'first_axes_processed': first_axes_processed,
                             'second_axes_processed': second_axes_processed,
-                            'margin_size': margin_size
+                            'margin_size': margin_size,
+                            'cell_image_path': release_cell_images,
                         }
                         
                         chunk_processed = draw_xyz_grid(**grid_args)
@@ -1021,6 +1262,7 @@ class Script(scripts.Script):
                 
                 total = len(xs) * len(ys) * len(zs)
                 done = 0
+                skip_grid_cell = grid_cell(xs, ys, zs)
                 
                 for iz, z in enumerate(zs):
                     for iy, y in enumerate(ys):
@@ -1028,7 +1270,7 @@ class Script(scripts.Script):
                             if state.interrupted:
                                 break
                                 
-                            proc = cell(x, y, z, ix, iy, iz)
+                            proc = skip_grid_cell(x, y, z, ix, iy, iz)
                             if proc.images:
                                 processed.images.extend(proc.images)
                                 processed.infotexts.extend(proc.infotexts)
@@ -1064,14 +1306,15 @@ class Script(scripts.Script):
                     x_labels=[x_opt.format_value(p, x_opt, x) for x in xs],
                     y_labels=[y_opt.format_value(p, y_opt, y) for y in ys],
                     z_labels=[z_opt.format_value(p, z_opt, z) for z in zs],
-                    cell=cell,
+                    cell=grid_cell(xs, ys, zs),
                     draw_legend=draw_legend,
                     draw_individual_labels=draw_individual_labels,
                     include_lone_images=include_lone_images,
                     include_sub_grids=include_sub_grids,
                     first_axes_processed=first_axes_processed,
                     second_axes_processed=second_axes_processed,
-                    margin_size=margin_size
+                    margin_size=margin_size,
+                    cell_image_path=release_cell_images,
                 )
 
                 if not processed.images:
@@ -0,0 +1,26 @@
+from modules.api import batching
+
+
+def test_requests_differing_in_prompt_share_a_batch():
+    a = batching.batch_key({"prompt": "a cat", "seed": 1, "steps": 20})
+    b = batching.batch_key({"prompt": "a dog", "seed": 2, "steps": 20})
+
+    assert a == b
+
+
+def test_requests_with_different_loras_are_not_batched_together():
+    a = batching.batch_key({"prompt": "a cat <lora:foo:0.5>", "steps": 20})
+    b = batching.batch_key({"prompt": "a cat <lora:bar:0.5>", "steps": 20})
+    c = batching.batch_key({"prompt": "a dog <lora:foo:1.0>", "steps": 20})
+    d = batching.batch_key({"prompt": "a dog <lora:foo:0.5>", "steps": 20})
+
+    assert a != b
+    assert a != c
+    assert a == d
+
+
+def test_hires_prompt_loras_are_part_of_the_key():
+    a = batching.batch_key({"prompt": "a cat", "hr_prompt": "a cat <lora:foo:1>", "steps": 20})
+    b = batching.batch_key({"prompt": "a cat", "hr_prompt": "a cat", "steps": 20})
+
+    assert a != b
@@ -0,0 +1,55 @@
+import pytest
+
+from modules import prompt_parser
+
+
+@pytest.fixture
+def prompts():
+    # what an X/Y/Z plot or a wildcards job looks like: many prompts that share most of their text
+    styles = ["(masterpiece:1.2)", "[sketch:watercolor:0.4]", "[cat|dog] portrait", "(detailed:1.1), [blurry]"]
+    return [f"a photo of a house, {styles[i % len(styles)]}, variant {i % 50}" for i in range(5000)]
+
+
+def test_schedules_are_cached(prompts):
+    prompt_parser.parsed_prompt_schedule.cache_clear()
+
+    first = prompt_parser.get_learned_conditioning_prompt_schedules(prompts, 20, 30)
+    cold = prompt_parser.parsed_prompt_schedule.cache_info()
+
+    second = prompt_parser.get_learned_conditioning_prompt_schedules(prompts, 20, 30)
+    warm = prompt_parser.parsed_prompt_schedule.cache_info()
+
+    assert first == second
+    assert cold.misses == len(set(prompts))
+    assert warm.misses == cold.misses
+    assert warm.hits > cold.hits
+
+
+def test_schedules_depend_on_steps():
+    assert prompt_parser.get_learned_conditioning_prompt_schedules(["a [b:c:0.5]"], 10) == [[[5, "a b"], [10, "a c"]]]
+    assert prompt_parser.get_learned_conditioning_prompt_schedules(["a [b:c:0.5]"], 20) == [[[10, "a b"], [20, "a c"]]]
+
+
+def test_cached_schedules_are_not_shared():
+    schedule = prompt_parser.get_learned_conditioning_prompt_schedules(["a [b:c:3]"], 10)[0]
+    schedule[0][1] = "changed"
+
+    assert prompt_parser.get_learned_conditioning_prompt_schedules(["a [b:c:3]"], 10)[0] == [[3, "a b"], [10, "a c"]]
+
+
+def test_attention_is_cached(prompts):
+    prompt_parser.parsed_prompt_attention.cache_clear()
+
+    first = [prompt_parser.parse_prompt_attention(prompt) for prompt in prompts]
+    cold = prompt_parser.parsed_prompt_attention.cache_info()
+
+    second = [prompt_parser.parse_prompt_attention(prompt) for prompt in prompts]
+    warm = prompt_parser.parsed_prompt_attention.cache_info()
+
+    assert first == second
+    assert cold.misses == len(set(prompts))
+    assert warm.misses == cold.misses
+    assert warm.hits - cold.hits == len(prompts)
+
+    first[0][0][1] = 100.0
+    assert prompt_parser.parse_prompt_attention(prompts[0]) == second[0]